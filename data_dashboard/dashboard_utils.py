@@ -131,15 +131,15 @@ ORDER BY date DESC
 def fetch_data(period):
     end = datetime.date.today()
     start = end - datetime.timedelta(days=period)
-    # Select the first row for each cluster label
+    # Select the first row for each cluster label, the latest point of every cluster comes from cluster_summary
     clusterquery = f"""
 WITH rank AS (
     SELECT 
         t.cluster_label,
-        tdj.date,
-        tdj.time,
-        tdj.latitude,
-        tdj.longitude,
+        cs.date,
+        cs.time,
+        cs.latitude,
+        cs.longitude,
         w.elevation_meters_asl AS elevation,
         w.temperature_2m AS temperature,
         w.relative_humidity_2m AS relative_humidity,
@@ -147,10 +147,10 @@ WITH rank AS (
         w.precipitation,
         t.tag,
         ca.country,
-        ROW_NUMBER() OVER(PARTITION BY t.cluster_label ORDER BY tdj.date DESC, tdj.time DESC) AS rn
+        ROW_NUMBER() OVER(PARTITION BY t.cluster_label ORDER BY cs.date DESC, cs.time DESC) AS rn
     FROM tags AS t 
-    INNER JOIN tile_data_john AS tdj 
-        ON t.cluster_label = tdj.cluster_label
+    INNER JOIN cluster_summary AS cs 
+        ON t.cluster_label = cs.cluster_label
     INNER JOIN weather AS w
         ON t."index" = w."index"
     INNER JOIN cluster_address as ca
@@ -158,7 +158,7 @@ WITH rank AS (
     WHERE 
         t.tag NOT IN ('street_address','plus_code','route','premise','subpremise','establishment','point_of_interest')
         AND
-        tdj.date BETWEEN '{start}' AND '{end}'
+        cs.date BETWEEN '{start}' AND '{end}'
 )
 
 SELECT
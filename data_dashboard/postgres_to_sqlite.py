@@ -29,7 +29,7 @@ query = f"""
 SELECT
     datetime,
     date,
-    time,
+    to_char(datetime AT TIME ZONE 'UTC', 'HH24:MI:SS') AS time, -- UTC like date, not the session time zone
     latitude,
     longitude,
     cluster_label
@@ -75,4 +75,19 @@ LIMIT {limit};
 """
 df = pd.read_sql(query, con=conn)
 df.to_sql('cluster_address', sqlite_conn, if_exists='replace', index=True)
-print('saved cluster_address to sqlite')
\ No newline at end of file
+print('saved cluster_address to sqlite')
+
+# latest point of every cluster, replaces a window over tile_data_john in the dashboard
+query = f"""
+SELECT
+    cluster_label,
+    (to_timestamp(last_seen / 1000.0) AT TIME ZONE 'UTC')::date AS date,
+    to_char(to_timestamp(last_seen / 1000.0) AT TIME ZONE 'UTC', 'HH24:MI:SS') AS time,
+    last_latitude AS latitude,
+    last_longitude AS longitude
+FROM cluster_summary
+LIMIT {limit};
+"""
+df = pd.read_sql(query, con=conn)
+df.to_sql('cluster_summary', sqlite_conn, if_exists='replace', index=True)
+print('saved cluster_summary to sqlite')
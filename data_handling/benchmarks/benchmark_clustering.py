@@ -0,0 +1,59 @@
+# Third Party Imports
+from sklearn.metrics import adjusted_rand_score
+import pandas as pd
+import numpy as np
+
+# Native Imports
+from pathlib import Path
+import warnings
+import time
+import sys
+
+# Custom Imports
+sys.path.append(str(Path(__file__).resolve().parents[1])) # data_handling/
+from data_utils.utils import cluster_data
+
+"""
+Benchmark for the HDBSCAN metric. Builds synthetic trips of growing size (stays with a few meters of GPS
+jitter, joined by noisy transit legs, spread over several continents) and times cluster_data with the
+haversine metric (ball tree) against the unit-sphere chord metric (kd-tree), reporting the label agreement
+
+Usage: python data_handling/benchmarks/benchmark_clustering.py [n_points ...]
+"""
+
+# rough centres of the regions the trip goes through, [latitude, longitude]
+REGIONS = np.array([[40.0, -105.0], [48.9, 2.3], [13.75, 100.5], [-33.9, 151.2], [64.1, -21.9]])
+
+
+def make_trip(n_points: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Synthetic trip of about n_points locations, 80% of them at stays and the rest in transit between stays
+    """
+    rng = np.random.default_rng(seed)
+    n_stays = max(n_points // 300, 2)
+    stays = REGIONS[rng.integers(len(REGIONS), size=n_stays)] + rng.uniform(-1, 1, (n_stays, 2))
+    points = []
+    for i, size in enumerate(rng.multinomial(int(n_points * 0.8), np.ones(n_stays) / n_stays)):
+        points.append(stays[i] + rng.normal(0, 4e-5, (size, 2))) # ~4 m of jitter
+        if i + 1 < n_stays:
+            steps = np.linspace(0, 1, int(n_points * 0.2 / n_stays))[:, None]
+            points.append(stays[i] + (stays[i + 1] - stays[i]) * steps + rng.normal(0, 1e-4, (len(steps), 2)))
+    points = np.concatenate(points)
+    return pd.DataFrame({'latitude': points[:, 0], 'longitude': points[:, 1]})
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [2_500, 5_000, 10_000, 20_000]
+    warnings.filterwarnings('ignore', category=FutureWarning)
+
+    for n_points in sizes:
+        df = make_trip(n_points)
+        start = time.time()
+        _, haversine_labels = cluster_data(df, metric='haversine')
+        haversine_time = time.time() - start
+        start = time.time()
+        _, chord_labels = cluster_data(df, metric='chord')
+        chord_time = time.time() - start
+        print(f"{len(df):>7} points: haversine {haversine_time:.3f} seconds, chord {chord_time:.3f} seconds, "
+              f"speedup {haversine_time / chord_time:.2f}x, ARI {adjusted_rand_score(haversine_labels, chord_labels):.4f}, "
+              f"{len(set(haversine_labels)) - 1} / {len(set(chord_labels)) - 1} clusters")
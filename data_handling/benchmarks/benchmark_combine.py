@@ -0,0 +1,75 @@
+# Third Party Imports
+import numpy as np
+
+# Native Imports
+from pathlib import Path
+import tempfile
+import json
+import time
+import sys
+import os
+
+# Custom Imports
+sys.path.append(str(Path(__file__).resolve().parents[1])) # data_handling/
+from data_utils.utils import parse_raw_files
+from data_utils.raw_store import RawWriter, list_raw_files
+
+"""
+Benchmark for parsing the raw files with a process pool. Builds a synthetic raw folder (daily snapshots plus
+per-date partitions for several tiles) and times parse_raw_files for 1 to N workers
+
+Usage: python data_handling/benchmarks/benchmark_combine.py [n_snapshots] [updates_per_tile]
+"""
+
+TILE_UUIDS = ['0287c8181aa557e7', '02df4813aa180c3a', '06c5863b0ea97d00', '06e9828702df2f1f']
+TILE_UUID = '06c5863b0ea97d00'
+
+
+def make_updates(rng: np.random.Generator, n: int, start_ts: int) -> list:
+    """
+    Random location updates one minute apart, shaped like the Tile history response
+    """
+    lat = 13.75 + np.cumsum(rng.normal(0, 1e-3, n))
+    lon = 100.5 + np.cumsum(rng.normal(0, 1e-3, n))
+    return [{'location_timestamp': start_ts + i * 60_000, 'latitude': float(lat[i]), 'longitude': float(lon[i]),
+             'raw_precision': float(rng.uniform(5, 50)), 'precision': float(rng.uniform(5, 50)),
+             'client_type': 'ios', 'tile_uuid': TILE_UUID} for i in range(n)]
+
+
+def make_raw_folder(datapath: Path, n_snapshots: int, updates_per_tile: int) -> None:
+    """
+    Write n_snapshots daily snapshots and a month of partitions for every tile
+    """
+    rng = np.random.default_rng(0)
+    start_ts = 1727740800000 # 2024-10-01
+    for i in range(n_snapshots):
+        snapshot = {uuid: {'result': {'location_updates': make_updates(rng, updates_per_tile, start_ts)}}
+                    for uuid in TILE_UUIDS}
+        with open(datapath / f"data_2024-10-{i + 1:02d}.json", 'w') as f:
+            json.dump(snapshot, f)
+    writer = RawWriter(datapath)
+    for uuid in TILE_UUIDS:
+        writer.write(uuid, make_updates(rng, 30 * 1440, start_ts))
+
+
+if __name__ == '__main__':
+    n_snapshots = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    updates_per_tile = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        datapath = Path(tmpdir)
+        print(f"Writing {n_snapshots} snapshots with {updates_per_tile} updates per tile...")
+        make_raw_folder(datapath, n_snapshots, updates_per_tile)
+        files = list_raw_files(datapath, [TILE_UUID])
+        size_mb = sum(file.stat().st_size for file in files) / 1e6
+        print(f"{len(files)} raw files, {size_mb:.1f} MB")
+
+        n_workers_list = sorted({1, 2, 4, 8, os.cpu_count()} & set(range(1, os.cpu_count() + 1)))
+        baseline = None
+        for n_workers in n_workers_list:
+            start = time.time()
+            batches = parse_raw_files(files, [TILE_UUID], n_workers=n_workers)
+            elapsed = time.time() - start
+            baseline = baseline or elapsed
+            n_rows = sum(len(batch['location_timestamp']) for batch in batches)
+            print(f"n_workers={n_workers:>2}: {elapsed:.3f} seconds, {n_rows} rows, speedup {baseline / elapsed:.2f}x")
@@ -0,0 +1,94 @@
+# Third Party Imports
+import googlemaps
+import numpy as np
+
+# Native Imports
+from pathlib import Path
+import tempfile
+import time
+import sys
+
+# Custom Imports
+sys.path.append(str(Path(__file__).resolve().parents[1])) # data_handling/
+sys.path.append(str(Path(__file__).resolve().parent)) # benchmarks/
+from data_utils.geocode_engine import TokenBucket, geocode_concurrent, load_checkpoint
+from stub_geocode_server import StubGeocodeServer
+
+"""
+Benchmark for reverse geocoding against the local stub server (fixed latency, quota enforced with
+OVER_QUERY_LIMIT). Times the original sequential loop (one request, then a .02 second sleep) against
+geocode_concurrent with the shared token bucket, and checks that an interrupted run resumes from its
+checkpoint without requesting the saved responses again
+
+Usage: python data_handling/benchmarks/benchmark_geocode.py [n_clusters] [latency_s] [queries_per_second]
+"""
+
+
+def make_client(server: StubGeocodeServer) -> googlemaps.Client:
+    """
+    Client pointed at the stub server, OVER_QUERY_LIMIT is left to geocode_engine
+    """
+    return googlemaps.Client(key='AIzaStubKey', base_url=server.base_url, retry_over_query_limit=False)
+
+
+if __name__ == '__main__':
+    n_clusters = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency_s = float(sys.argv[2]) if len(sys.argv) > 2 else 0.08
+    queries_per_second = float(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    server = StubGeocodeServer(latency_s=latency_s, queries_per_second=queries_per_second)
+    server.start()
+    client = make_client(server)
+    rng = np.random.default_rng(0)
+    coordinates = {str(i): (float(lat), float(lon))
+                   for i, (lat, lon) in enumerate(rng.uniform([-60, -180], [60, 180], (n_clusters, 2)))}
+
+    start = time.time()
+    sequential = {}
+    for cluster_label, latlng in coordinates.items():
+        sequential[cluster_label] = client.reverse_geocode(latlng)
+        time.sleep(.02)
+    sequential_time = time.time() - start
+    print(f"sequential: {n_clusters} clusters in {sequential_time:.2f} seconds "
+          f"({n_clusters / sequential_time:.1f} requests per second)")
+
+    for n_workers in [4, 8, 16]:
+        server.n_requests, server.n_refused = 0, 0
+        time.sleep(1) # let the server's quota window clear
+        start = time.time()
+        results = geocode_concurrent(client, coordinates, TokenBucket(rate=queries_per_second * 0.95), n_workers=n_workers)
+        elapsed = time.time() - start
+        assert results == sequential
+        print(f"{n_workers:>2} workers: {elapsed:.2f} seconds ({n_clusters / elapsed:.1f} requests per second), "
+              f"speedup {sequential_time / elapsed:.2f}x, {server.n_refused} refused")
+
+    # a limiter set above the quota gets refused, the retries still recover every response
+    server.n_requests, server.n_refused = 0, 0
+    time.sleep(1)
+    start = time.time()
+    results = geocode_concurrent(client, coordinates, TokenBucket(rate=queries_per_second * 3), n_workers=16)
+    assert results == sequential
+    print(f"limiter at 3x the quota: {time.time() - start:.2f} seconds, {server.n_refused} refused and retried")
+
+    # interrupt a run half way, then resume it from the checkpoint
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint_path = str(Path(tmp) / 'checkpoint.jsonl')
+
+        def interrupt(cluster_label, lat, lon, response):
+            if len(load_checkpoint(checkpoint_path)) >= n_clusters // 2:
+                raise KeyboardInterrupt
+
+        time.sleep(1)
+        try:
+            geocode_concurrent(client, coordinates, TokenBucket(rate=queries_per_second * 0.95), n_workers=8,
+                               checkpoint_path=checkpoint_path, on_result=interrupt)
+        except KeyboardInterrupt:
+            pass
+        saved = len(load_checkpoint(checkpoint_path))
+        server.n_requests, server.n_refused = 0, 0
+        results = geocode_concurrent(client, coordinates, TokenBucket(rate=queries_per_second * 0.95), n_workers=8,
+                                     checkpoint_path=checkpoint_path)
+        assert results == sequential
+        print(f"resumed after {saved} checkpointed responses, {server.n_requests - server.n_refused} answered on resume")
+
+    server.shutdown()
@@ -0,0 +1,119 @@
+# Native Imports
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from collections import deque
+import threading
+import json
+import time
+import sys
+
+"""
+Local stand-in for the GoogleMaps Geocoding API, for testing and benchmarking the geocoder without paying
+for requests. Answers /maps/api/geocode/json with a response shaped like Google's after a fixed latency,
+and refuses requests above the quota with OVER_QUERY_LIMIT, like the real API. Point a client at it with
+googlemaps.Client(key='AIza...', base_url='http://127.0.0.1:<port>')
+
+Usage: python data_handling/benchmarks/stub_geocode_server.py [port] [latency_s] [queries_per_second]
+"""
+
+
+def make_response(lat: float, lon: float) -> list:
+    """
+    Google-shaped reverse geocoding results for a coordinate, addresses derived from the coordinate
+    """
+    street_number = str(int(abs(lat * 1e4)) % 1000)
+    route = f"Stub Street {int(abs(lon * 1e3)) % 100}"
+    components = [{'long_name': street_number, 'short_name': street_number, 'types': ['street_number']},
+                  {'long_name': route, 'short_name': route, 'types': ['route']},
+                  {'long_name': 'Stubville', 'short_name': 'Stubville', 'types': ['locality', 'political']},
+                  {'long_name': 'Stub State', 'short_name': 'ST', 'types': ['administrative_area_level_1', 'political']},
+                  {'long_name': 'Stubland', 'short_name': 'SL', 'types': ['country', 'political']}]
+    return [{'address_components': components,
+             'formatted_address': f"{street_number} {route}, Stubville, ST, Stubland",
+             'geometry': {'location': {'lat': lat, 'lng': lon}, 'location_type': 'ROOFTOP'},
+             'place_id': f"stub_{lat:.5f}_{lon:.5f}",
+             'types': ['street_address']}]
+
+
+class StubGeocodeServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering reverse geocoding requests
+
+    Attributes
+    ----------
+    latency_s : float
+        delay before every answer, stands in for the round trip to Google
+    queries_per_second : float
+        requests accepted in any one second window, the rest get OVER_QUERY_LIMIT
+    n_requests : int
+        requests received
+    n_refused : int
+        requests refused with OVER_QUERY_LIMIT
+    """
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency_s: float = 0.08, queries_per_second: float = 50):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.latency_s = latency_s
+        self.queries_per_second = queries_per_second
+        self.n_requests = 0
+        self.n_refused = 0
+        self._sent_times = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> None:
+        """
+        Serve from a background thread
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def admit(self) -> bool:
+        """
+        Whether a request fits in the quota of the last second
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.n_requests += 1
+            while self._sent_times and now - self._sent_times[0] >= 1:
+                self._sent_times.popleft()
+            if len(self._sent_times) >= self.queries_per_second:
+                self.n_refused += 1
+                return False
+            self._sent_times.append(now)
+            return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/maps/api/geocode/json':
+            self.send_error(404)
+            return
+        time.sleep(self.server.latency_s)
+        if self.server.admit():
+            lat, lon = (float(x) for x in parse_qs(url.query)['latlng'][0].split(','))
+            body = {'status': 'OK', 'results': make_response(lat, lon)}
+        else:
+            body = {'status': 'OVER_QUERY_LIMIT', 'results': [], 'error_message': 'You have exceeded your rate-limit'}
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    latency_s = float(sys.argv[2]) if len(sys.argv) > 2 else 0.08
+    queries_per_second = float(sys.argv[3]) if len(sys.argv) > 3 else 50
+    server = StubGeocodeServer(port, latency_s, queries_per_second)
+    print(f"Serving stub geocoding API on {server.base_url}")
+    server.serve_forever()
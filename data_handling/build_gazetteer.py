@@ -0,0 +1,30 @@
+# Native Imports
+import sys
+
+# Custom Imports
+from data_utils.gazetteer import Gazetteer
+
+"""
+Build the offline gazetteer used by reverse_geocode to answer coarse clusters without the GoogleMaps API.
+Run once (and again whenever the source data is updated), it is not part of the DAG. Download first:
+
+    https://download.geonames.org/export/dump/cities1000.zip          (unzip to cities1000.txt)
+    https://download.geonames.org/export/dump/admin1CodesASCII.txt
+    https://download.geonames.org/export/dump/countryInfo.txt
+    Natural Earth 1:50m Admin 0 - Countries, as GeoJSON (ne_50m_admin_0_countries.geojson)
+
+Usage: python data_handling/build_gazetteer.py [source folder]
+"""
+
+# Variables
+SOURCEPATH = '/opt/data/gazetteer_sources/'
+GAZETTEERPATH = '/opt/data/state/gazetteer/'
+
+if __name__ == '__main__':
+    source_path = sys.argv[1] if len(sys.argv) > 1 else SOURCEPATH
+    Gazetteer.build(GAZETTEERPATH,
+                    cities_path=source_path + 'cities1000.txt',
+                    admin1_path=source_path + 'admin1CodesASCII.txt',
+                    country_info_path=source_path + 'countryInfo.txt',
+                    countries_geojson_path=source_path + 'ne_50m_admin_0_countries.geojson')
+    print(f"Successfully saved gazetteer: '{GAZETTEERPATH}'")
@@ -1,6 +1,19 @@
 from .utils import *
 from .geocoder import *
+from .geocode_cache import *
+from .geocode_engine import *
+from .geocode_tables import *
+from .gazetteer import *
 from .weather_api import *
+from .watermarks import *
+from .tile_api import *
+from .raw_store import *
+from .raw_parser import *
+from .location_store import *
+from .feature_store import *
+from .cluster_index import *
+from .cluster_artifact import *
+from .cluster_registry import *
 
 # Print message to know things import properly
 print('hello from data_utils/__init__.py')
\ No newline at end of file
@@ -0,0 +1,149 @@
+# Third Party Imports
+import pyarrow as pa
+import pandas as pd
+import numpy as np
+
+# Native Imports
+from pathlib import Path
+
+# Custom Imports
+from .utils import cluster_summary, haversine_m
+
+# Bump whenever the columns of either table change, artifacts of another version are refused
+ARTIFACT_VERSION = 1
+
+
+class ClusterArtifact():
+    """
+    Class holding the result of a clustering run in place of the pickled HDBSCAN estimator, which keeps every
+    training point and internal tree. Two uncompressed Arrow IPC files, which memory-map without a copy:
+
+        clusters.arrow : one row per cluster, ['cluster_label','centroid_latitude','centroid_longitude',
+                         'radius_m','count','first_seen','last_seen','exemplar_latitude','exemplar_longitude']
+        members.arrow  : one row per clustered point, ['latitude','longitude'] in radians, 'cluster_label' and
+                         'core_distance' (only written when core distances are given), used for assignment
+
+    Attributes
+    ----------
+    path : pathlib.Path
+        directory holding the two files
+    n_exemplars : int
+        number of members closest to the centroid kept as exemplars of every cluster
+
+    Methods
+    -------
+    write(df, labels, core_distances)
+        summarize the clusters and write the artifact
+    clusters()
+        read the cluster table as a DataFrame
+    members()
+        read the member table as a pyarrow Table backed by the memory-mapped file
+    exists()
+        whether the artifact has been written
+    """
+    def __init__(self, path: str, n_exemplars: int = 5):
+        """
+        Initialize ClusterArtifact
+
+        Parameters
+        -----------
+        path : str
+            directory holding the artifact, created on first write
+        n_exemplars : int [optional]
+            number of exemplar points kept per cluster
+
+        Returns
+        -----------
+        None
+        """
+        self.path = Path(path)
+        self.n_exemplars = n_exemplars
+
+    def write(self, df: pd.DataFrame, labels: np.ndarray, core_distances: np.ndarray = None) -> None:
+        """
+        Summarize every cluster and write the artifact. Noise and special labels (< 0) are left out
+
+        Parameters
+        -----------
+        df : pd.DataFrame
+            the clustered points, contains ['location_timestamp','latitude','longitude']
+        labels : np.ndarray
+            cluster label of every row of df
+        core_distances : np.ndarray [optional]
+            core distance of every row of df, in the units of the assignment index. Without it no member table
+            is written
+
+        Returns
+        -----------
+        None
+        """
+        labels = np.asarray(labels)
+        clustered = labels >= 0
+        clusters = cluster_summary(df, labels)
+        clusters = clusters[clusters['cluster_label'] >= 0].sort_values('cluster_label').set_index('cluster_label')
+        points = pd.DataFrame({'cluster_label': labels[clustered],
+                               'latitude': df['latitude'].values[clustered],
+                               'longitude': df['longitude'].values[clustered]})
+
+        # distance of every member to its centroid gives the bounding radius and picks the exemplars
+        centroids = clusters.loc[points['cluster_label'], ['centroid_latitude', 'centroid_longitude']].values
+        points['distance_m'] = haversine_m(points['latitude'].values, points['longitude'].values,
+                                           centroids[:, 0], centroids[:, 1])
+        clusters['radius_m'] = points.groupby('cluster_label', sort=True)['distance_m'].max()
+        exemplars = (points.sort_values(['cluster_label', 'distance_m'])
+                           .groupby('cluster_label', sort=True).head(self.n_exemplars)
+                           .groupby('cluster_label', sort=True))
+        clusters['exemplar_latitude'] = exemplars['latitude'].agg(list)
+        clusters['exemplar_longitude'] = exemplars['longitude'].agg(list)
+        clusters = clusters.reset_index()[['cluster_label', 'centroid_latitude', 'centroid_longitude', 'radius_m',
+                                           'count', 'first_seen', 'last_seen',
+                                           'exemplar_latitude', 'exemplar_longitude']]
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._write_table('clusters.arrow', pa.Table.from_pandas(clusters, preserve_index=False))
+        if core_distances is not None:
+            members = pa.table({'latitude': np.deg2rad(points['latitude'].values),
+                                'longitude': np.deg2rad(points['longitude'].values),
+                                'cluster_label': points['cluster_label'].values.astype(np.int64),
+                                'core_distance': np.asarray(core_distances)[clustered]})
+            self._write_table('members.arrow', members)
+
+    def clusters(self) -> pd.DataFrame:
+        """
+        Read the cluster table, one row per cluster
+        """
+        return self._read_table('clusters.arrow').to_pandas()
+
+    def members(self) -> pa.Table:
+        """
+        Read the member table. The columns are views of the memory-mapped file, .to_numpy() doesn't copy them
+        """
+        return self._read_table('members.arrow')
+
+    def exists(self) -> bool:
+        """
+        Whether a cluster table has been written
+        """
+        return (self.path / 'clusters.arrow').exists()
+
+    def _write_table(self, name: str, table: pa.Table) -> None:
+        """
+        Write a table with the artifact version in its schema metadata, through a temporary file
+        """
+        table = table.replace_schema_metadata({'artifact_version': str(ARTIFACT_VERSION)})
+        tmp_path = self.path / f"{name}.tmp"
+        with pa.OSFile(str(tmp_path), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        tmp_path.replace(self.path / name)
+
+    def _read_table(self, name: str) -> pa.Table:
+        """
+        Memory-map a table, raises ValueError if it was written by another artifact version
+        """
+        table = pa.ipc.open_file(pa.memory_map(str(self.path / name), 'r')).read_all()
+        version = (table.schema.metadata or {}).get(b'artifact_version', b'').decode()
+        if version != str(ARTIFACT_VERSION):
+            raise ValueError(f"{self.path / name} is artifact version '{version}', expected '{ARTIFACT_VERSION}'")
+        return table
+
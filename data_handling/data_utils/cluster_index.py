@@ -0,0 +1,373 @@
+# Third Party Imports
+import pandas as pd
+import numpy as np
+from sklearn.neighbors import BallTree, KDTree
+
+# Native Imports
+from datetime import datetime, timedelta
+from pathlib import Path
+import json
+
+# Custom Imports
+from .utils import EARTH_RADIUS_M, cluster_data, to_unit_sphere, detect_stays
+from .cluster_artifact import ClusterArtifact
+
+
+class IncrementalClusterer():
+    """
+    Class to label new points against the clusters of the last full HDBSCAN fit instead of re-fitting on every
+    point ever recorded. The members of every cluster are kept in a persisted spatial index together with their
+    core distances. A new point joins the cluster of its nearest member when it lies within that member's core
+    distance (the same density HDBSCAN used to admit the member), floored at assign_floor_m (and grid_m) since
+    the busiest places are full of duplicates with a core distance of about 0. Otherwise it is labelled noise
+    (-1) and counted as pending. A full re-fit only runs on a schedule or once enough pending points have built up
+
+    Attributes
+    ----------
+    path : pathlib.Path
+        directory holding the ClusterArtifact of the last fit (its members are the index), 'labels.parquet'
+        (labels of every point) and 'meta.json'
+    min_cluster_size : int
+        min_cluster_size passed to cluster_data, also the min_samples used for the core distances
+    refit_days : int
+        days after which a full re-fit is forced
+    refit_pending : int
+        number of pending points that forces a full re-fit
+    grid_m : float
+        grid_m passed to cluster_data
+    assign_floor_m : float
+        smallest reach in meters of a member during assignment
+    partition_deg : float
+        partition_deg passed to cluster_data
+    metric : str
+        metric passed to cluster_data, 'haversine' or 'chord'. The index uses the same distance
+    n_workers : int
+        n_workers passed to cluster_data
+    artifact : ClusterArtifact
+        clusters and members of the last full fit
+    meta : dict
+        {'last_fit': isoformat datetime, 'pending': number of pending points}
+
+    Methods
+    -------
+    needs_refit(now)
+        whether the next call to label should re-fit
+    label(df)
+        raw cluster labels for every row of df, re-fitting or assigning as needed
+    fit(df)
+        full HDBSCAN fit, rebuilds the index
+    assign(coords)
+        label points against the persisted index
+    """
+    def __init__(self, path: str, min_cluster_size: int = 5, refit_days: int = 7, refit_pending: int = 500,
+                 grid_m: float = None, partition_deg: float = None, n_workers: int = 1,
+                 metric: str = 'haversine', assign_floor_m: float = 10):
+        """
+        Initialize IncrementalClusterer
+
+        Parameters
+        -----------
+        path : str
+            directory holding the index, labels and metadata, created on first fit
+        min_cluster_size : int [optional]
+            min_cluster_size passed to cluster_data
+        refit_days : int [optional]
+            days after which a full re-fit is forced
+        refit_pending : int [optional]
+            number of pending points that forces a full re-fit
+        grid_m : float [optional]
+            grid_m passed to cluster_data, None fits every point
+        partition_deg : float [optional]
+            partition_deg passed to cluster_data, None fits all of the points at once
+        n_workers : int [optional]
+            number of processes the partitions are fit with
+        metric : str [optional]
+            metric passed to cluster_data, 'haversine' or 'chord'
+        assign_floor_m : float [optional]
+            smallest reach in meters of a member during assignment, raised to grid_m when that is larger
+
+        Returns
+        -----------
+        None
+        """
+        self.path = Path(path)
+        self.min_cluster_size = min_cluster_size
+        self.assign_floor_m = assign_floor_m
+        self.refit_days = refit_days
+        self.refit_pending = refit_pending
+        self.grid_m = grid_m
+        self.partition_deg = partition_deg
+        self.metric = metric
+        self.n_workers = n_workers
+        self.artifact = ClusterArtifact(self.path)
+        self.meta = {}
+        if (self.path / 'meta.json').exists():
+            with open(self.path / 'meta.json', 'r') as f:
+                self.meta = json.load(f)
+        settings = {'min_cluster_size': min_cluster_size, 'grid_m': grid_m, 'partition_deg': partition_deg,
+                    'metric': metric}
+        if any(self.meta.get(key) != value for key, value in settings.items()) or not self.artifact.exists():
+            self.meta = {} # index was built with other settings, or before the artifact replaced members.npz
+
+    def needs_refit(self, now: datetime = None) -> bool:
+        """
+        Whether the next call to label should re-fit: no index yet, the schedule is due, or too many
+        points are pending
+        """
+        if not self.meta:
+            return True
+        now = now or datetime.now()
+        if now - datetime.fromisoformat(self.meta['last_fit']) >= timedelta(days=self.refit_days):
+            return True
+        return self.meta['pending'] >= self.refit_pending
+
+    def label(self, df: pd.DataFrame, now: datetime = None):
+        """
+        Raw cluster labels for every row of df. Points labelled by a previous run keep their label, new points
+        are assigned against the index, unless a full re-fit is due
+
+        Parameters
+        -----------
+        df : pd.DataFrame
+            every location of one tile, contains ['location_timestamp','latitude','longitude']
+        now : datetime [optional]
+            time used for the re-fit schedule
+
+        Returns
+        -----------
+        db : sklearn HDBSCAN class
+            fit model, None when no re-fit happened
+        labels : np.array
+            array containing the labels
+        pending : np.array
+            boolean array, True for points labelled noise by assignment and waiting for the next re-fit
+        """
+        if self.needs_refit(now):
+            db, labels = self.fit(df, now)
+            return db, labels, np.zeros(len(df), dtype=bool)
+
+        previous = pd.read_parquet(self.path / 'labels.parquet')
+        merged = df[['location_timestamp']].merge(previous, on='location_timestamp', how='left')
+        new_mask = merged['cluster_label'].isna().values
+        labels = merged['cluster_label'].fillna(-1).astype(np.int64).to_numpy(copy=True)
+        pending = merged['pending'].eq(True).to_numpy(copy=True)
+
+        coords = np.deg2rad(df.loc[new_mask, ['latitude', 'longitude']].values)
+        labels[new_mask] = self.assign(coords)
+        pending[new_mask] = labels[new_mask] == -1
+        print(f"Assigned {new_mask.sum()} new points, {pending[new_mask].sum()} pending")
+
+        self.meta['pending'] = int(pending.sum())
+        self._save_labels(df, labels, pending)
+        return None, labels, pending
+
+    def fit(self, df: pd.DataFrame, now: datetime = None):
+        """
+        Full HDBSCAN fit on every point, rebuilds the index of cluster members and their core distances
+
+        Parameters
+        -----------
+        df : pd.DataFrame
+            every location of one tile, contains ['location_timestamp','latitude','longitude']
+        now : datetime [optional]
+            time recorded as the last fit
+
+        Returns
+        -----------
+        db : sklearn HDBSCAN class
+            fit model, None when df has too few points to fit
+        labels : np.array
+            array containing the labels
+        """
+        if len(df) == 0:
+            # e.g. no point of the tile passed the quality flags, the index is empty until the next fit
+            db, labels, core_distances = None, np.empty(0, dtype=np.int64), np.empty(0)
+        else:
+            db, labels = cluster_data(df[['latitude', 'longitude']], min_cluster_size=self.min_cluster_size,
+                                      grid_m=self.grid_m, partition_deg=self.partition_deg, n_workers=self.n_workers,
+                                      metric=self.metric)
+            coords = np.deg2rad(df[['latitude', 'longitude']].values)
+
+            # core distance as HDBSCAN defines it: distance to the min_samples-th neighbour, the point included
+            min_samples = min(self.min_cluster_size, len(coords))
+            core_distances = self._build_tree(coords).query(self._embed(coords), k=min_samples)[0][:, -1]
+
+        self.artifact.write(df, labels, core_distances=core_distances)
+        self._tree = None
+
+        self.meta = {'last_fit': (now or datetime.now()).isoformat(), 'pending': 0,
+                     'min_cluster_size': self.min_cluster_size, 'grid_m': self.grid_m,
+                     'partition_deg': self.partition_deg, 'metric': self.metric}
+        self._save_labels(df, labels, np.zeros(len(df), dtype=bool))
+        return db, labels
+
+    def assign(self, coords: np.ndarray) -> np.ndarray:
+        """
+        Label points against the persisted index
+
+        Parameters
+        -----------
+        coords : np.ndarray
+            (n, 2) array of [latitude, longitude] in radians
+
+        Returns
+        -----------
+        labels : np.array
+            label of the nearest member when within its core distance (or the floor), otherwise -1
+        """
+        labels = np.full(len(coords), -1, dtype=np.int64)
+        if len(coords) == 0:
+            return labels
+        if getattr(self, '_tree', None) is None:
+            members = self.artifact.members()
+            self._member_labels = members['cluster_label'].to_numpy()
+            # distances of the metric: radians for haversine, the chord of the unit sphere for chord
+            floor = max(self.assign_floor_m, self.grid_m or 0) / EARTH_RADIUS_M
+            if self.metric == 'chord':
+                floor = 2 * np.sin(floor / 2)
+            self._core_distances = np.maximum(members['core_distance'].to_numpy(), floor)
+            coords_members = np.stack([members['latitude'].to_numpy(), members['longitude'].to_numpy()], axis=1)
+            self._tree = self._build_tree(coords_members) if len(self._member_labels) else None
+        if self._tree is None:
+            return labels
+
+        distances, nearest = self._tree.query(self._embed(coords), k=1)
+        distances, nearest = distances[:, 0], nearest[:, 0]
+        within = distances <= self._core_distances[nearest]
+        labels[within] = self._member_labels[nearest[within]]
+        return labels
+
+    def _embed(self, coords: np.ndarray) -> np.ndarray:
+        """
+        Coordinates in the space of the metric: radians for haversine, the unit sphere for chord
+        """
+        return to_unit_sphere(coords) if self.metric == 'chord' else coords
+
+    def _build_tree(self, coords: np.ndarray):
+        """
+        Spatial index over coords ([latitude, longitude] in radians) using the metric's distance
+        """
+        if self.metric == 'chord':
+            return KDTree(to_unit_sphere(coords))
+        return BallTree(coords, metric='haversine')
+
+    def _save_labels(self, df: pd.DataFrame, labels: np.ndarray, pending: np.ndarray) -> None:
+        """
+        Persist the labels of every point, then the metadata
+        """
+        pd.DataFrame({'location_timestamp': df['location_timestamp'].values,
+                      'cluster_label': labels,
+                      'pending': pending}).to_parquet(self.path / 'labels.parquet', index=False)
+        _save_meta(self.path, self.meta)
+
+
+class StayPointClusterer():
+    """
+    Class to label a tile's trajectory with stay point detection (see utils.detect_stays) as new points arrive,
+    an alternative to IncrementalClusterer with the same label interface. Each run restarts from the last visit
+    that was still open at the end of the previous run, so only the new points are passed over and the labels
+    are the same as labelling the full history at once. Stays are labelled with their place, transit -3 and
+    GPS jumps -1, so reduce_clusters has little left to do
+
+    Attributes
+    ----------
+    path : pathlib.Path
+        directory holding 'labels.parquet' (labels of every point) and 'meta.json'
+    distance_m : float
+        radius of a stay in meters
+    dwell_s : float
+        minimum duration of a stay in seconds
+    meta : dict
+        {'places': places of every stay, 'resume_timestamp': location_timestamp of the first point of the last visit}
+
+    Methods
+    -------
+    label(df)
+        cluster labels for every row of df, only the points since the last visit are passed over
+    """
+    def __init__(self, path: str, distance_m: float = 100, dwell_s: float = 1200):
+        """
+        Initialize StayPointClusterer
+
+        Parameters
+        -----------
+        path : str
+            directory holding the labels and metadata, created on first label
+        distance_m : float [optional]
+            radius of a stay in meters
+        dwell_s : float [optional]
+            minimum duration of a stay in seconds
+
+        Returns
+        -----------
+        None
+        """
+        self.path = Path(path)
+        self.distance_m = distance_m
+        self.dwell_s = dwell_s
+        self.meta = {}
+        if (self.path / 'meta.json').exists():
+            with open(self.path / 'meta.json', 'r') as f:
+                self.meta = json.load(f)
+        settings = {'engine': 'stay_points', 'distance_m': distance_m, 'dwell_s': dwell_s}
+        if any(self.meta.get(key) != value for key, value in settings.items()):
+            self.meta = {} # labels were made with other settings
+
+    def label(self, df: pd.DataFrame, now: datetime = None):
+        """
+        Cluster labels for every row of df. Points before the last open visit keep their label, the rest are
+        passed over again. A point inserted before that visit (e.g. a late update from Tile) relabels everything
+
+        Parameters
+        -----------
+        df : pd.DataFrame
+            every location of one tile, contains ['location_timestamp','latitude','longitude'], sorted by time
+        now : datetime [optional]
+            unused, kept for the IncrementalClusterer interface
+
+        Returns
+        -----------
+        db : None
+            there is no model to save
+        labels : np.array
+            array containing the labels
+        pending : np.array
+            boolean array, always False
+        """
+        timestamps = df['location_timestamp'].values
+        start = 0
+        labels = np.full(len(df), -3, dtype=np.int64)
+        if self.meta:
+            previous = pd.read_parquet(self.path / 'labels.parquet')
+            merged = df[['location_timestamp']].merge(previous, on='location_timestamp', how='left')
+            start = np.searchsorted(timestamps, self.meta['resume_timestamp'], side='left')
+            if merged['cluster_label'].iloc[:start].isna().any():
+                start = 0 # history changed before the last visit
+            else:
+                labels[:start] = merged['cluster_label'].iloc[:start].astype(np.int64).values
+        places = self.meta['places'] if start > 0 else []
+
+        new_labels, places, open_start = detect_stays(df['latitude'].values[start:], df['longitude'].values[start:],
+                                                      timestamps[start:], distance_m=self.distance_m,
+                                                      dwell_s=self.dwell_s, places=places)
+        labels[start:] = new_labels
+        print(f"Labelled {len(df) - start} points, {len(places)} places")
+
+        self.meta = {'engine': 'stay_points', 'distance_m': self.distance_m, 'dwell_s': self.dwell_s,
+                     'places': places,
+                     'resume_timestamp': int(timestamps[start + open_start]) if len(df) > start else 0}
+        self.path.mkdir(parents=True, exist_ok=True)
+        pd.DataFrame({'location_timestamp': timestamps,
+                      'cluster_label': labels}).to_parquet(self.path / 'labels.parquet', index=False)
+        _save_meta(self.path, self.meta)
+        return None, labels, np.zeros(len(df), dtype=bool)
+
+
+def _save_meta(path: Path, meta: dict) -> None:
+    """
+    Write meta.json through a temporary file, so a crash can't leave it half written next to valid labels
+    """
+    tmp_path = path / 'meta.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    tmp_path.replace(path / 'meta.json')
@@ -0,0 +1,190 @@
+# Third Party Imports
+import pandas as pd
+import numpy as np
+from sklearn.neighbors import BallTree
+
+# Native Imports
+from pathlib import Path
+import json
+
+# Custom Imports
+from .utils import EARTH_RADIUS_M, haversine_m
+
+PLACE_COLUMNS = ['place_id', 'centroid_latitude', 'centroid_longitude', 'min_latitude', 'max_latitude',
+                 'min_longitude', 'max_longitude', 'count', 'first_seen', 'last_seen']
+
+
+class ClusterRegistry():
+    """
+    Class to give clusters IDs that survive a re-fit. HDBSCAN renumbers its clusters on every fit, so anything
+    keyed by cluster_label (geocoding, tags, addresses) would have to be redone. The registry keeps every place
+    it has seen, and matches the clusters of each run to those places by centroid distance and by the overlap
+    of their bounding boxes, through a BallTree on the stored centroids. A matched cluster keeps the place_id
+    of its place, an unmatched one gets a new place_id. Every cluster comes back with a status:
+
+        'new'       : no stored place matched, enrichment has to be computed
+        'changed'   : matched, but the centroid moved more than change_m since the place was last enriched
+        'unchanged' : matched within change_m, enrichment stored for the place_id can be reused
+
+    Noise and special labels (< 0) are not registered, they keep their label as place_id
+
+    Attributes
+    ----------
+    path : pathlib.Path
+        directory holding 'places.parquet' (one row per place) and 'meta.json'
+    match_m : float
+        largest centroid distance in meters for a cluster to match a place
+    min_overlap : float
+        smallest overlap (intersection over the smaller box) of the bounding boxes for a match
+    change_m : float
+        centroid shift in meters above which a matched cluster is 'changed'
+    places : pd.DataFrame
+        stored places, PLACE_COLUMNS. The centroid is the one the place was last reported 'changed' at, which
+        is stored before enrichment runs: enrichment that can fail keeps the centroid it was computed at next
+        to its result and checks it against change_m as well (see reverse_geocode)
+    meta : dict
+        {'next_place_id': first unused place_id}
+
+    Methods
+    -------
+    update(summary)
+        match the clusters of a run to the stored places, store the result and return the place_ids
+    """
+    def __init__(self, path: str, match_m: float = 100, min_overlap: float = 0.3, change_m: float = 25):
+        """
+        Initialize ClusterRegistry
+
+        Parameters
+        -----------
+        path : str
+            directory holding the registry, created on first update
+        match_m : float [optional]
+            largest centroid distance in meters for a cluster to match a place
+        min_overlap : float [optional]
+            smallest overlap of the bounding boxes for a match, between 0 and 1
+        change_m : float [optional]
+            centroid shift in meters above which a matched cluster is 'changed'. Should not exceed the radius of
+            the geocode cache, so an unchanged place would get the same response
+
+        Returns
+        -----------
+        None
+        """
+        self.path = Path(path)
+        self.match_m = match_m
+        self.min_overlap = min_overlap
+        self.change_m = change_m
+        self.meta = {'next_place_id': 0}
+        self.places = pd.DataFrame({col: pd.Series(dtype=np.int64 if col in ['place_id', 'count', 'first_seen', 'last_seen']
+                                                   else np.float64) for col in PLACE_COLUMNS})
+        if (self.path / 'meta.json').exists():
+            with open(self.path / 'meta.json', 'r') as f:
+                self.meta = json.load(f)
+            self.places = pd.read_parquet(self.path / 'places.parquet')
+
+    def update(self, summary: pd.DataFrame) -> pd.DataFrame:
+        """
+        Match the clusters of a run to the stored places and store the result. Each place is matched by at
+        most one cluster: pairs are taken by decreasing overlap, then increasing distance, so when a place
+        splits the larger part keeps its place_id, and when places merge the cluster takes the best match
+
+        Parameters
+        -----------
+        summary : pd.DataFrame
+            output of utils.cluster_summary, one row per cluster
+
+        Returns
+        -----------
+        places : pd.DataFrame
+            one row per row of summary, ['cluster_label','place_id','place_status']
+        """
+        summary = summary.reset_index(drop=True)
+        clusters = summary[summary['cluster_label'] >= 0]
+        result = pd.DataFrame({'cluster_label': summary['cluster_label'].values,
+                               'place_id': summary['cluster_label'].values.astype(np.int64),
+                               'place_status': 'unchanged'})
+
+        # candidate pairs: every stored place within match_m of a cluster centroid
+        cluster_idx, place_idx = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        if len(self.places) and len(clusters):
+            tree = BallTree(np.radians(self.places[['centroid_latitude', 'centroid_longitude']].values), metric='haversine')
+            neighbours = tree.query_radius(np.radians(clusters[['centroid_latitude', 'centroid_longitude']].values),
+                                           r=self.match_m / EARTH_RADIUS_M)
+            cluster_idx = np.repeat(clusters.index.values, [len(n) for n in neighbours])
+            place_idx = np.concatenate(neighbours).astype(np.int64)
+
+        matched = {}
+        if len(cluster_idx):
+            new_boxes = self._boxes(summary.loc[cluster_idx])
+            old_boxes = self._boxes(self.places.iloc[place_idx])
+            overlap = self._overlap(new_boxes, old_boxes)
+            distance = haversine_m(summary.loc[cluster_idx, 'centroid_latitude'].values,
+                                   summary.loc[cluster_idx, 'centroid_longitude'].values,
+                                   self.places['centroid_latitude'].values[place_idx],
+                                   self.places['centroid_longitude'].values[place_idx])
+            used_places = set()
+            for i in np.lexsort((distance, -overlap)):
+                if overlap[i] < self.min_overlap:
+                    break
+                if cluster_idx[i] in matched or place_idx[i] in used_places:
+                    continue
+                matched[cluster_idx[i]] = (place_idx[i], distance[i])
+                used_places.add(place_idx[i])
+
+        places = self.places.copy()
+        new_rows = []
+        for i in clusters.index:
+            row = summary.loc[i]
+            if i in matched:
+                j, distance = matched[i]
+                result.loc[i, 'place_id'] = places.at[j, 'place_id']
+                places.at[j, 'count'] = row['count']
+                places.at[j, 'first_seen'] = min(places.at[j, 'first_seen'], row['first_seen'])
+                places.at[j, 'last_seen'] = max(places.at[j, 'last_seen'], row['last_seen'])
+                if distance <= self.change_m:
+                    continue
+                # moved: the stored centroid becomes the one the place is enriched at again
+                result.loc[i, 'place_status'] = 'changed'
+                for col in PLACE_COLUMNS[1:7]:
+                    places.at[j, col] = row[col]
+            else:
+                result.loc[i, 'place_id'] = self.meta['next_place_id']
+                result.loc[i, 'place_status'] = 'new'
+                new_rows.append({'place_id': self.meta['next_place_id'], **{col: row[col] for col in PLACE_COLUMNS[1:]}})
+                self.meta['next_place_id'] += 1
+        if new_rows:
+            places = pd.concat([places, pd.DataFrame(new_rows)], ignore_index=True) if len(places) else pd.DataFrame(new_rows)
+        self.places = places[PLACE_COLUMNS].astype(self.places.dtypes.to_dict())
+
+        # places first, then meta, each through a temporary file so a crash leaves whole files behind
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.places.to_parquet(self.path / 'places.tmp', index=False)
+        (self.path / 'places.tmp').replace(self.path / 'places.parquet')
+        with open(self.path / 'meta.tmp', 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        (self.path / 'meta.tmp').replace(self.path / 'meta.json')
+        status = result.loc[result['cluster_label'] >= 0, 'place_status'].value_counts()
+        print(f"{status.get('new', 0)} new places, {status.get('changed', 0)} changed, {status.get('unchanged', 0)} unchanged")
+        return result
+
+    def _boxes(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Bounding boxes [min_lat, max_lat, min_lon, max_lon], padded to at least change_m on every side so single
+        point clusters still overlap their neighbours
+        """
+        pad_lat = np.degrees(self.change_m / EARTH_RADIUS_M)
+        pad_lon = pad_lat / np.maximum(np.cos(np.radians(df['centroid_latitude'].values)), 0.01)
+        return np.column_stack([np.minimum(df['min_latitude'].values, df['centroid_latitude'].values - pad_lat),
+                                np.maximum(df['max_latitude'].values, df['centroid_latitude'].values + pad_lat),
+                                np.minimum(df['min_longitude'].values, df['centroid_longitude'].values - pad_lon),
+                                np.maximum(df['max_longitude'].values, df['centroid_longitude'].values + pad_lon)])
+
+    @staticmethod
+    def _overlap(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """
+        Area of the intersection of two boxes over the area of the smaller one, row by row
+        """
+        height = np.clip(np.minimum(a[:, 1], b[:, 1]) - np.maximum(a[:, 0], b[:, 0]), 0, None)
+        width = np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 2], b[:, 2]), 0, None)
+        smaller = np.minimum((a[:, 1] - a[:, 0]) * (a[:, 3] - a[:, 2]), (b[:, 1] - b[:, 0]) * (b[:, 3] - b[:, 2]))
+        return height * width / smaller
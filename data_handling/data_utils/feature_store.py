@@ -0,0 +1,221 @@
+# Third Party Imports
+import pandas as pd
+import numpy as np
+
+# Native Imports
+from pathlib import Path
+import shutil
+import json
+
+# Custom Imports
+from .utils import trajectory_kinematics
+
+# Trajectory features depend on at most this many previous points (direction similarity uses two steps)
+TRAILING_POINTS = 2
+# A tile with more feature parts than this has them merged back into a single part
+MAX_PARTS = 16
+
+
+class FeatureStore():
+    """
+    Class to compute trajectory features incrementally. The trailing points of every tile are persisted, so
+    each run only computes features for the points appended since the previous run, and the results are
+    identical to recomputing the full history. Features are stored as parquet parts, one per tile per run,
+    merged into one part once a tile has more than MAX_PARTS:
+
+        features/<tile_uuid>/part-<first location_timestamp>.parquet
+
+    Attributes
+    ----------
+    path : pathlib.Path
+        directory holding the feature parts and the state
+    state_path : pathlib.Path
+        json file containing, per tile, the number of points processed and the trailing points
+    state : dict
+        {tile_uuid: {'count': points processed, 'location_timestamp': [...], 'latitude': [...], 'longitude': [...]}},
+        the lists holding the trailing points
+    max_gap_s : float
+        max_gap_s passed to trajectory_kinematics
+
+    Methods
+    -------
+    update(df)
+        compute and store the features of the new points, returns the features of those points
+    load(df, tile_uuids)
+        read the stored feature parts, of every tile or of some
+    """
+    def __init__(self, path: str, max_gap_s: float = None):
+        """
+        Initialize FeatureStore
+
+        Parameters
+        -----------
+        path : str
+            directory holding the feature parts and the state, created on first update
+        max_gap_s : float [optional]
+            max_gap_s passed to trajectory_kinematics. Changing it invalidates the stored features
+
+        Returns
+        -----------
+        None
+        """
+        self.path = Path(path)
+        self.state_path = self.path / 'trajectory_state.json'
+        self.max_gap_s = max_gap_s
+        self.state = {}
+        if self.state_path.exists():
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            if state.get('max_gap_s') == max_gap_s:
+                self.state = state['tiles']
+
+    def update(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Compute and store the features of the points appended since the previous run. A tile whose history
+        changed before its last processed point (e.g. a late update from Tile: a different number of points up
+        to the last processed one, or different trailing points) is recomputed in full
+
+        Parameters
+        -----------
+        df : pd.DataFrame
+            every location of every tile, output of combine_all_data (sorted by tile, then time)
+
+        Returns
+        -----------
+        df : pd.DataFrame
+            the locations computed in this run (every location of a recomputed tile) with the
+            trajectory_kinematics columns added, sorted by tile, then time. Use load for the full history
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        new_frames = []
+        for tile_uuid, tile_df in df.groupby('tile_uuid', observed=True, sort=False):
+            tile_uuid = str(tile_uuid)
+            timestamps = tile_df['location_timestamp'].values
+            tile_state = self.state.get(tile_uuid)
+
+            n_processed = 0
+            if tile_state is not None and tile_state['count'] > 0:
+                last_ts = tile_state['location_timestamp'][-1]
+                n_processed = np.searchsorted(timestamps, last_ts, side='right')
+            if tile_state is None or n_processed != tile_state['count'] or not self._same_trailing(tile_df, tile_state):
+                # nothing stored for this tile, or its history changed: recompute all of it
+                shutil.rmtree(self.path / tile_uuid, ignore_errors=True)
+                tile_state = {'count': 0, 'location_timestamp': [], 'latitude': [], 'longitude': []}
+                n_processed = 0
+
+            new_df = tile_df.iloc[n_processed:]
+            if new_df.empty:
+                continue
+
+            # prepend the trailing points so the first new points see their predecessors
+            n_trailing = len(tile_state['location_timestamp'])
+            kinematics = trajectory_kinematics(
+                np.concatenate([tile_state['latitude'], new_df['latitude'].values]),
+                np.concatenate([tile_state['longitude'], new_df['longitude'].values]),
+                timestamp=np.concatenate([np.asarray(tile_state['location_timestamp'], dtype=np.int64),
+                                          new_df['location_timestamp'].values]),
+                max_gap_s=self.max_gap_s)
+            new_df = new_df.copy()
+            for col, values in kinematics.items():
+                new_df[col] = values[n_trailing:]
+
+            tile_dir = self.path / tile_uuid
+            tile_dir.mkdir(exist_ok=True)
+            new_df.to_parquet(tile_dir / f"part-{new_df['location_timestamp'].iloc[0]}.parquet", index=False)
+            self._compact(tile_dir)
+
+            trailing = tile_df.iloc[max(0, len(tile_df) - TRAILING_POINTS):]
+            self.state[tile_uuid] = {'count': len(tile_df),
+                                     'location_timestamp': trailing['location_timestamp'].tolist(),
+                                     'latitude': trailing['latitude'].tolist(),
+                                     'longitude': trailing['longitude'].tolist()}
+            new_frames.append(new_df)
+
+        # state goes last, a crash before this only means the same points are computed again
+        tmp_path = self.state_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'max_gap_s': self.max_gap_s, 'tiles': self.state}, f)
+        tmp_path.replace(self.state_path)
+        print(f"Computed features for {sum(len(new_df) for new_df in new_frames)} new points")
+
+        if not new_frames:
+            return pd.DataFrame()
+        return self._like(pd.concat(new_frames, ignore_index=True), df)
+
+    def load(self, df: pd.DataFrame = None, tile_uuids: list = None) -> pd.DataFrame:
+        """
+        Read the stored feature parts. Reads the full history of the tiles, so it grows with it
+
+        Parameters
+        -----------
+        df : pd.DataFrame [optional]
+            the input of update, its tile categories and row order are restored
+        tile_uuids : list [optional]
+            tiles to read, None reads every tile
+
+        Returns
+        -----------
+        features : pd.DataFrame
+            every stored location with the trajectory_kinematics columns. Empty if nothing has been stored yet,
+            with the columns of df when given
+        """
+        parts = []
+        for tile_uuid in (self.state if tile_uuids is None else [str(tile_uuid) for tile_uuid in tile_uuids]):
+            parts.extend(self._parts(self.path / tile_uuid))
+        if not parts and df is None:
+            return pd.DataFrame()
+        if not parts:
+            # no rows, but the columns of every location with its features
+            kinematics = trajectory_kinematics(np.empty(0), np.empty(0), timestamp=np.empty(0, dtype=np.int64))
+            return df.iloc[:0].assign(**kinematics).reset_index(drop=True)
+        features = pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+        # a compaction interrupted after writing the merged part leaves the old parts next to it
+        features = features.drop_duplicates(['tile_uuid', 'location_timestamp'], ignore_index=True)
+        if df is not None:
+            return self._like(features, df)
+        # concat only keeps the categorical dtype when the categories match, so restore it
+        for col in ['tile_uuid', 'tile_name']:
+            features[col] = features[col].astype('category')
+        return features
+
+    @staticmethod
+    def _like(features: pd.DataFrame, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Features with the same tile categories and row order as df, rows of tiles df doesn't have are dropped
+        """
+        for col in ['tile_uuid', 'tile_name']:
+            features[col] = features[col].astype(df[col].dtype)
+        features = features[features['tile_uuid'].notna()]
+        return features.sort_values(['tile_uuid', 'location_timestamp'], ignore_index=True)
+
+    @staticmethod
+    def _parts(tile_dir: Path) -> list:
+        """
+        Feature parts of a tile, in order of their first location_timestamp
+        """
+        return sorted(tile_dir.glob('part-*.parquet'), key=lambda part: int(part.stem.split('-')[1]))
+
+    @staticmethod
+    def _same_trailing(tile_df: pd.DataFrame, tile_state: dict) -> bool:
+        """
+        Whether the trailing points in the state are still the points before the new ones, the features of the
+        new points are computed from them
+        """
+        n_trailing = len(tile_state['location_timestamp'])
+        trailing = tile_df.iloc[tile_state['count'] - n_trailing:tile_state['count']]
+        return all(np.array_equal(trailing[col].values, tile_state[col])
+                   for col in ['location_timestamp', 'latitude', 'longitude'])
+
+    def _compact(self, tile_dir: Path) -> None:
+        """
+        Merge the parts of a tile into one once there are more than MAX_PARTS, so load doesn't open a file per
+        run. The merged part replaces the first part, then the others are removed
+        """
+        parts = self._parts(tile_dir)
+        if len(parts) <= MAX_PARTS:
+            return
+        tmp_path = tile_dir / 'compact.tmp'
+        pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True).to_parquet(tmp_path, index=False)
+        tmp_path.replace(parts[0])
+        for part in parts[1:]:
+            part.unlink()
@@ -0,0 +1,310 @@
+# Third Party Imports
+import pyarrow as pa
+import pandas as pd
+import numpy as np
+from sklearn.neighbors import KDTree
+
+# Native Imports
+from pathlib import Path
+import json
+import math
+
+# Custom Imports
+from .utils import EARTH_RADIUS_M, to_unit_sphere
+
+# Bump whenever the columns of any table change, gazetteers of another version are refused
+GAZETTEER_VERSION = 1
+GRID_DEG = 1 # cell size of the grid indexing the country polygons
+
+# columns of the GeoNames 'cities*.txt' dumps (https://download.geonames.org/export/dump/)
+GEONAMES_COLUMNS = ['geonameid', 'name', 'asciiname', 'alternatenames', 'latitude', 'longitude', 'feature_class',
+                    'feature_code', 'country_code', 'cc2', 'admin1_code', 'admin2_code', 'admin3_code',
+                    'admin4_code', 'population', 'elevation', 'dem', 'timezone', 'modification_date']
+
+
+class Gazetteer():
+    """
+    Class for an offline reverse geocoding tier answering coarse address fields (locality,
+    administrative_area_level_1, country) without any network call. It is built once from GeoNames populated
+    places and Natural Earth country polygons (see build) into uncompressed Arrow IPC files, which are
+    memory-mapped on load:
+
+        places.arrow    : one row per populated place, ['geonameid','latitude','longitude','name','admin1',
+                          'admin1_code','country_code'], indexed by a kd-tree on the unit sphere
+        countries.arrow : one row per country, ['country_code','country']
+        parts.arrow     : one row per polygon of a country, ['country_index','edge_start','edge_end']
+        edges.arrow     : polygon edges ['x1','y1','x2','y2'] (longitude, latitude), contiguous per part
+        grid.arrow      : (cell, part) pairs sorted by cell, every GRID_DEG cell a part's bounding box touches
+
+    The country is found by point in polygon (crossing number) over the parts indexed in the point's grid
+    cell, the locality and administrative area come from the nearest populated place, within max_locality_m
+    and max_admin_m respectively. Answers have the shape of a GoogleMaps reverse geocoding response with location_type
+    'APPROXIMATE', so process_geocode keeps their address components but not their address or place_id
+
+    Attributes
+    ----------
+    path : pathlib.Path
+        directory holding the tables
+    max_locality_m : float
+        farthest populated place, in meters, reported as the locality
+    max_admin_m : float
+        farthest populated place, in meters, whose administrative area is reported
+
+    Methods
+    -------
+    build(path, cities_path, admin1_path, country_info_path, countries_geojson_path)
+        build the tables from the GeoNames and Natural Earth files
+    reverse_geocode(latitude, longitude)
+        Google-shaped response for one coordinate
+    reverse_geocode_many(latitude, longitude)
+        Google-shaped responses for arrays of coordinates
+    exists(path)
+        whether a gazetteer has been built in path
+    """
+    def __init__(self, path: str, max_locality_m: float = 25_000, max_admin_m: float = 100_000):
+        """
+        Initialize Gazetteer, memory-mapping its tables
+
+        Parameters
+        -----------
+        path : str
+            directory the gazetteer was built in
+        max_locality_m : float [optional]
+            farthest populated place, in meters, reported as the locality
+        max_admin_m : float [optional]
+            farthest populated place, in meters, whose administrative area is reported. In sparsely populated
+            areas the nearest place can sit across a state or province border, so farther places are not trusted
+
+        Returns
+        -----------
+        None
+        """
+        self.path = Path(path)
+        self.max_locality_m = max_locality_m
+        self.max_admin_m = max_admin_m
+        self.places = _read_table(self.path / 'places.arrow')
+        self.countries = _read_table(self.path / 'countries.arrow')
+        parts = _read_table(self.path / 'parts.arrow')
+        edges = _read_table(self.path / 'edges.arrow')
+        grid = _read_table(self.path / 'grid.arrow')
+
+        self._part_country = parts.column('country_index').to_numpy()
+        self._part_edges = np.column_stack([parts.column('edge_start').to_numpy(), parts.column('edge_end').to_numpy()])
+        self._x1, self._y1, self._x2, self._y2 = (edges.column(col).to_numpy() for col in ['x1', 'y1', 'x2', 'y2'])
+        self._grid_cell = grid.column('cell').to_numpy()
+        self._grid_part = grid.column('part').to_numpy()
+        self._tree = KDTree(to_unit_sphere(np.radians(np.column_stack([self.places.column('latitude').to_numpy(),
+                                                                        self.places.column('longitude').to_numpy()]))))
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        """
+        Whether a gazetteer has been built in path
+        """
+        return (Path(path) / 'grid.arrow').exists()
+
+    @staticmethod
+    def build(path: str, cities_path: str, admin1_path: str, country_info_path: str,
+              countries_geojson_path: str) -> None:
+        """
+        Build the gazetteer tables
+
+        Parameters
+        -----------
+        path : str
+            directory to write the tables to
+        cities_path : str
+            GeoNames populated places, e.g. 'cities1000.txt'
+        admin1_path : str
+            GeoNames 'admin1CodesASCII.txt', names of the first-level administrative areas
+        country_info_path : str
+            GeoNames 'countryInfo.txt', names of the countries
+        countries_geojson_path : str
+            Natural Earth admin 0 countries as GeoJSON, e.g. 'ne_50m_admin_0_countries.geojson'
+
+        Returns
+        -----------
+        None
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        # populated places, with the name of their first-level administrative area
+        places = pd.read_csv(cities_path, sep='\t', header=None, names=GEONAMES_COLUMNS, quoting=3,
+                             usecols=['geonameid', 'name', 'latitude', 'longitude', 'country_code', 'admin1_code'],
+                             dtype={'country_code': str, 'admin1_code': str}, keep_default_na=False)
+        admin1 = pd.read_csv(admin1_path, sep='\t', header=None, names=['code', 'name', 'asciiname', 'geonameid'],
+                             quoting=3, dtype=str, keep_default_na=False)
+        admin1_names = dict(zip(admin1['code'], admin1['name']))
+        places['admin1'] = (places['country_code'] + '.' + places['admin1_code']).map(admin1_names).fillna('')
+        places = places[['geonameid', 'latitude', 'longitude', 'name', 'admin1', 'admin1_code', 'country_code']]
+        _write_table(path / 'places.arrow', pa.Table.from_pandas(places.reset_index(drop=True), preserve_index=False))
+
+        # country names from GeoNames, so they match the country codes of the places
+        country_info = pd.read_csv(country_info_path, sep='\t', header=None, comment='#', quoting=3, dtype=str,
+                                   keep_default_na=False, usecols=[0, 4], names=['iso', 'country'])
+        country_names = dict(zip(country_info['iso'], country_info['country']))
+
+        with open(countries_geojson_path, 'r', encoding='utf-8') as f:
+            features = json.load(f)['features']
+        country_codes, part_country, part_edges, edge_arrays, grid_cells, grid_parts = [], [], [], [], [], []
+        n_edges = 0
+        for feature in features:
+            props = feature['properties']
+            # Natural Earth marks some countries (France, Norway) '-99' in ISO_A2, ISO_A2_EH has them
+            iso = next((props[key] for key in ['ISO_A2_EH', 'ISO_A2', 'iso_a2'] if props.get(key, '-99') != '-99'), None)
+            if iso is None or feature['geometry'] is None:
+                continue
+            if iso not in country_codes:
+                country_codes.append(iso)
+            country_index = country_codes.index(iso)
+            geometry = feature['geometry']
+            polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+            for polygon in polygons:
+                # every ring of a part (outer and holes) goes in, the crossing number handles the holes
+                edges = np.concatenate([np.column_stack([np.asarray(ring)[:-1, :2], np.asarray(ring)[1:, :2]])
+                                        for ring in polygon if len(ring) > 1])
+                part_index = len(part_country)
+                part_country.append(country_index)
+                part_edges.append((n_edges, n_edges + len(edges)))
+                edge_arrays.append(edges)
+                n_edges += len(edges)
+                # grid cells touched by the part's bounding box
+                rows = np.arange(_cell_row(edges[:, [1, 3]].min()), _cell_row(edges[:, [1, 3]].max()) + 1)
+                cols = np.arange(_cell_col(edges[:, [0, 2]].min()), _cell_col(edges[:, [0, 2]].max()) + 1)
+                cells = (rows[:, None] * int(360 / GRID_DEG) + cols[None, :]).ravel()
+                grid_cells.append(cells)
+                grid_parts.append(np.full(len(cells), part_index))
+
+        countries = pd.DataFrame({'country_code': country_codes,
+                                  'country': [country_names.get(code, code) for code in country_codes]})
+        _write_table(path / 'countries.arrow', pa.Table.from_pandas(countries, preserve_index=False))
+        part_edges = np.asarray(part_edges, dtype=np.int64)
+        _write_table(path / 'parts.arrow', pa.table({'country_index': np.asarray(part_country, dtype=np.int32),
+                                                     'edge_start': part_edges[:, 0], 'edge_end': part_edges[:, 1]}))
+        edges = np.concatenate(edge_arrays).astype(np.float64)
+        _write_table(path / 'edges.arrow', pa.table({'x1': edges[:, 0], 'y1': edges[:, 1],
+                                                     'x2': edges[:, 2], 'y2': edges[:, 3]}))
+        grid_cells, grid_parts = np.concatenate(grid_cells), np.concatenate(grid_parts)
+        order = np.argsort(grid_cells, kind='stable')
+        _write_table(path / 'grid.arrow', pa.table({'cell': grid_cells[order].astype(np.int64),
+                                                    'part': grid_parts[order].astype(np.int32)}))
+        print(f"Built gazetteer: {len(places)} places, {len(countries)} countries, {len(part_country)} polygons, "
+              f"{len(edges)} edges")
+
+    def reverse_geocode(self, latitude: float, longitude: float) -> list:
+        """
+        Google-shaped reverse geocoding response for one coordinate, see reverse_geocode_many
+        """
+        return self.reverse_geocode_many(np.array([latitude]), np.array([longitude]))[0]
+
+    def reverse_geocode_many(self, latitude: np.ndarray, longitude: np.ndarray) -> list:
+        """
+        Google-shaped reverse geocoding responses for arrays of coordinates
+
+        Parameters
+        -----------
+        latitude : np.ndarray
+            latitudes in degrees
+        longitude : np.ndarray
+            longitudes in degrees
+
+        Returns
+        -----------
+        responses : list
+            one response per coordinate: a list holding one result with the locality, administrative area and
+            country that were found, or an empty list when none was (e.g. at sea)
+        """
+        latitude, longitude = np.asarray(latitude, dtype=np.float64), np.asarray(longitude, dtype=np.float64)
+        country_index = np.array([self._country_at(lat, lon) for lat, lon in zip(latitude, longitude)], dtype=np.int64)
+
+        distance, nearest = self._tree.query(to_unit_sphere(np.radians(np.column_stack([latitude, longitude]))), k=1)
+        distance_m = 2 * EARTH_RADIUS_M * np.arcsin(np.clip(distance[:, 0] / 2, 0, 1))
+        nearest = nearest[:, 0]
+        places = self.places.take(pa.array(nearest)).to_pydict()
+        countries = self.countries.to_pydict()
+        country_position = {code: i for i, code in enumerate(countries['country_code'])}
+
+        responses = []
+        for i in range(len(latitude)):
+            if country_index[i] < 0:
+                # off every polygon (coast line simplification, at sea), trust a place close enough
+                country_index[i] = country_position.get(places['country_code'][i], -1) if distance_m[i] <= self.max_locality_m else -1
+            components = []
+            location = {'lat': float(latitude[i]), 'lng': float(longitude[i])}
+            same_country = country_index[i] >= 0 and places['country_code'][i] == countries['country_code'][country_index[i]]
+            if same_country and distance_m[i] <= self.max_locality_m:
+                components.append({'long_name': places['name'][i], 'short_name': places['name'][i],
+                                   'types': ['locality', 'political']})
+                location = {'lat': places['latitude'][i], 'lng': places['longitude'][i]}
+            if same_country and places['admin1'][i] and distance_m[i] <= self.max_admin_m:
+                components.append({'long_name': places['admin1'][i], 'short_name': places['admin1_code'][i],
+                                   'types': ['administrative_area_level_1', 'political']})
+            if country_index[i] >= 0:
+                components.append({'long_name': countries['country'][country_index[i]],
+                                   'short_name': countries['country_code'][country_index[i]],
+                                   'types': ['country', 'political']})
+            if not components:
+                responses.append([])
+                continue
+            responses.append([{'address_components': components,
+                               'formatted_address': ', '.join(comp['long_name'] for comp in components),
+                               'geometry': {'location': location, 'location_type': 'APPROXIMATE'},
+                               'place_id': f"geonames:{places['geonameid'][i]}" if components[0]['types'][0] == 'locality'
+                                           else f"country:{components[-1]['short_name']}",
+                               'types': components[0]['types']}])
+        return responses
+
+    def _country_at(self, latitude: float, longitude: float) -> int:
+        """
+        Index of the country whose polygons contain a coordinate, -1 if none does
+        """
+        cell = _cell_row(latitude) * int(360 / GRID_DEG) + _cell_col(longitude)
+        start, end = np.searchsorted(self._grid_cell, [cell, cell + 1])
+        for part in self._grid_part[start:end]:
+            edge_start, edge_end = self._part_edges[part]
+            y1, y2 = self._y1[edge_start:edge_end], self._y2[edge_start:edge_end]
+            # edges crossing the horizontal line through the point, counted when they lie east of it
+            crosses = (y1 > latitude) != (y2 > latitude)
+            x1, x2 = self._x1[edge_start:edge_end][crosses], self._x2[edge_start:edge_end][crosses]
+            y1, y2 = y1[crosses], y2[crosses]
+            if np.count_nonzero(longitude < x1 + (latitude - y1) * (x2 - x1) / (y2 - y1)) % 2 == 1:
+                return int(self._part_country[part])
+        return -1
+
+
+def _cell_row(latitude: float) -> int:
+    """
+    Grid row of a latitude
+    """
+    return min(int(math.floor((latitude + 90) / GRID_DEG)), int(180 / GRID_DEG) - 1)
+
+
+def _cell_col(longitude: float) -> int:
+    """
+    Grid column of a longitude
+    """
+    return min(int(math.floor((longitude + 180) / GRID_DEG)), int(360 / GRID_DEG) - 1)
+
+
+def _write_table(path: Path, table: pa.Table) -> None:
+    """
+    Write a table with the gazetteer version in its schema metadata, through a temporary file
+    """
+    table = table.replace_schema_metadata({'gazetteer_version': str(GAZETTEER_VERSION)})
+    tmp_path = path.with_suffix('.tmp')
+    with pa.OSFile(str(tmp_path), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    tmp_path.replace(path)
+
+
+def _read_table(path: Path) -> pa.Table:
+    """
+    Memory-map a table, raises ValueError if it was written by another gazetteer version
+    """
+    table = pa.ipc.open_file(pa.memory_map(str(path), 'r')).read_all()
+    version = (table.schema.metadata or {}).get(b'gazetteer_version', b'').decode()
+    if version != str(GAZETTEER_VERSION):
+        raise ValueError(f"{path} is gazetteer version '{version}', expected '{GAZETTEER_VERSION}'")
+    return table
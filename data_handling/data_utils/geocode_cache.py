@@ -0,0 +1,165 @@
+# Third Party Imports
+import numpy as np
+
+# Native Imports
+from pathlib import Path
+import sqlite3
+import json
+import math
+import time
+
+# Custom Imports
+from .utils import EARTH_RADIUS_M, haversine_m
+
+
+class GeocodeCache():
+    """
+    Class to keep reverse geocoding responses on disk, so a place that was already paid for is served locally
+    even after the clusters are re-fit and renumbered. Responses are stored in SQLite, keyed by the grid cell
+    (about radius_m x radius_m) of the coordinate that was geocoded. A lookup checks the surrounding cells and
+    returns the response of the closest coordinate within radius_m. Entries expire after ttl_days, and past
+    max_entries the least recently used entries are evicted
+
+    Attributes
+    ----------
+    path : pathlib.Path
+        location of the SQLite database
+    radius_m : float
+        a cached response is reused for coordinates up to this many meters away
+    ttl_days : float
+        age in days after which an entry is no longer served
+    max_entries : int
+        number of entries kept by evict
+    hits : int
+        lookups served from the cache since the cache was opened
+    misses : int
+        lookups that found nothing since the cache was opened
+
+    Methods
+    -------
+    get(latitude, longitude)
+        cached response for a coordinate, None on a miss
+    put(latitude, longitude, response)
+        store the response for a coordinate
+    evict()
+        drop expired entries, then the least recently used ones above max_entries
+    close()
+        close the database
+    """
+    def __init__(self, path: str, radius_m: float = 50, ttl_days: float = 180, max_entries: int = 100_000):
+        """
+        Initialize GeocodeCache
+
+        Parameters
+        -----------
+        path : str
+            location of the SQLite database, created if it doesn't exist
+        radius_m : float [optional]
+            a cached response is reused for coordinates up to this many meters away
+        ttl_days : float [optional]
+            age in days after which an entry is no longer served
+        max_entries : int [optional]
+            number of entries kept by evict
+
+        Returns
+        -----------
+        None
+        """
+        self.path = Path(path)
+        self.radius_m = radius_m
+        self.ttl_days = ttl_days
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS geocode_cache (
+                cell_row INTEGER, cell_col INTEGER, latitude REAL, longitude REAL,
+                response TEXT, created_at REAL, last_used REAL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_cell ON geocode_cache (cell_row, cell_col)")
+        self.conn.commit()
+
+    def get(self, latitude: float, longitude: float):
+        """
+        Cached response for a coordinate
+
+        Parameters
+        -----------
+        latitude : float
+            latitude in degrees
+        longitude : float
+            longitude in degrees
+
+        Returns
+        -----------
+        response : list
+            response of the closest cached coordinate within radius_m that hasn't expired, None on a miss
+        """
+        row, col = self._cell(latitude, longitude)
+        now = time.time()
+        entries = self.conn.execute("""
+            SELECT rowid, latitude, longitude, response FROM geocode_cache
+            WHERE cell_row BETWEEN ? AND ? AND cell_col BETWEEN ? AND ? AND created_at >= ?""",
+            (row - 1, row + 1, col - 1, col + 1, now - self.ttl_days * 86400)).fetchall()
+        if entries:
+            distances = haversine_m(latitude, longitude, np.array([entry[1] for entry in entries]),
+                                    np.array([entry[2] for entry in entries]))
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= self.radius_m:
+                self.conn.execute("UPDATE geocode_cache SET last_used = ? WHERE rowid = ?", (now, entries[nearest][0]))
+                self.conn.commit()
+                self.hits += 1
+                return json.loads(entries[nearest][3])
+        self.misses += 1
+        return None
+
+    def put(self, latitude: float, longitude: float, response) -> None:
+        """
+        Store the response for a coordinate
+
+        Parameters
+        -----------
+        latitude : float
+            latitude in degrees
+        longitude : float
+            longitude in degrees
+        response : list
+            response from client.reverse_geocode
+
+        Returns
+        -----------
+        None
+        """
+        row, col = self._cell(latitude, longitude)
+        now = time.time()
+        self.conn.execute("INSERT INTO geocode_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          (row, col, float(latitude), float(longitude), json.dumps(response), now, now))
+        self.conn.commit()
+
+    def evict(self) -> int:
+        """
+        Drop expired entries, then the least recently used entries above max_entries. Returns the number dropped
+        """
+        before = self.conn.total_changes
+        self.conn.execute("DELETE FROM geocode_cache WHERE created_at < ?", (time.time() - self.ttl_days * 86400,))
+        self.conn.execute("""
+            DELETE FROM geocode_cache WHERE rowid NOT IN (
+                SELECT rowid FROM geocode_cache ORDER BY last_used DESC LIMIT ?)""", (self.max_entries,))
+        self.conn.commit()
+        return self.conn.total_changes - before
+
+    def close(self) -> None:
+        """
+        Close the database
+        """
+        self.conn.close()
+
+    def _cell(self, latitude: float, longitude: float) -> tuple:
+        """
+        Grid cell of about radius_m x radius_m meters holding a coordinate
+        """
+        cell_deg = math.degrees(self.radius_m / EARTH_RADIUS_M)
+        return (math.floor(latitude / cell_deg),
+                math.floor(longitude * max(math.cos(math.radians(latitude)), 0.01) / cell_deg))
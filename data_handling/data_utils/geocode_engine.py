@@ -0,0 +1,202 @@
+# Third Party Imports
+import googlemaps
+
+# Native Imports
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import threading
+import random
+import json
+import time
+
+# GoogleMaps Geocoding API quota
+QUERIES_PER_MINUTE = 3000
+
+
+class TokenBucket():
+    """
+    Thread-safe token bucket. Tokens refill continuously at rate per second up to capacity, and every request
+    takes one, so any number of threads sharing the bucket stay under the quota together
+
+    Attributes
+    ----------
+    rate : float
+        tokens added per second
+    capacity : float
+        most tokens the bucket holds, i.e. the largest burst allowed after an idle period
+
+    Methods
+    -------
+    acquire()
+        block until a token is available and take it
+    """
+    def __init__(self, rate: float = QUERIES_PER_MINUTE / 60, capacity: float = 1):
+        """
+        Initialize TokenBucket
+
+        Parameters
+        -----------
+        rate : float [optional]
+            tokens added per second
+        capacity : float [optional]
+            most tokens the bucket holds, the bucket starts full. Any one second sees at most capacity + rate
+            requests
+
+        Returns
+        -----------
+        None
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Block until a token is available and take it
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def reverse_geocode_with_retry(client: googlemaps.Client, latlng: tuple, limiter: TokenBucket,
+                               max_retries: int = 6, backoff_s: float = 0.5) -> list:
+    """
+    Function to reverse geocode one coordinate, taking a token from the limiter before every attempt. Requests
+    refused with OVER_QUERY_LIMIT are retried with exponential backoff and jitter
+
+    Parameters
+    -----------
+    client : googlemaps.Client
+        client for GoogleMaps API, should be created with retry_over_query_limit=False so the refusals reach
+        this function instead of being retried inside the client
+    latlng : tuple
+        (latitude, longitude) in degrees
+    limiter : TokenBucket
+        rate limiter shared by every thread
+    max_retries : int [optional]
+        number of retries before the OVER_QUERY_LIMIT error is raised
+    backoff_s : float [optional]
+        delay before the first retry, doubled for every following one
+
+    Returns
+    -----------
+    response : list
+        response from client.reverse_geocode
+    """
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            return client.reverse_geocode(latlng)
+        except googlemaps.exceptions.ApiError as e:
+            if e.status != 'OVER_QUERY_LIMIT' or attempt == max_retries:
+                raise
+            time.sleep(backoff_s * 2 ** attempt * (0.5 + random.random()))
+
+
+def load_checkpoint(path: str) -> dict:
+    """
+    Function to read the responses saved by geocode_concurrent. A line cut short by a crash is ignored
+
+    Parameters
+    -----------
+    path : str
+        location of the JSON lines checkpoint
+
+    Returns
+    -----------
+    checkpoint : dict
+        {cluster_label: (latitude, longitude, response)}, empty if the file doesn't exist
+    """
+    checkpoint = {}
+    if not Path(path).exists():
+        return checkpoint
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            checkpoint[entry['cluster_label']] = (entry['latitude'], entry['longitude'], entry['response'])
+    return checkpoint
+
+
+def geocode_concurrent(client: googlemaps.Client, coordinates: dict, limiter: TokenBucket = None,
+                       n_workers: int = 8, checkpoint_path: str = None, on_result=None) -> dict:
+    """
+    Function to reverse geocode many coordinates with a thread pool. The threads share one token bucket, so
+    throughput follows the quota instead of the round trip time. Every response is appended to the
+    checkpoint as soon as it arrives, and responses already in the checkpoint for the same label and
+    coordinates are not requested again
+
+    Parameters
+    -----------
+    client : googlemaps.Client
+        client for GoogleMaps API
+    coordinates : dict
+        {cluster_label: (latitude, longitude)}, labels must be strings
+    limiter : TokenBucket [optional]
+        rate limiter, defaults to a bucket refilled at QUERIES_PER_MINUTE
+    n_workers : int [optional]
+        number of requests in flight at once
+    checkpoint_path : str [optional]
+        JSON lines file the responses are appended to, None for no checkpoint
+    on_result : callable [optional]
+        called as on_result(cluster_label, latitude, longitude, response) for every new response and every
+        response recovered from the checkpoint (a crash can come before the caller stored it), always from the
+        calling thread (e.g. to fill a cache that isn't thread-safe)
+
+    Returns
+    -----------
+    geocode_results : dict
+        dictionary containing {cluster_label: api_response}
+    """
+    limiter = limiter if limiter is not None else TokenBucket()
+    geocode_results = {}
+    if checkpoint_path is not None:
+        for cluster_label, (lat, lon, response) in load_checkpoint(checkpoint_path).items():
+            if coordinates.get(cluster_label) == (lat, lon):
+                geocode_results[cluster_label] = response
+                if on_result is not None:
+                    on_result(cluster_label, lat, lon, response)
+        if geocode_results:
+            print(f"{len(geocode_results)} responses recovered from the checkpoint")
+    pending = {label: latlng for label, latlng in coordinates.items() if label not in geocode_results}
+
+    checkpoint = open(checkpoint_path, 'a') if checkpoint_path is not None else None
+    try:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(reverse_geocode_with_retry, client, latlng, limiter): label
+                       for label, latlng in pending.items()}
+            try:
+                for i, future in enumerate(as_completed(futures)):
+                    if i % 50 == 0:
+                        print(f"{100*(i/len(futures)):.1f}% Complete")
+                    cluster_label = futures[future]
+                    lat, lon = pending[cluster_label]
+                    response = future.result()
+                    geocode_results[cluster_label] = response
+                    if checkpoint is not None:
+                        checkpoint.write(json.dumps({'cluster_label': cluster_label, 'latitude': lat,
+                                                     'longitude': lon, 'response': response}) + '\n')
+                        checkpoint.flush()
+                    if on_result is not None:
+                        on_result(cluster_label, lat, lon, response)
+            except BaseException:
+                # don't keep paying for requests whose results can't be used
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    return geocode_results
@@ -0,0 +1,94 @@
+# Third Party Imports
+import pandas as pd
+import numpy as np
+from anyascii import anyascii
+
+# Native Imports
+from functools import lru_cache
+
+"""
+Flattening of GoogleMaps reverse geocoding responses into columnar tables. The nested response dicts are
+walked once, appending to flat column lists, and everything after that (filtering, ordering, pivoting,
+normalization) is done with vectorized pandas operations
+"""
+
+
+@lru_cache(maxsize=None)
+def transliterate(text: str) -> str:
+    """
+    anyascii, memoized: the same street, city and country names come back in many responses
+    """
+    return anyascii(text)
+
+
+def flatten_responses(geocode_results: dict) -> dict:
+    """
+    Function to flatten reverse geocoding responses into three tables in one pass
+
+    Parameters
+    -----------
+    geocode_results : dict
+        dictionary containing {cluster_label: api_response}, labels as strings
+
+    Returns
+    -----------
+    tables : dict
+        'results'    : one row per result, ['result_id','cluster_key','location_type','formatted_address','place_id']
+        'types'      : one row per type of a result, ['result_id','tag']
+        'components' : one row per address component of the first result of every response,
+                       ['cluster_key','component_type','long_name'], component_type being the component's first type
+    """
+    cluster_key, location_type, formatted_address, place_id = [], [], [], []
+    type_result_id, tags = [], []
+    component_key, component_type, long_name = [], [], []
+    for key, response in geocode_results.items():
+        for i, item in enumerate(response):
+            rid = len(cluster_key)
+            cluster_key.append(key)
+            location_type.append(item['geometry']['location_type'])
+            formatted_address.append(item.get('formatted_address'))
+            place_id.append(item.get('place_id'))
+            item_types = item.get('types')
+            if isinstance(item_types, list):
+                type_result_id.extend([rid] * len(item_types))
+                tags.extend(item_types)
+            if i == 0:
+                components = item.get('address_components', [])
+                component_key.extend([key] * len(components))
+                component_type.extend([comp['types'][0] for comp in components])
+                long_name.extend([comp['long_name'] for comp in components])
+
+    return {'results': pd.DataFrame({'result_id': np.arange(len(cluster_key), dtype=np.int64),
+                                     'cluster_key': pd.Series(cluster_key, dtype=object),
+                                     'location_type': pd.Series(location_type, dtype=object),
+                                     'formatted_address': pd.Series(formatted_address, dtype=object),
+                                     'place_id': pd.Series(place_id, dtype=object)}),
+            'types': pd.DataFrame({'result_id': np.array(type_result_id, dtype=np.int64),
+                                   'tag': pd.Series(tags, dtype=object)}),
+            'components': pd.DataFrame({'cluster_key': pd.Series(component_key, dtype=object),
+                                        'component_type': pd.Series(component_type, dtype=object),
+                                        'long_name': pd.Series(long_name, dtype=object)})}
+
+
+def group_mode(df: pd.DataFrame, by: str, col: str) -> pd.Series:
+    """
+    Function to find the most frequent value of col in every group, ties going to the largest value. Same
+    result as groupby(by)[col].agg(pd.Series.mode) followed by explode, keeping the last row of every group
+
+    Parameters
+    -----------
+    df : pd.DataFrame
+        contains columns by and col
+    by : str
+        column to group by
+    col : str
+        column to take the mode of
+
+    Returns
+    -----------
+    mode : pd.Series
+        most frequent value of col, indexed by the values of by
+    """
+    counts = df.groupby([by, col], sort=False).size().rename('n').reset_index()
+    counts = counts.sort_values(['n', col], kind='stable').drop_duplicates(by, keep='last')
+    return counts.set_index(by)[col]
@@ -3,12 +3,14 @@ import googlemaps
 from dotenv import load_dotenv
 import pandas as pd
 import numpy as np
-from anyascii import anyascii
 
 # Native
-import time
 import os
 
+# Custom
+from .geocode_engine import TokenBucket, geocode_concurrent, QUERIES_PER_MINUTE
+from .geocode_tables import flatten_responses, group_mode, transliterate
+
 """
 In order to use this script the Google Cloud SDK Shell needs to be running
 
@@ -32,19 +34,30 @@ class Geocoder():
     geocode_results : dict
         dict containing {cluster label: api_response}
     df : pandas DataFrame
-        has columns ['cluster_label','latitude','longitude']
+        has column 'cluster_label', the centroid table of the last geocode_clusters call
+    cache : GeocodeCache
+        on-disk cache of responses checked before calling the API, None calls the API for every cluster
+    limiter : TokenBucket
+        rate limiter shared by the concurrent requests, refilled at QUERIES_PER_MINUTE
+    tables : dict
+        the responses flattened by process_geocode, see geocode_tables.flatten_responses
+    local : Gazetteer
+        offline tier answering the clusters that only need coarse address fields, None sends every cluster
+        to the API
 
     Methods
     -------
     check_state()
         ensure client is running correctly
     geocode_clusters(df)
-        make the API call to GoogleMaps API and save result
+        make the API call to GoogleMaps API for the centroid of every cluster and save result
+    geocode_centroids(centroids)
+        make the API call to GoogleMaps API for a table of cluster centroids and save result
     process_geocode()
         process the results from the API responses
 
     """
-    def __init__(self, geocode_results = None, df = None):
+    def __init__(self, geocode_results = None, df = None, cache = None, local = None):
         """
         Initialize Geocoder
 
@@ -54,6 +67,10 @@ class Geocoder():
             load pre-saved results from API call
         df : pandas DataFrame [optional]
             load a dataframe
+        cache : GeocodeCache [optional]
+            on-disk cache of responses checked before calling the API
+        local : Gazetteer [optional]
+            offline tier for the clusters that only need coarse address fields
 
         Returns
         -----------
@@ -63,12 +80,16 @@ class Geocoder():
         load_dotenv() # take environment variables from .env.
         self.google_api_key = os.environ.get("GOOGLE_API_KEY")
         # Set up googlemaps client for reverse geocoding
-        self.client = googlemaps.Client(key=f"{self.google_api_key}")
+        # OVER_QUERY_LIMIT is retried by geocode_engine, so the retries also go through the rate limiter
+        self.client = googlemaps.Client(key=f"{self.google_api_key}", retry_over_query_limit=False)
+        self.limiter = TokenBucket(rate=QUERIES_PER_MINUTE / 60)
 
         if geocode_results is not None:
             self.geocode_results = geocode_results
         if df is not None:
             self.df = df
+        self.cache = cache
+        self.local = local
 
     def check_state(self):
         """
@@ -81,31 +102,96 @@ class Geocoder():
             print(e)
 
     # Request reverse geocoding from google api
-    def geocode_clusters(self, df: pd.DataFrame) -> dict:
+    def geocode_clusters(self, df: pd.DataFrame, n_workers: int = 8, checkpoint_path: str = None,
+                         coarse: np.ndarray = None) -> dict:
         """
-        Request reverse geocoding from GoogleMaps API
+        Request reverse geocoding from GoogleMaps API for the centroid of every cluster
 
         Parameters
         -----------
         df : pandas DataFrame
-            contains columns ['cluster_label','latitude','longitude']
+            contains columns ['cluster_label','latitude','longitude'], or one row per cluster with
+            ['cluster_label','centroid_latitude','centroid_longitude'] (see utils.cluster_summary)
+        n_workers : int [optional]
+            number of requests in flight at once
+        checkpoint_path : str [optional]
+            JSON lines file every response is appended to as it arrives, responses already in it for the same
+            cluster and coordinates are reused after a crash
+        coarse : np.ndarray [optional]
+            only with a centroid table, True for the clusters that only need coarse address fields
 
         Returns
         -----------
         geocode_results : dict
             dictionary containing {cluster_label: api_response}
         """
-        self.df = df
-        total_len = df['cluster_label'].nunique()
-        self.geocode_results = {}
-        for i, cluster_label in enumerate(list(df['cluster_label'].unique())):
-            if i%50 == 0:
-                print(f"{100*(i/total_len):.1f}% Complete")
-            # reverse geocode the mean lat and lon of the cluster
-            lat, lon = df[df['cluster_label'] == cluster_label][['latitude','longitude']].mean().values
-            self.geocode_results[str(cluster_label)] = self.client.reverse_geocode((lat, lon))
-            time.sleep(.02) # to stay under the 3000 requests per minute ~ .02 sec per request
+        if 'centroid_latitude' in df.columns:
+            centroids = df[['cluster_label','centroid_latitude','centroid_longitude']]
+        else:
+            # the mean lat and lon of every cluster in one grouped pass, clusters in order of first appearance
+            centroids = (df.groupby('cluster_label', sort=False, observed=True)[['latitude','longitude']].mean()
+                           .reset_index()
+                           .rename(columns={'latitude': 'centroid_latitude', 'longitude': 'centroid_longitude'}))
+        return self.geocode_centroids(centroids, n_workers=n_workers, checkpoint_path=checkpoint_path, coarse=coarse)
+
+    def geocode_centroids(self, centroids: pd.DataFrame, n_workers: int = 8, checkpoint_path: str = None,
+                          coarse: np.ndarray = None) -> dict:
+        """
+        Request reverse geocoding from GoogleMaps API for a batch of coordinates. Requests are sent
+        concurrently, sharing a token bucket that keeps them under the API quota (see
+        geocode_engine.geocode_concurrent)
 
+        Parameters
+        -----------
+        centroids : pandas DataFrame
+            one row per cluster with ['cluster_label','centroid_latitude','centroid_longitude']
+        n_workers : int [optional]
+            number of requests in flight at once
+        checkpoint_path : str [optional]
+            JSON lines file every response is appended to as it arrives
+        coarse : np.ndarray [optional]
+            True for the rows of centroids that only need coarse address fields (locality,
+            administrative_area_level_1, country). With a local gazetteer they are answered offline
+
+        Returns
+        -----------
+        geocode_results : dict
+            dictionary containing {cluster_label: api_response}, in the order of centroids
+        """
+        # process_geocode only needs the cluster labels, so the centroid table stands in for the points
+        self.df = centroids
+        coordinates = {str(cluster_label): (float(lat), float(lon)) for cluster_label, lat, lon in
+                       zip(centroids['cluster_label'], centroids['centroid_latitude'], centroids['centroid_longitude'])}
+
+        self.geocode_results = {}
+        if self.local is not None and coarse is not None and np.any(coarse):
+            coarse = np.asarray(coarse, dtype=bool)
+            responses = self.local.reverse_geocode_many(centroids['centroid_latitude'].values[coarse],
+                                                        centroids['centroid_longitude'].values[coarse])
+            self.geocode_results.update(zip([label for label, is_coarse in zip(coordinates, coarse) if is_coarse], responses))
+            print(f"{coarse.sum()} clusters answered by the local gazetteer")
+        if self.cache is not None:
+            # places geocoded on an earlier run (under any label) are served from the cache
+            n_answered = len(self.geocode_results)
+            for cluster_label, (lat, lon) in coordinates.items():
+                if cluster_label in self.geocode_results:
+                    continue
+                response = self.cache.get(lat, lon)
+                if response is not None:
+                    self.geocode_results[cluster_label] = response
+            print(f"{len(self.geocode_results) - n_answered} clusters served from the geocode cache")
+        to_request = {label: latlng for label, latlng in coordinates.items() if label not in self.geocode_results}
+        print(f"{len(to_request)} clusters to request from the GoogleMaps API")
+
+        # the cache is filled from this thread, sqlite connections can't be shared between threads
+        on_result = (lambda label, lat, lon, response: self.cache.put(lat, lon, response)) if self.cache is not None else None
+        self.geocode_results.update(geocode_concurrent(self.client, to_request, self.limiter, n_workers=n_workers,
+                                                       checkpoint_path=checkpoint_path, on_result=on_result))
+        # keep the order of the clusters
+        self.geocode_results = {label: self.geocode_results[label] for label in coordinates}
+
+        if self.cache is not None:
+            self.cache.evict()
         return self.geocode_results
 
     
@@ -127,56 +213,35 @@ class Geocoder():
             contains columns ['cluster_label','address'] one row per possible address
 
         """
-        # Initialize empty lists to collect data for our new DataFrames
-        all_tags = []
-        all_place_ids = []
-        all_addresses = []
-
-        # --- Process special clusters (-3 and -1) ---
-        # For transit clusters (-3)
-        label = -3
-        all_tags.append({'cluster_label': label, 'tag': 'transit'})
-        all_place_ids.append({'cluster_label': label, 'place_id': 'none'})
-        all_addresses.append({'cluster_label': label, 'address': 'none'})
-
-        # For outlier clusters (-1)
-        label = -1
-        all_tags.append({'cluster_label': label, 'tag': 'outlier'})
-        all_place_ids.append({'cluster_label': label, 'place_id': 'none'})
-        all_addresses.append({'cluster_label': label, 'address': 'none'})
-
-        # Get labels that are not special cases and exist in geocode_results
+        # Flatten every response into columnar tables in one pass
+        self.tables = flatten_responses(self.geocode_results)
+
+        # --- Special clusters (-3 and -1) come first ---
+        special = pd.DataFrame({'cluster_label': [-3, -1], 'tag': ['transit', 'outlier'],
+                                'place_id': ['none', 'none'], 'address': ['none', 'none']})
+
+        # Get labels that are not special cases and exist in geocode_results, in the order of the clusters
         regular_cluster_labels = [
             label for label in self.df['cluster_label'].unique()
             if label not in [-1, -2, -3] and str(label) in self.geocode_results
         ]
-
-        for cluster_label in regular_cluster_labels:
-            geocoded_items = self.geocode_results[str(cluster_label)]
-            
-            filtered_results = [
-                item for item in geocoded_items
-                if item['geometry']['location_type'] not in ['RANGE_INTERPOLATED', 'APPROXIMATE']
-            ]
-
-            for item in filtered_results:
-                # Tags
-                if 'types' in item and isinstance(item['types'], list):
-                    for tag in item['types']:
-                        all_tags.append({'cluster_label': cluster_label, 'tag': tag})
-                
-                # Place IDs
-                if 'place_id' in item:
-                    all_place_ids.append({'cluster_label': cluster_label, 'place_id': item['place_id']})
-                
-                # Addresses
-                if 'formatted_address' in item:
-                    all_addresses.append({'cluster_label': cluster_label, 'address': item['formatted_address']})
+        order = pd.DataFrame({'cluster_key': [str(label) for label in regular_cluster_labels],
+                              'cluster_label': np.asarray(regular_cluster_labels, dtype=np.int64),
+                              'position': np.arange(len(regular_cluster_labels))})
+        results = self.tables['results']
+        results = results[~results['location_type'].isin(['RANGE_INTERPOLATED', 'APPROXIMATE'])]
+        results = results.merge(order, on='cluster_key').sort_values(['position', 'result_id'], kind='stable')
+        tags = results[['result_id', 'cluster_label']].merge(self.tables['types'], on='result_id')
 
         # Create the new DataFrames
-        self.df_tags = pd.DataFrame(all_tags)
-        self.df_place_ids = pd.DataFrame(all_place_ids)
-        self.df_possible_addresses = pd.DataFrame(all_addresses)
+        self.df_tags = pd.concat([special[['cluster_label', 'tag']], tags[['cluster_label', 'tag']]], ignore_index=True)
+        self.df_place_ids = pd.concat([special[['cluster_label', 'place_id']],
+                                       results.loc[results['place_id'].notna(), ['cluster_label', 'place_id']]],
+                                      ignore_index=True)
+        self.df_possible_addresses = pd.concat([special[['cluster_label', 'address']],
+                                                results.loc[results['formatted_address'].notna(), ['cluster_label', 'formatted_address']]
+                                                       .rename(columns={'formatted_address': 'address'})],
+                                               ignore_index=True)
         # Further process geocode results for city, country, etc
         # contains info only for top address in cluster, so save to new frame
         self.df_cluster_address = self.add_address_info()
@@ -195,7 +260,8 @@ class Geocoder():
     
     def add_address_info(self):
         """
-        Further process geocode results to extract the primary address's compenents
+        Further process geocode results to extract the primary address's compenents, from the tables
+        flattened by process_geocode
 
         Parameters
         -----------
@@ -211,37 +277,22 @@ class Geocoder():
                               'administrative_area_level_3','administrative_area_level_4',
                               'street_number','route','neighborhood','locality',
                               'country','postal_code','postal_code_suffix','plus_code']
-        address_info = []
-        for key in self.geocode_results.keys():
-            if key in ['-1','-3']:
-                loc_info = {comp:np.nan for comp in address_components}
-                loc_info['cluster_label'] = key
-                address_info.append(loc_info)
-            else:
-                parsed_components = {}
-                for comp in self.geocode_results[key][0]['address_components']:
-                    component_type = comp['types'][0]
-                    if component_type in address_components:
-                        long_name_value = comp['long_name']
-                        
-                        # Check if the value is not None and convert it to string
-                        if long_name_value is not None:
-                            # anyascii converts non-english characters to their closest equivalent
-                            parsed_components[component_type] = anyascii(str(long_name_value))
-                        else:
-                            parsed_components[component_type] = np.nan
-
-                # build the final loc_info dictionary
-                loc_info = {
-                    tag: parsed_components.get(tag, np.nan)
-                    for tag in address_components
-                }
-                loc_info['cluster_label'] = key
-                address_info.append(loc_info)
-
-        df_cluster_address = pd.DataFrame(address_info)
-        return df_cluster_address
-    
+        components = self.tables['components']
+        # special clusters get no address, for duplicated component types the last one wins
+        components = components[~components['cluster_key'].isin(['-1', '-3'])
+                                & components['component_type'].isin(address_components[1:])]
+        components = components.drop_duplicates(['cluster_key', 'component_type'], keep='last')
+        # anyascii converts non-english characters to their closest equivalent, once per distinct name
+        long_name = components['long_name'].astype(str).where(components['long_name'].notna())
+        names = long_name.dropna().unique()
+        components = components.assign(long_name=long_name.map(dict(zip(names, map(transliterate, names)))))
+
+        df_cluster_address = (components.pivot(index='cluster_key', columns='component_type', values='long_name')
+                                        .reindex(index=list(self.geocode_results.keys()), columns=address_components[1:])
+                                        .rename_axis(index='cluster_label', columns=None)
+                                        .reset_index())
+        return df_cluster_address[address_components]
+
     def get_normalized_cluster_mapping(self):
         """
         Reduce clusters using the primary address in cluster
@@ -256,15 +307,14 @@ class Geocoder():
             dictionary that maps {cluster_label: norm_cluster_label}. Contains an entry for every cluster and maps to
             the normalized version of that cluster
         """
-        # Mapping address to most frequent cluster_label
-        tdf = self.df_possible_addresses.groupby('address')['cluster_label'].agg(pd.Series.mode).to_frame().reset_index()
-        tdf.rename(columns={'cluster_label': 'norm_cluster_label'}, inplace=True)
-        tdf = tdf.explode('norm_cluster_label')
-        # This df contains the mapping of cluster_label --> most_common_cluster_label
-        tdf = pd.merge(self.df_possible_addresses, tdf, on='address', how='left')
-
-        # Convert to dictionary
-        cluster_map = pd.Series(tdf['norm_cluster_label'].values, index=tdf['cluster_label']).to_dict()
+        # Mapping address to most frequent cluster_label (ties go to the largest label)
+        norm_labels = group_mode(self.df_possible_addresses, 'address', 'cluster_label')
+        # Every cluster maps to the most common cluster_label of the last of its addresses
+        last_address = self.df_possible_addresses.drop_duplicates('cluster_label', keep='last').set_index('cluster_label')['address']
+        cluster_map = last_address.map(norm_labels).reindex(self.df_possible_addresses['cluster_label'].unique()).to_dict()
         cluster_map[-1] = -1
         cluster_map[-3] = -3
+        # clusters without a precise address (e.g. answered by the local gazetteer) stay on their own
+        for key in self.geocode_results:
+            cluster_map.setdefault(int(key), int(key))
         return cluster_map
@@ -0,0 +1,151 @@
+# Third Party Imports
+import pandas as pd
+
+# Native Imports
+from pathlib import Path
+import json
+
+# Bump whenever the columns or dtypes of the combined data change, the store is then rebuilt from the raw files
+SCHEMA_VERSION = 3
+
+
+class LocationStore():
+    """
+    Class to persist the combined, de-duplicated location data of one or more tiles together with a manifest
+    of the raw files it was built from, so each run only has to parse raw files that are new or have changed
+
+    Attributes
+    ----------
+    tile_uuids : list
+        unique IDs of the tiles in the store
+    manifest_path : pathlib.Path
+        json file containing the tile_uuids and {raw file path: {'size': bytes, 'mtime_ns': modification time}}
+    store_path : pathlib.Path
+        parquet file containing the de-duplicated location data
+    manifest : dict
+        {raw file path: {'size': bytes, 'mtime_ns': modification time}} of the raw files already in the store
+
+    Methods
+    -------
+    new_files(files)
+        filter a list of raw files down to the ones not yet in the store
+    load()
+        read the stored location data
+    merge(df)
+        merge newly parsed location data into the stored data
+    save(df, files)
+        write the location data and add the files to the manifest
+    """
+    def __init__(self, statepath: str, tile_uuids: list):
+        """
+        Initialize LocationStore
+
+        Parameters
+        -----------
+        statepath : str
+            directory holding the manifest and the store, created on first save
+        tile_uuids : list
+            unique IDs of the tiles in the store. A single tile gets its own store, several tiles share one.
+            If the tiles (or SCHEMA_VERSION) differ from the ones the store was built for, it is rebuilt from scratch
+
+        Returns
+        -----------
+        None
+        """
+        self.tile_uuids = list(tile_uuids)
+        name = self.tile_uuids[0] if len(self.tile_uuids) == 1 else 'all_tiles'
+        self.manifest_path = Path(statepath) / f"manifest_{name}.json"
+        self.store_path = Path(statepath) / f"locations_{name}.parquet"
+        self.manifest = {}
+        if self.manifest_path.exists() and self.store_path.exists():
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+            if sorted(manifest.get('tile_uuids', [])) == sorted(self.tile_uuids) and \
+               manifest.get('schema_version') == SCHEMA_VERSION:
+                self.manifest = manifest['files']
+
+    def new_files(self, files: list) -> list:
+        """
+        Filter a list of raw files down to the ones that are not in the manifest or whose size or
+        modification time changed since they were ingested (e.g. partitions that were appended to)
+
+        Parameters
+        -----------
+        files : list
+            list of raw file paths
+
+        Returns
+        -----------
+        new_files : list
+            list of raw file paths that need to be parsed
+        """
+        new_files = []
+        for file in files:
+            stat = Path(file).stat()
+            entry = self.manifest.get(str(file))
+            if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+                new_files.append(file)
+        return new_files
+
+    def load(self) -> pd.DataFrame:
+        """
+        Read the stored location data, returns an empty DataFrame if nothing has been stored yet
+        """
+        if not self.store_path.exists():
+            return pd.DataFrame()
+        return pd.read_parquet(self.store_path)
+
+    def merge(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Merge newly parsed location data into the stored data. Rows from df win over stored rows with the
+        same tile_uuid and location_timestamp
+
+        Parameters
+        -----------
+        df : pd.DataFrame
+            newly parsed location data, output of combine_data
+
+        Returns
+        -----------
+        df : pd.DataFrame
+            stored and new location data, de-duplicated and sorted by tile and datetime
+        """
+        stored = self.load() if self.manifest else pd.DataFrame()
+        if stored.empty:
+            return df
+        if df.empty:
+            return stored
+        df = pd.concat([stored, df], ignore_index=True)
+        # concat only keeps the categorical dtype when the categories match, so restore it
+        for col in ['tile_uuid', 'tile_name']:
+            df[col] = df[col].astype('category')
+        df = df.groupby(['tile_uuid', 'location_timestamp'], as_index=False, observed=True, sort=True).last()
+        return df[stored.columns]
+
+    def save(self, df: pd.DataFrame, files: list) -> None:
+        """
+        Write the location data, then add the files it was built from to the manifest
+
+        Parameters
+        -----------
+        df : pd.DataFrame
+            merged location data
+        files : list
+            list of raw file paths that were parsed this run
+
+        Returns
+        -----------
+        None
+        """
+        self.store_path.parent.mkdir(parents=True, exist_ok=True)
+        if not df.empty:
+            df.to_parquet(self.store_path, index=False)
+        for file in files:
+            stat = Path(file).stat()
+            self.manifest[str(file)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        # manifest goes last, a crash in between only means some files get parsed again
+        tmp_path = self.manifest_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'schema_version': SCHEMA_VERSION, 'tile_uuids': self.tile_uuids, 'files': self.manifest},
+                      f, indent=2)
+        tmp_path.replace(self.manifest_path)
@@ -0,0 +1,179 @@
+# Third Party Imports
+import msgspec
+import numpy as np
+
+# Native Imports
+from pathlib import Path
+from typing import Optional
+import mmap
+
+# Custom Imports
+from .raw_store import iter_members
+
+"""
+Selective parsing of the raw Tile data. Only the requested tiles' location updates are decoded, and only the
+fields the pipeline uses, straight into typed structs that are then turned into numpy columns. Everything
+else in a file (other tiles, unused fields) is skipped by msgspec without building Python objects
+"""
+
+LOCATION_COLUMNS = {'tile_index': np.int16, # position of the tile in the list of requested tiles
+                    'location_timestamp': np.int64,
+                    'latitude': np.float64,
+                    'longitude': np.float64,
+                    'raw_precision': np.float64,
+                    'precision': np.float64}
+
+
+class LocationUpdate(msgspec.Struct):
+    location_timestamp: Optional[int] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    raw_precision: Optional[float] = None
+    precision: Optional[float] = None
+
+
+class _HistoryResult(msgspec.Struct):
+    location_updates: list[LocationUpdate] = []
+
+
+class _History(msgspec.Struct):
+    result: Optional[_HistoryResult] = None
+
+
+# strict=False lets numbers sent as strings through, like json.load + pd.DataFrame did
+_snapshot_decoder = msgspec.json.Decoder(dict[str, msgspec.Raw])
+_history_decoder = msgspec.json.Decoder(_History, strict=False)
+_update_decoder = msgspec.json.Decoder(LocationUpdate, strict=False)
+
+
+def empty_columns() -> dict:
+    """
+    Columns for a file without any location updates for the requested tiles
+    """
+    return {col: np.empty(0, dtype=dtype) for col, dtype in LOCATION_COLUMNS.items()}
+
+
+def updates_to_columns(location_updates: list, tile_index: int) -> dict:
+    """
+    Function to turn a list of LocationUpdate structs into numpy columns. Updates without a
+    location_timestamp are dropped, missing floats become NaN
+
+    Parameters
+    -----------
+    location_updates : list
+        list of LocationUpdate
+    tile_index : int
+        position of the tile the updates belong to in the list of requested tiles
+
+    Returns
+    -----------
+    columns : dict
+        {column name: np.array} for every column in LOCATION_COLUMNS
+    """
+    location_updates = [update for update in location_updates if update.location_timestamp is not None]
+    columns = {'location_timestamp': np.fromiter((u.location_timestamp for u in location_updates),
+                                                 dtype=np.int64, count=len(location_updates))}
+    for col in ['latitude', 'longitude', 'raw_precision', 'precision']:
+        columns[col] = np.fromiter((np.nan if getattr(u, col) is None else getattr(u, col) for u in location_updates),
+                                   dtype=np.float64, count=len(location_updates))
+    columns['tile_index'] = np.full(len(location_updates), tile_index, dtype=np.int16)
+    return columns
+
+
+def parse_snapshot(path, tile_uuids: list) -> dict:
+    """
+    Function to parse the requested tiles' location updates from a daily snapshot ('data_<date>.json'). The
+    file is memory-mapped and the histories of any other tiles are only scanned over, never decoded
+
+    Parameters
+    -----------
+    path : str or pathlib.Path
+        path to the snapshot
+    tile_uuids : list
+        unique IDs of the tiles to extract
+
+    Returns
+    -----------
+    columns : dict
+        {column name: np.array} for every column in LOCATION_COLUMNS
+    """
+    if Path(path).stat().st_size == 0:
+        return empty_columns()
+
+    batches = []
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            tiles = _snapshot_decoder.decode(buffer)
+            for tile_index, tile_uuid in enumerate(tile_uuids):
+                if tile_uuid not in tiles:
+                    continue
+                history = _history_decoder.decode(tiles[tile_uuid])
+                if history.result is not None:
+                    batches.append(updates_to_columns(history.result.location_updates, tile_index))
+            # release the views into the mapped file before it is closed
+            del tiles
+    return concat_columns(batches)
+
+
+def parse_partition(path, tile_index: int = 0) -> dict:
+    """
+    Function to parse a tile's partition ('<tile_uuid>/<date>.jsonl.gz'), one gzip member at a time
+
+    Parameters
+    -----------
+    path : str or pathlib.Path
+        path to the partition
+    tile_index : int [optional]
+        position of the partition's tile in the list of requested tiles
+
+    Returns
+    -----------
+    columns : dict
+        {column name: np.array} for every column in LOCATION_COLUMNS
+    """
+    location_updates = []
+    for member in iter_members(path):
+        location_updates.extend(_update_decoder.decode_lines(member))
+    return updates_to_columns(location_updates, tile_index)
+
+
+def parse_raw_file(path, tile_uuids: list) -> dict:
+    """
+    Function to parse the requested tiles' location updates from any raw file into numpy columns
+
+    Parameters
+    -----------
+    path : str or pathlib.Path
+        path to a daily snapshot or a partition of one of the tiles
+    tile_uuids : list
+        unique IDs of the tiles to extract
+
+    Returns
+    -----------
+    columns : dict
+        {column name: np.array} for every column in LOCATION_COLUMNS
+    """
+    path = Path(path)
+    if path.name.endswith('.jsonl.gz'):
+        # partitions live in a folder named after their tile
+        return parse_partition(path, tile_uuids.index(path.parent.name))
+    return parse_snapshot(path, tile_uuids)
+
+
+def concat_columns(batches: list) -> dict:
+    """
+    Function to concatenate column batches from several files into one set of columns
+
+    Parameters
+    -----------
+    batches : list
+        list of column dicts returned by parse_raw_file
+
+    Returns
+    -----------
+    columns : dict
+        {column name: np.array} for every column in LOCATION_COLUMNS
+    """
+    if not batches:
+        return empty_columns()
+    return {col: np.concatenate([batch[col] for batch in batches]) for col in LOCATION_COLUMNS}
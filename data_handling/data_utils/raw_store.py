@@ -0,0 +1,170 @@
+# Native Imports
+from datetime import datetime, timezone
+from pathlib import Path
+import gzip
+import json
+import zlib
+
+
+class RawWriter():
+    """
+    Class to stream Tile location updates to the raw folder as they arrive. Updates are written as gzip
+    compressed newline-delimited json, partitioned by tile uuid and the (UTC) date of the update:
+
+        raw/<tile_uuid>/<YYYY-MM-DD>.jsonl.gz
+
+    Every write appends a new gzip member to the partition, so nothing already on disk is rewritten
+
+    Attributes
+    ----------
+    datapath : pathlib.Path
+        root of the raw data folder
+    counts : dict
+        dict containing {tile_uuid: number of updates written by this writer}
+
+    Methods
+    -------
+    write(tile_uuid, location_updates)
+        append location updates to their partitions
+    """
+    def __init__(self, datapath: str):
+        """
+        Initialize RawWriter
+
+        Parameters
+        -----------
+        datapath : str
+            root of the raw data folder
+
+        Returns
+        -----------
+        None
+        """
+        self.datapath = Path(datapath)
+        self.counts = {}
+
+    def write(self, tile_uuid: str, location_updates: list) -> None:
+        """
+        Append location updates to the partition of their tile and date
+
+        Parameters
+        -----------
+        tile_uuid : str
+            unique ID for the tile
+        location_updates : list
+            list of location update dicts from a tile.async_history response
+
+        Returns
+        -----------
+        None
+        """
+        partitions = {}
+        for update in location_updates:
+            date = partition_date(update.get('location_timestamp'))
+            partitions.setdefault(date, []).append(update)
+
+        tile_dir = self.datapath / tile_uuid
+        tile_dir.mkdir(parents=True, exist_ok=True)
+        for date, updates in partitions.items():
+            lines = ''.join(json.dumps(update) + '\n' for update in updates)
+            # one compressed member per write, so a partial write can only damage the tail of the file
+            with open(tile_dir / f"{date}.jsonl.gz", 'ab') as f:
+                f.write(gzip.compress(lines.encode('utf-8')))
+        self.counts[tile_uuid] = self.counts.get(tile_uuid, 0) + len(location_updates)
+
+
+def partition_date(location_timestamp) -> str:
+    """
+    Partition name for a location_timestamp (ms since epoch), updates without a timestamp go to 'unknown'
+    """
+    if location_timestamp is None:
+        return 'unknown'
+    return datetime.fromtimestamp(location_timestamp / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+
+
+def iter_members(path):
+    """
+    Iterate over the decompressed gzip members of a raw partition. A truncated final member (e.g. from a
+    crash during a write) is skipped instead of failing the whole partition
+
+    Parameters
+    -----------
+    path : str or pathlib.Path
+        path to a '.jsonl.gz' partition
+
+    Yields
+    -----------
+    member : bytes
+        newline-delimited json of one write
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    while data:
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16) # gzip header
+        try:
+            member = decompressor.decompress(data)
+        except zlib.error:
+            return
+        if not decompressor.eof:
+            return # truncated member
+        yield member
+        data = decompressor.unused_data
+
+
+def read_partition(path) -> list:
+    """
+    Read every location update from a raw partition as dicts
+
+    Parameters
+    -----------
+    path : str or pathlib.Path
+        path to a '.jsonl.gz' partition
+
+    Returns
+    -----------
+    location_updates : list
+        list of location update dicts
+    """
+    return [json.loads(line) for member in iter_members(path) for line in member.splitlines() if line]
+
+
+def list_partitions(datapath: str, tile_uuid: str) -> list:
+    """
+    List the raw partitions for a tile, sorted by date
+
+    Parameters
+    -----------
+    datapath : str
+        root of the raw data folder
+    tile_uuid : str
+        unique ID for the tile
+
+    Returns
+    -----------
+    partitions : list
+        list of pathlib.Path pointing to the '.jsonl.gz' partitions
+    """
+    return sorted((Path(datapath) / tile_uuid).glob('*.jsonl.gz'))
+
+
+def list_raw_files(datapath: str, tile_uuids: list) -> list:
+    """
+    List every raw file that can hold updates for the tiles: the daily snapshots plus each tile's partitions
+
+    Parameters
+    -----------
+    datapath : str
+        root of the raw data folder
+    tile_uuids : list
+        unique IDs of the tiles
+
+    Returns
+    -----------
+    files : list
+        list of pathlib.Path
+    """
+    files = sorted(Path(datapath).glob('*.json'))
+    for tile_uuid in tile_uuids:
+        files.extend(list_partitions(datapath, tile_uuid))
+    return files
@@ -0,0 +1,187 @@
+# Native Imports
+import asyncio
+from datetime import datetime
+from pathlib import Path
+import json
+
+
+def split_windows(start: datetime, end: datetime, months: int = 1) -> list:
+    """
+    Split a date range into windows aligned to the start of a month
+
+    Parameters
+    -----------
+    start : datetime
+        start of the range
+    end : datetime
+        end of the range
+    months : int [optional]
+        number of calendar months in each window
+
+    Returns
+    -----------
+    windows : list
+        list of (window_start, window_end) tuples covering [start, end)
+    """
+    windows = []
+    window_start = start
+    while window_start < end:
+        # first day of the month 'months' after window_start
+        month_index = window_start.year * 12 + (window_start.month - 1) + months
+        boundary = datetime(month_index // 12, month_index % 12 + 1, 1)
+        window_end = min(boundary, end)
+        windows.append((window_start, window_end))
+        window_start = window_end
+    return windows
+
+
+class HistoryFetcher():
+    """
+    Class to fetch the location history of many tiles concurrently. Each tile's range is split into
+    date windows, every window is requested in parallel under a shared concurrency limit, and each response
+    is handed to a RawWriter as soon as it arrives. Finished windows are checkpointed to disk so a failed run
+    can resume without requesting them again
+
+    Attributes
+    ----------
+    writer : RawWriter
+        writer that stores the location updates of every finished window
+    max_concurrency : int
+        maximum number of requests in flight at once
+    retries : int
+        number of attempts per window before giving up
+    backoff : float
+        seconds to wait before the first retry, doubled after every failed attempt
+    window_months : int
+        number of calendar months in each window
+    checkpoint_dir : pathlib.Path
+        directory holding one json file per finished window
+
+    Methods
+    -------
+    fetch_all(tiles, starts, end)
+        fetch and write the history of every tile, returns {tile_uuid: latest location_timestamp}
+    fetch_window(tile, start, end)
+        fetch and write one window with retries, skipped when already checkpointed
+    clear_checkpoints()
+        remove the checkpointed windows once the run has been saved
+    """
+    def __init__(self, writer, checkpoint_dir: str, max_concurrency: int = 4, retries: int = 3,
+                 backoff: float = 2.0, window_months: int = 1):
+        """
+        Initialize HistoryFetcher
+
+        Parameters
+        -----------
+        writer : RawWriter
+            writer that stores the location updates of every finished window
+        checkpoint_dir : str
+            directory to checkpoint finished windows in, created if it does not exist
+        max_concurrency : int [optional]
+            maximum number of requests in flight at once
+        retries : int [optional]
+            number of attempts per window before giving up
+        backoff : float [optional]
+            seconds to wait before the first retry
+        window_months : int [optional]
+            number of calendar months in each window
+
+        Returns
+        -----------
+        None
+        """
+        self.writer = writer
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.window_months = window_months
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+
+    async def fetch_all(self, tiles: dict, starts: dict, end: datetime) -> dict:
+        """
+        Fetch and write the history of every tile, all windows of all tiles run concurrently
+
+        Parameters
+        -----------
+        tiles : dict
+            {tile_uuid: pytile Tile} as returned by api.async_get_tiles()
+        starts : dict
+            {tile_uuid: start of the range to request}
+        end : datetime
+            end of the range to request for every tile
+
+        Returns
+        -----------
+        latest_timestamps : dict
+            {tile_uuid: latest location_timestamp fetched, None if the tile had no updates}
+        """
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = {}
+        for tile_uuid, tile in tiles.items():
+            windows = split_windows(starts[tile_uuid], end, months=self.window_months)
+            tasks[tile_uuid] = [self.fetch_window(tile, window_start, window_end)
+                                for window_start, window_end in windows]
+        print(f"Requesting {sum(len(t) for t in tasks.values())} windows for {len(tasks)} tiles")
+
+        results = await asyncio.gather(*[asyncio.gather(*window_tasks) for window_tasks in tasks.values()])
+        latest_timestamps = {}
+        for tile_uuid, window_timestamps in zip(tasks, results):
+            window_timestamps = [ts for ts in window_timestamps if ts is not None]
+            latest_timestamps[tile_uuid] = max(window_timestamps) if window_timestamps else None
+        return latest_timestamps
+
+    async def fetch_window(self, tile, start: datetime, end: datetime):
+        """
+        Fetch one window of a tile's history, retrying with exponential backoff, and write its location updates
+
+        Parameters
+        -----------
+        tile : pytile Tile
+            tile to request the history of
+        start : datetime
+            start of the window
+        end : datetime
+            end of the window
+
+        Returns
+        -----------
+        latest_timestamp : int
+            latest location_timestamp in the window, None if the window had no updates
+        """
+        checkpoint = self.checkpoint_dir / f"{tile.uuid}_{start:%Y%m%d%H%M%S}_{end:%Y%m%d%H%M%S}.json"
+        if checkpoint.exists():
+            with open(checkpoint, 'r') as f:
+                return json.load(f)['latest_timestamp']
+
+        delay = self.backoff
+        for attempt in range(1, self.retries + 1):
+            try:
+                async with self._semaphore:
+                    history = await tile.async_history(start, end)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                print(f"{tile.uuid} {start.date()} to {end.date()} failed (attempt {attempt}): {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+
+        location_updates = (history or {}).get('result', {}).get('location_updates', [])
+        self.writer.write(tile.uuid, location_updates)
+        timestamps = [update['location_timestamp'] for update in location_updates
+                      if update.get('location_timestamp') is not None]
+        latest_timestamp = max(timestamps) if timestamps else None
+
+        # the checkpoint is only written after the updates are on disk
+        with open(checkpoint, 'w') as f:
+            json.dump({'latest_timestamp': latest_timestamp, 'count': len(location_updates)}, f)
+        return latest_timestamp
+
+    def clear_checkpoints(self) -> None:
+        """
+        Remove the checkpointed windows, call once the watermarks have been saved
+        """
+        for checkpoint in self.checkpoint_dir.glob('*.json'):
+            checkpoint.unlink()
+        self.checkpoint_dir.rmdir()
@@ -4,67 +4,155 @@ import numpy as np
 from sklearn.cluster import HDBSCAN
 
 # Native Imports
-from pathlib import Path
-import json
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import math
+
+# Custom Imports
+from .raw_store import list_raw_files
+from .raw_parser import parse_raw_file, concat_columns
+from .location_store import LocationStore
+
+# Column order of the combined location data
+LOCATION_SCHEMA = ['tile_name', 'tile_uuid', 'location_timestamp', 'datetime', 'date', 'hour',
+                   'latitude', 'longitude', 'raw_precision', 'precision']
 
 # caching doesn't help here because we are not calling the function repeatedly with the same arguments
 # @lru_cache(maxsize=None)
-def combine_data(datapath: str, tile_uuid: str, tile_name: str):
+def combine_data(datapath: str, tile_uuid: str, tile_name: str, statepath: str = None, n_workers: int = 1):
     """
     Function to combine all data from the raw jsons to a dataframe, optimized for speed.
+    Reads both the daily snapshots ('data_<date>.json') and the tile's partitions ('<tile_uuid>/<date>.jsonl.gz')
 
     Parameters
     -----------
     datapath : string
-        the file path pointing to the directory holding the raw data in json format
+        the file path pointing to the directory holding the raw data
     tile_uuid : string
         unique ID for the tile
     tile_name : string
         human readable name of the tile
+    statepath : string [optional]
+        directory holding the persisted location store and manifest. When given only raw files that are new
+        since the last run are parsed and merged into the store, otherwise every raw file is parsed
+    n_workers : int [optional]
+        number of processes to parse the raw files with, 1 parses in this process
 
     Returns
     ----------
     df : pd.DataFrame
         dataframe containing the combined data
     """
-    all_location_updates = []
-    files = Path(datapath).glob('*.json')
+    return combine_all_data(datapath, {tile_uuid: tile_name}, statepath=statepath, n_workers=n_workers)
 
-    for file in files:
-        with open(file, 'r') as f:
-            data = json.load(f)
-            # Safely access nested data, handle potential missing keys if your JSONs vary
-            if tile_uuid in data and 'result' in data[tile_uuid] and \
-               'location_updates' in data[tile_uuid]['result']:
-                all_location_updates.extend(data[tile_uuid]['result']['location_updates'])
+def combine_all_data(datapath: str, tilenames: dict, statepath: str = None, n_workers: int = 1):
+    """
+    Function to combine the data of several tiles in a single pass over the raw files. Each snapshot is read
+    once and every requested tile is extracted from it, so adding trackers costs almost no extra I/O
 
-    if not all_location_updates:
-        return pd.DataFrame() # Return empty DataFrame if no data found
+    Parameters
+    -----------
+    datapath : string
+        the file path pointing to the directory holding the raw data
+    tilenames : dict
+        {tile_uuid: tile_name} for every tile to combine
+    statepath : string [optional]
+        directory holding the persisted location store and manifest. When given only raw files that are new
+        since the last run are parsed and merged into the store, otherwise every raw file is parsed
+    n_workers : int [optional]
+        number of processes to parse the raw files with, 1 parses in this process
 
-    df = pd.DataFrame(all_location_updates)
+    Returns
+    ----------
+    df : pd.DataFrame
+        dataframe containing the combined data, de-duplicated on (tile_uuid, location_timestamp)
+    """
+    tile_uuids = list(tilenames)
+    files = list_raw_files(datapath, tile_uuids)
+    if statepath is not None:
+        store = LocationStore(statepath, tile_uuids)
+        files = store.new_files(files)
+        print(f"Parsing {len(files)} new or changed raw files")
 
-    # Convert 'location_timestamp' to datetime directly
-    df['datetime'] = pd.to_datetime(df['location_timestamp'], unit='ms', utc=True)
-    df['date'] = df['datetime'].dt.date
-    df['time'] = df['datetime'].dt.strftime("%H:%M:%S")
+    # only the requested tiles' location updates are decoded, straight into numpy columns
+    columns = concat_columns(parse_raw_files(files, tile_uuids, n_workers=n_workers))
 
-    # Add tile_name column
-    df['tile_name'] = tile_name
+    df = build_location_frame(columns, tilenames)
 
-    # Add tile_uuid column
-    df['tile_uuid'] = tile_uuid # Assuming tile_uuid is constant for all data in this combination process
+    if statepath is not None:
+        df = store.merge(df)
+        store.save(df, files)
 
-    # Remove Duplicates
-    df = df.groupby('location_timestamp', as_index=False).last()
-    df = df.sort_values(by='datetime')
+    return df
 
-    # Ensure all columns exist before reordering to avoid KeyError
-    required_cols = ['tile_name', 'tile_uuid', 'location_timestamp', 'datetime', 'date', 'time',
-                     'latitude', 'longitude', 'raw_precision', 'precision']
-    final_cols = [col for col in required_cols if col in df.columns]
-    df = df[final_cols] # Reorder columns
+def parse_raw_files(files: list, tile_uuids: list, n_workers: int = 1) -> list:
+    """
+    Function to parse many raw files, optionally fanned out to a process pool. Workers send back numpy
+    column batches, which are much cheaper to pickle than lists of dicts
 
-    return df
+    Parameters
+    -----------
+    files : list
+        list of raw file paths
+    tile_uuids : list
+        unique IDs of the tiles to extract
+    n_workers : int [optional]
+        number of processes to parse with, 1 parses in this process
+
+    Returns
+    ----------
+    batches : list
+        list of column dicts, one per file, in the order of files
+    """
+    parse = partial(parse_raw_file, tile_uuids=tile_uuids)
+    if n_workers <= 1 or len(files) <= 1:
+        return [parse(file) for file in files]
+
+    n_workers = min(n_workers, len(files))
+    # several small partitions per task keeps the per-task overhead down
+    chunksize = max(1, len(files) // (n_workers * 4))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(parse, files, chunksize=chunksize))
+
+def build_location_frame(columns: dict, tilenames: dict) -> pd.DataFrame:
+    """
+    Function to turn parsed location columns into a de-duplicated dataframe with a compact schema:
+    categorical tile columns, int64 epoch and datetime64 timestamps, and date/hour derived from the
+    timestamp instead of formatted strings. date stays a datetime.date (written as a parquet date), so it
+    compares with 'YYYY-MM-DD' strings downstream
+
+    Parameters
+    -----------
+    columns : dict
+        {column name: np.array} as returned by raw_parser.parse_raw_file
+    tilenames : dict
+        {tile_uuid: tile_name}, in the order the tiles were parsed in
+
+    Returns
+    ----------
+    df : pd.DataFrame
+        dataframe containing the location data, sorted by tile (in tilenames order) and datetime
+    """
+    if len(columns['location_timestamp']) == 0:
+        return pd.DataFrame() # Return empty DataFrame if no data found
+
+    df = pd.DataFrame(columns)
+
+    # Remove Duplicates -- on the integer columns, before anything is derived from them.
+    # Sorting the group keys also leaves the rows ordered by tile, then time
+    df = df.groupby(['tile_index', 'location_timestamp'], as_index=False, sort=True).last()
+
+    # Categorical tile columns from the tile index the parser assigned
+    df['tile_uuid'] = pd.Categorical.from_codes(df['tile_index'].values, categories=list(tilenames.keys()))
+    df['tile_name'] = pd.Categorical.from_codes(df['tile_index'].values, categories=list(tilenames.values()))
+
+    # Convert 'location_timestamp' to datetime directly, date and hour are derived without string formatting
+    df['datetime'] = pd.to_datetime(df['location_timestamp'], unit='ms', utc=True).astype('datetime64[ms, UTC]')
+    df['date'] = df['datetime'].dt.date # UTC date
+    df['hour'] = df['datetime'].dt.hour.astype(np.int8)
+
+    df = df[LOCATION_SCHEMA] # Reorder columns
+    return df.reset_index(drop=True)
 
 # *** DEPRACATED - no longer used because caching is not necessary ***
 def numpy_to_hashable_bytes(arr):
@@ -75,72 +163,557 @@ def numpy_to_hashable_bytes(arr):
 
 # caching doesn't help here because we are not calling the function repeatedly with the same arguments
 # @lru_cache(maxsize=None)
-def cluster_data(df, metric: str = 'haversine', min_cluster_size: int = 5):
+def cluster_data(df, metric: str = 'haversine', min_cluster_size: int = 5, grid_m: float = None,
+                 partition_deg: float = None, margin_m: float = 2000, n_workers: int = 1, engine: str = 'hdbscan',
+                 stay_distance_m: float = 100, stay_dwell_s: float = 1200):
     """
     Fits an HDBSCAN clustering model to the data and returns the labels
 
     Parameters
     -----------
     df : pd.DataFrame
-        dataframe that contains the columns to be fit on (should only be ['latitude', 'longitude'])
+        dataframe that contains the columns to be fit on (should only be ['latitude', 'longitude'], plus
+        'location_timestamp' for the stay_points engine)
+    metric : str [optional]
+        'haversine' fits great-circle distances with a ball tree. 'chord' embeds the points on the unit sphere
+        and fits the euclidean (chord) distance between them with a kd-tree, which is faster and orders every
+        pair of points the same way. Any other metric is passed to HDBSCAN as is
+    min_cluster_size : int [optional]
+        min_cluster_size passed to HDBSCAN
+    grid_m : float [optional]
+        size of the grid cells in meters. When given, points are snapped to the grid and HDBSCAN is fit on the
+        occupied cells (see snap_to_grid) instead of on every point, None fits every point
+    partition_deg : float [optional]
+        size of the spatial partitions in degrees. When given, every partition is fit separately (see
+        cluster_partitioned), None fits all of the points at once
+    margin_m : float [optional]
+        overlap between neighbouring partitions in meters, only used with partition_deg
+    n_workers : int [optional]
+        number of processes the partitions are fit with, only used with partition_deg
+    engine : str [optional]
+        'hdbscan', or 'stay_points' to label the time-ordered trajectory in a single pass with detect_stays
+        instead (which already labels transit -3 and ignores every HDBSCAN argument)
+    stay_distance_m : float [optional]
+        distance_m passed to detect_stays
+    stay_dwell_s : float [optional]
+        dwell_s passed to detect_stays
 
     Returns
     -----------
     db : sklearn HDBSCAN class
-        fit model
+        fit model, with partition_deg a dict of {partition: fit model}, None with the stay_points engine or when
+        df has fewer rows than min_cluster_size (every label is then -1)
     db.labels_ : np.array
-        array containing the labels
+        array containing the labels, one per row of df
     """
+    if engine == 'stay_points':
+        labels, _, _ = detect_stays(df['latitude'].values, df['longitude'].values, df['location_timestamp'].values,
+                                    distance_m=stay_distance_m, dwell_s=stay_dwell_s)
+        return None, labels
     # scaler = StandardScaler()
     # coords = scaler.fit_transform(df)
     # consider using metric='haversine' in future versions, which also need to remove standard scaler
+    if partition_deg is not None:
+        return cluster_partitioned(df, partition_deg, margin_m=margin_m, metric=metric,
+                                   min_cluster_size=min_cluster_size, grid_m=grid_m, n_workers=n_workers)
+
     coords_radians = np.deg2rad(df[['latitude', 'longitude']].values)
-    db = HDBSCAN(metric=metric, min_cluster_size=min_cluster_size, n_jobs=-1).fit(coords_radians) 
-    return db, db.labels_
+    embed = to_unit_sphere if metric == 'chord' else (lambda coords: coords)
+    hdbscan = HDBSCAN(metric='euclidean' if metric == 'chord' else metric, min_cluster_size=min_cluster_size, n_jobs=-1)
+    if len(coords_radians) < min_cluster_size:
+        # HDBSCAN refuses fewer rows than min_samples (defaults to min_cluster_size), nothing can be a cluster
+        return None, np.full(len(coords_radians), -1, dtype=np.int64)
+    if grid_m is None:
+        db = hdbscan.fit(embed(coords_radians))
+        return db, db.labels_
+
+    cell_coords, counts, inverse = snap_to_grid(coords_radians, grid_m)
+    # a stationary tracker fills a cell with hundreds of points. Each cell is fit with its multiplicity capped
+    # one below min_samples (defaults to min_cluster_size): enough copies to keep the cell dense, but never
+    # enough for the copies alone to be a core neighbourhood, which would give the cell a zero core distance
+    # and split every busy cell into its own cluster
+    repeats = np.minimum(counts, max(min_cluster_size - 1, 1))
+    if repeats.sum() < min_cluster_size:
+        # the points sit in too few cells to fit the reduced rows (e.g. a tile that didn't move all day),
+        # there are few distinct places so the points themselves are fit
+        db = hdbscan.fit(embed(coords_radians))
+        return db, db.labels_
+    db = hdbscan.fit(embed(np.repeat(cell_coords, repeats, axis=0)))
+    first_copy = np.concatenate([[0], np.cumsum(repeats)[:-1]])
+    return db, db.labels_[first_copy][inverse]
+
+def sweep_clusters(df, min_cluster_sizes: list, selection_methods: tuple = ('eom', 'leaf'), metric: str = 'haversine',
+                   min_samples: int = 5, grid_m: float = None):
+    """
+    Flat clusterings for many HDBSCAN settings from a single fit. The core distances and the minimum spanning
+    tree only depend on min_samples, so the single linkage tree is built once and every min_cluster_size and
+    cluster selection method is read off it. With min_samples equal to min_cluster_size the labels are the same
+    as cluster_data's
 
-def add_bearing_column(df):
+    Parameters
+    -----------
+    df : pd.DataFrame
+        dataframe that contains ['latitude', 'longitude'], plus 'direction_similarity' to count geocode calls
+        after reduce_clusters
+    min_cluster_sizes : list
+        min_cluster_size values to try
+    selection_methods : tuple [optional]
+        cluster_selection_method values to try, 'eom' and/or 'leaf'
+    metric : str [optional]
+        metric passed to cluster_data, 'haversine' or 'chord'
+    min_samples : int [optional]
+        min_samples used for the core distances of every setting
+    grid_m : float [optional]
+        grid_m passed to cluster_data
+
+    Returns
+    -----------
+    sweep : pd.DataFrame
+        one row per setting, contains ['min_cluster_size','cluster_selection_method','n_clusters',
+        'noise_fraction','geocode_calls'], geocode_calls being the number of labels geocode_clusters requests
+    labels : dict
+        {(min_cluster_size, cluster_selection_method): np.array of labels, one per row of df}
     """
-    Function to calculate bearing for a DataFrame using vectorized operations.
+    try:
+        # private to sklearn, imported here so a release that moves it only breaks the sweep
+        from sklearn.cluster._hdbscan._tree import tree_to_labels
+    except ImportError as e:
+        raise ImportError("sweep_clusters reads the single linkage tree from sklearn's private HDBSCAN internals "
+                          "(sklearn.cluster._hdbscan._tree), it needs scikit-learn>=1.7.0 with those still in place "
+                          "(tested with 1.7.0 and 1.9.1)") from e
+
+    coords_radians = np.deg2rad(df[['latitude', 'longitude']].values)
+    fit_coords, rows = coords_radians, np.arange(len(coords_radians))
+    if grid_m is not None:
+        # same reduction as cluster_data, including its fallback to the points when too few rows remain
+        cell_coords, counts, inverse = snap_to_grid(coords_radians, grid_m)
+        repeats = np.minimum(counts, max(min_samples - 1, 1))
+        if repeats.sum() >= min_samples:
+            fit_coords = np.repeat(cell_coords, repeats, axis=0)
+            rows = np.concatenate([[0], np.cumsum(repeats)[:-1]])[inverse]
+    if metric == 'chord':
+        fit_coords, metric = to_unit_sphere(fit_coords), 'euclidean'
+    db = None
+    if len(fit_coords) >= min_samples: # fewer rows than min_samples can't be fit, every setting is all noise
+        db = HDBSCAN(metric=metric, min_cluster_size=min(min_cluster_sizes), min_samples=min_samples,
+                     n_jobs=-1).fit(fit_coords)
+
+    results, labels = [], {}
+    for min_cluster_size in min_cluster_sizes:
+        for selection_method in selection_methods:
+            if db is None:
+                setting_labels = np.full(len(coords_radians), -1, dtype=np.int64)
+            else: # _single_linkage_tree_ is private as well
+                setting_labels = tree_to_labels(db._single_linkage_tree_, min_cluster_size=min_cluster_size,
+                                                cluster_selection_method=selection_method)[0][rows]
+            cluster_labels = pd.Series(setting_labels, name='cluster_label')
+            if 'direction_similarity' in df.columns:
+                cluster_labels = reduce_clusters(pd.DataFrame({'cluster_label': cluster_labels,
+                                                               'direction_similarity': df['direction_similarity'].values}))
+            results.append({'min_cluster_size': min_cluster_size,
+                            'cluster_selection_method': selection_method,
+                            'n_clusters': int(setting_labels.max() + 1),
+                            'noise_fraction': float((setting_labels == -1).mean()),
+                            'geocode_calls': int(cluster_labels.nunique())}) # one request per label
+            labels[(min_cluster_size, selection_method)] = setting_labels
+    return pd.DataFrame(results), labels
+
+def to_unit_sphere(coords_radians: np.ndarray) -> np.ndarray:
+    """
+    Embeds [latitude, longitude] in radians as [x, y, z] on the unit sphere. The euclidean distance between two
+    embedded points is the chord 2 * sin(d / 2) of their great-circle distance d (in radians), which grows
+    with d, so nearest neighbours are the same as with haversine
+    """
+    latitude, longitude = coords_radians[:, 0], coords_radians[:, 1]
+    cos_latitude = np.cos(latitude)
+    return np.stack([cos_latitude * np.cos(longitude), cos_latitude * np.sin(longitude), np.sin(latitude)], axis=1)
+
+def snap_to_grid(coords_radians: np.ndarray, grid_m: float):
+    """
+    Snaps points to a grid of roughly grid_m x grid_m meter cells and de-duplicates them. Each occupied cell is
+    represented by the mean of its points
+
+    Parameters
+    -----------
+    coords_radians : np.ndarray
+        (n, 2) array of [latitude, longitude] in radians
+    grid_m : float
+        size of the grid cells in meters
+
+    Returns
+    -----------
+    cell_coords : np.ndarray
+        (n_cells, 2) array of [latitude, longitude] in radians, mean of the points in each cell
+    counts : np.ndarray
+        number of points in each cell
+    inverse : np.ndarray
+        cell of every point, cell_coords[inverse] has one row per point
+    """
+    cell_size = grid_m / EARTH_RADIUS_M # radians of latitude
+    row = np.floor(coords_radians[:, 0] / cell_size)
+    # longitude cells are widened by 1/cos(latitude) of the cell row so they stay grid_m wide on the ground
+    col = np.floor(coords_radians[:, 1] * np.cos((row + 0.5) * cell_size) / cell_size)
+    cells = np.stack([row, col], axis=1).astype(np.int64)
+    _, inverse, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    cell_coords = np.stack([np.bincount(inverse, weights=coords_radians[:, i]) for i in range(2)], axis=1)
+    return cell_coords / counts[:, None], counts, inverse
+
+def cluster_partitioned(df, partition_deg: float, margin_m: float = 2000, metric: str = 'haversine',
+                        min_cluster_size: int = 5, grid_m: float = None, n_workers: int = 1):
+    """
+    Fits HDBSCAN separately on square partitions of partition_deg degrees, optionally in a process pool.
+    Every partition also takes in the points within margin_m of its edges, so a cluster crossing an edge
+    is seen (at least partly) from both sides. Clusters of different partitions that share a point are
+    merged, and every point keeps the label it got in its own partition. When partition_deg divides 360 the
+    partition columns wrap at the antimeridian, so a cluster crossing +-180 degrees is merged like any other
+    (with 'haversine' or 'chord'; other metrics don't see the wrap). Otherwise the last column is narrower and
+    the two sides of the antimeridian are never merged
 
     Parameters
     -----------
     df : pd.DataFrame
-        dataframe containing ['latitude','longitude']
+        dataframe that contains ['latitude', 'longitude']
+    partition_deg : float
+        size of the partitions in degrees
+    margin_m : float [optional]
+        overlap between neighbouring partitions in meters, should be larger than the clusters
+    metric : str [optional]
+        metric passed to HDBSCAN
+    min_cluster_size : int [optional]
+        min_cluster_size passed to HDBSCAN
+    grid_m : float [optional]
+        grid_m passed to cluster_data for every partition
+    n_workers : int [optional]
+        number of processes to fit with, 1 fits in this process
 
     Returns
-    ---------
-    bearing : pd.Series
-        pandas series containing the bearing for every row
+    -----------
+    db : dict
+        {(partition row, partition column): fit model}
+    labels : np.array
+        array containing the labels, one per row of df, numbered across all partitions
+    """
+    latitude = df['latitude'].to_numpy(dtype=np.float64)
+    longitude = df['longitude'].to_numpy(dtype=np.float64)
+    row = np.floor(latitude / partition_deg).astype(np.int64)
+    col = np.floor(longitude / partition_deg).astype(np.int64)
+
+    # points within the margin of an edge (or corner) also go to the partitions on the other side
+    margin_lat = np.rad2deg(margin_m / EARTH_RADIUS_M) / partition_deg
+    margin_lon = margin_lat / np.maximum(np.cos(np.deg2rad(latitude)), 0.01)
+    lat_offset = latitude / partition_deg - row
+    lon_offset = longitude / partition_deg - col
+    n_cols = 360 / partition_deg
+    wrap = int(round(n_cols)) if np.isclose(n_cols, round(n_cols)) else None
+    if wrap is not None:
+        col = col % wrap # -180 and 180 fall in the same column
+    near_row = {-1: lat_offset < margin_lat, 0: np.ones(len(df), dtype=bool), 1: 1 - lat_offset < margin_lat}
+    near_col = {-1: lon_offset < margin_lon, 0: np.ones(len(df), dtype=bool), 1: 1 - lon_offset < margin_lon}
+    members = {} # {partition: [row indices]}
+    for row_shift in [-1, 0, 1]:
+        for col_shift in [-1, 0, 1]:
+            index = np.flatnonzero(near_row[row_shift] & near_col[col_shift])
+            shifted_col = col[index] + col_shift
+            if wrap is not None:
+                shifted_col = shifted_col % wrap
+            for key, rows in pd.Series(index).groupby([row[index] + row_shift, shifted_col]):
+                members.setdefault(key, []).append(rows.values)
+    members = {key: np.sort(np.concatenate(rows)) for key, rows in members.items()}
+
+    # largest partitions first, so a big one doesn't start last and hold up the pool
+    keys = sorted(members, key=lambda key: len(members[key]), reverse=True)
+    fit = partial(_cluster_partition, metric=metric, min_cluster_size=min_cluster_size, grid_m=grid_m)
+    coords = [np.stack([latitude[members[key]], longitude[members[key]]], axis=1) for key in keys]
+    if n_workers <= 1 or len(keys) <= 1:
+        results = [fit(partition) for partition in coords]
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(keys))) as executor:
+            results = list(executor.map(fit, coords))
+    db = {key: result[0] for key, result in zip(keys, results)}
+
+    # number every partition's clusters apart, every point keeps the label from its own partition
+    home_labels = np.full(len(df), -1, dtype=np.int64)
+    points, point_labels = [], []
+    n_labels = 0
+    for key, (_, labels) in zip(keys, results):
+        index = members[key]
+        labels = np.where(labels >= 0, labels + n_labels, -1)
+        n_labels = max(n_labels, labels.max() + 1)
+        is_home = (row[index] == key[0]) & (col[index] == key[1])
+        home_labels[index[is_home]] = labels[is_home]
+        points.append(index[labels >= 0])
+        point_labels.append(labels[labels >= 0])
+
+    # clusters that share a point (only possible in the margins) are the same cluster, merge them (union-find)
+    points, point_labels = np.concatenate(points), np.concatenate(point_labels)
+    order = np.argsort(points, kind='stable')
+    points, point_labels = points[order], point_labels[order]
+    shared = np.flatnonzero((points[1:] == points[:-1]) & (point_labels[1:] != point_labels[:-1]))
+    parent = list(range(n_labels))
+    for i in shared:
+        _union(parent, point_labels[i], point_labels[i + 1])
+
+    roots = np.array([_find(parent, label) for label in range(n_labels)], dtype=np.int64)
+    labels = np.full(len(df), -1, dtype=np.int64)
+    clustered = home_labels >= 0
+    # consecutive labels in order of first appearance
+    _, first, inverse = np.unique(roots[home_labels[clustered]], return_index=True, return_inverse=True)
+    labels[clustered] = np.argsort(np.argsort(first))[inverse.reshape(-1)]
+    return db, labels
+
+def _cluster_partition(coords: np.ndarray, metric: str, min_cluster_size: int, grid_m: float):
+    """
+    Fits one partition for cluster_partitioned, coords is an (n, 2) array of [latitude, longitude] in degrees.
+    A partition with too few points, or too few grid rows once snapped (e.g. a remote spot visited once),
+    comes back all noise or fit point by point from cluster_data, instead of failing the whole pool
+    """
+    return cluster_data(pd.DataFrame(coords, columns=['latitude', 'longitude']), metric=metric,
+                        min_cluster_size=min_cluster_size, grid_m=grid_m)
+
+def _find(parent: list, label: int) -> int:
+    """
+    Root of a label in the union-find forest, compresses the path on the way up
+    """
+    root = label
+    while parent[root] != root:
+        root = parent[root]
+    while parent[label] != root:
+        parent[label], label = root, parent[label]
+    return root
+
+def _union(parent: list, a: int, b: int) -> None:
     """
-    # Create a copy to avoid SettingWithCopyWarning if df is a slice
-    df_copy = df.copy()
+    Merges the sets holding labels a and b, the smaller root becomes the root of both
+    """
+    a, b = _find(parent, a), _find(parent, b)
+    if a != b:
+        parent[max(a, b)] = min(a, b)
 
-    # Shift latitude and longitude to get previous points -- will create NaN value for first row
-    df_copy['prev_latitude'] = df_copy['latitude'].shift(1)
-    df_copy['prev_longitude'] = df_copy['longitude'].shift(1)
+def detect_stays(latitude: np.ndarray, longitude: np.ndarray, timestamp: np.ndarray, distance_m: float = 100,
+                 dwell_s: float = 1200, places: list = None):
+    """
+    Stay point detection in a single pass over a time-ordered trajectory. Points are added to the current
+    visit while they are within distance_m of its centroid. When a point leaves, the visit is closed: it is a
+    stay if it lasted at least dwell_s, otherwise its points were in transit. A single point that leaves and
+    is followed by a point back within distance_m is a GPS jump, labelled an outlier, and the visit goes on.
+    Stays within distance_m of an earlier stay's place share its label, so repeated visits form one cluster
 
-    # Convert degrees to radians for trigonometric functions
-    lat1_rad = np.deg2rad(df_copy['prev_latitude'])
-    lon1_rad = np.deg2rad(df_copy['prev_longitude'])
-    lat2_rad = np.deg2rad(df_copy['latitude'])
-    lon2_rad = np.deg2rad(df_copy['longitude'])
+    Parameters
+    -----------
+    latitude : np.ndarray
+        latitude in degrees, ordered by time
+    longitude : np.ndarray
+        longitude in degrees, ordered by time
+    timestamp : np.ndarray
+        location_timestamp in ms since epoch
+    distance_m : float [optional]
+        radius of a stay in meters
+    dwell_s : float [optional]
+        minimum duration of a stay in seconds
+    places : list [optional]
+        [[latitude, longitude], ...] places of earlier stays, label i is places[i]. Extended in place with the
+        new places, pass the list back in to carry on from an earlier pass
 
-    # Calculate differences in longitude
-    dLon = lon2_rad - lon1_rad
+    Returns
+    -----------
+    labels : np.array
+        place of every point's stay, -1 for outliers, -3 for transit. The points of the last visit are labelled
+        with what they are so far, the visit may still grow into a stay
+    places : list
+        places of every stay, including the new ones
+    open_start : int
+        row of the first point of the last visit, a later pass should restart there
+    """
+    places = [] if places is None else places
+    place_cells = {}
+    for label, (place_lat, place_lon) in enumerate(places):
+        place_cells.setdefault(_place_cell(place_lat, place_lon, distance_m), []).append(label)
+
+    n = len(latitude)
+    labels = np.full(n, -3, dtype=np.int64)
+    timestamp = np.asarray(timestamp, dtype=np.int64)
+    start, last, count, sum_lat, sum_lon = 0, 0, 0, 0.0, 0.0
+    outliers = []
+
+    def close_visit(end):
+        # points from start to end (exclusive), without the outliers, form a stay or stay in transit
+        if count == 0 or (timestamp[last] - timestamp[start]) / 1000 < dwell_s:
+            return
+        place_lat, place_lon = sum_lat / count, sum_lon / count
+        label = _nearest_place(places, place_cells, place_lat, place_lon, distance_m)
+        if label is None:
+            label = len(places)
+            places.append([place_lat, place_lon])
+            place_cells.setdefault(_place_cell(place_lat, place_lon, distance_m), []).append(label)
+        labels[start:end] = label
+        labels[outliers] = -1
+
+    for i in range(n):
+        if count and _haversine_m(sum_lat / count, sum_lon / count, latitude[i], longitude[i]) > distance_m:
+            if (i + 1 < n and _haversine_m(sum_lat / count, sum_lon / count,
+                                           latitude[i + 1], longitude[i + 1]) <= distance_m):
+                outliers.append(i) # jumped away and straight back
+                continue
+            close_visit(i)
+            start, count, sum_lat, sum_lon, outliers = i, 0, 0.0, 0.0, []
+        count += 1
+        sum_lat += latitude[i]
+        sum_lon += longitude[i]
+        last = i
+    close_visit(n)
+    return labels, places, start
+
+def haversine_m(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """
+    Great-circle distance in meters between arrays of points in degrees
+    """
+    lat1, lon1, lat2, lon2 = map(np.deg2rad, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(a)))
 
-    # Apply the bearing formula using vectorized NumPy functions
-    y = np.sin(dLon) * np.cos(lat2_rad)
-    x = np.cos(lat1_rad) * np.sin(lat2_rad) - np.sin(lat1_rad) * np.cos(lat2_rad) * np.cos(dLon)
+def _haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Great-circle distance in meters between two points in degrees
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
 
-    # Calculate bearing in radians, then convert to degrees
-    brng_rad = np.arctan2(y, x)
-    brng_deg = np.rad2deg(brng_rad)
+def _place_cell(latitude: float, longitude: float, distance_m: float) -> tuple:
+    """
+    Grid cell of about distance_m x distance_m meters holding a place
+    """
+    cell_deg = math.degrees(distance_m / EARTH_RADIUS_M)
+    return (math.floor(latitude / cell_deg),
+            math.floor(longitude * max(math.cos(math.radians(latitude)), 0.01) / cell_deg))
 
-    # Normalize bearing to be between 0 and 360 degrees
-    bearing = (brng_deg + 360) % 360
+def _nearest_place(places: list, place_cells: dict, latitude: float, longitude: float, distance_m: float):
+    """
+    Label of the nearest place within distance_m, looked up in the surrounding grid cells, None if there is none
+    """
+    row, col = _place_cell(latitude, longitude, distance_m)
+    nearest, nearest_distance = None, distance_m
+    for row_shift in [-1, 0, 1]:
+        for col_shift in [-1, 0, 1]:
+            for label in place_cells.get((row + row_shift, col + col_shift), []):
+                distance = _haversine_m(latitude, longitude, *places[label])
+                if distance <= nearest_distance:
+                    nearest, nearest_distance = label, distance
+    return nearest
+
+EARTH_RADIUS_M = 6371008.8 # mean earth radius
+
+def trajectory_kinematics(latitude: np.ndarray, longitude: np.ndarray, timestamp: np.ndarray = None,
+                          group: np.ndarray = None, max_gap_s: float = None) -> dict:
+    """
+    Fused kernel computing every step-based feature of a time-ordered trajectory in one pass over the arrays.
+    Step i goes from row i-1 to row i. A step is broken (all its features NaN) on the first row of a group,
+    and when more than max_gap_s seconds passed since the previous row. Direction similarity needs the
+    current and previous step to both be unbroken
 
-    # Convert the NumPy array result back to a Pandas Series, preserving the original index
-    return pd.Series(bearing, index=df.index)
+    Parameters
+    -----------
+    latitude : np.ndarray
+        latitude in degrees, ordered by group then time
+    longitude : np.ndarray
+        longitude in degrees, ordered by group then time
+    timestamp : np.ndarray [optional]
+        location_timestamp in ms since epoch, without it elapsed_s and speed_mps are NaN
+    group : np.ndarray [optional]
+        group id per row (e.g. tile_uuid codes), steps never cross a change of group
+    max_gap_s : float [optional]
+        steps spanning a longer time gap than this are broken, None keeps every step
+
+    Returns
+    -----------
+    kinematics : dict
+        {'bearing': degrees from north in [0, 360),
+         'direction_similarity': cosine between the current and previous step in lat/lon space,
+         'step_distance_m': haversine distance of the step,
+         'elapsed_s': seconds since the previous row,
+         'speed_mps': step_distance_m / elapsed_s}
+        each an np.ndarray with one value per row
+    """
+    lat = np.deg2rad(np.asarray(latitude, dtype=np.float64))
+    lon = np.deg2rad(np.asarray(longitude, dtype=np.float64))
+    n = len(lat)
+
+    # Valid steps, step i goes from row i-1 to i
+    valid = np.zeros(n, dtype=bool)
+    valid[1:] = True
+    if group is not None:
+        group = np.asarray(group)
+        valid[1:] &= group[1:] == group[:-1]
+    elapsed = np.full(n, np.nan)
+    if timestamp is not None:
+        elapsed[1:] = np.diff(np.asarray(timestamp, dtype=np.int64)) / 1000
+        if max_gap_s is not None:
+            valid[1:] &= elapsed[1:] <= max_gap_s
+    elapsed[~valid] = np.nan
+
+    # Step differences, shared by every feature
+    dlat = np.full(n, np.nan)
+    dlon = np.full(n, np.nan)
+    dlat[1:] = lat[1:] - lat[:-1]
+    dlon[1:] = lon[1:] - lon[:-1]
+    dlat[~valid] = np.nan
+    dlon[~valid] = np.nan
+    cos_lat = np.cos(lat)
+    sin_lat = np.sin(lat)
+    cos_lat_prev = np.full(n, np.nan)
+    cos_lat_prev[1:] = cos_lat[:-1]
+    sin_lat_prev = np.full(n, np.nan)
+    sin_lat_prev[1:] = sin_lat[:-1]
+
+    # Bearing
+    y = np.sin(dlon) * cos_lat
+    x = cos_lat_prev * sin_lat - sin_lat_prev * cos_lat * np.cos(dlon)
+    bearing = (np.rad2deg(np.arctan2(y, x)) + 360) % 360
+
+    # Haversine step distance and speed
+    a = np.sin(dlat / 2)**2 + cos_lat_prev * cos_lat * np.sin(dlon / 2)**2
+    step_distance = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    speed = np.divide(step_distance, elapsed, out=np.full(n, np.nan), where=elapsed > 0)
+
+    # Direction similarity, cosine between consecutive steps in degree space
+    # (reuses the step difference buffers, diffs are taken from the degree inputs to avoid round-off)
+    dlat.fill(np.nan)
+    dlon.fill(np.nan)
+    dlat[valid] = np.diff(np.asarray(latitude, dtype=np.float64))[valid[1:]]
+    dlon[valid] = np.diff(np.asarray(longitude, dtype=np.float64))[valid[1:]]
+    prev_dlat = np.full(n, np.nan)
+    prev_dlon = np.full(n, np.nan)
+    prev_dlat[1:] = dlat[:-1]
+    prev_dlon[1:] = dlon[:-1]
+    dot_product = prev_dlat * dlat + prev_dlon * dlon
+    magnitudes = np.sqrt(prev_dlat**2 + prev_dlon**2) * np.sqrt(dlat**2 + dlon**2)
+    direction_similarity = np.divide(dot_product, magnitudes,
+                                     out=np.where(np.isnan(magnitudes), np.nan, 0.0), # 0 where a step has no length
+                                     where=magnitudes > 0)
+
+    return {'bearing': bearing,
+            'direction_similarity': direction_similarity,
+            'step_distance_m': step_distance,
+            'elapsed_s': elapsed,
+            'speed_mps': speed}
+
+def add_bearing_column(df):
+    """
+    Function to calculate bearing for a DataFrame using vectorized operations.
+
+    Parameters
+    -----------
+    df : pd.DataFrame
+        dataframe containing ['latitude','longitude']
+
+    Returns
+    ---------
+    bearing : pd.Series
+        pandas series containing the bearing for every row
+    """
+    kinematics = trajectory_kinematics(df['latitude'].values, df['longitude'].values)
+    return pd.Series(kinematics['bearing'], index=df.index)
 
 
 def add_direction_similarity(df):
@@ -157,31 +730,68 @@ def add_direction_similarity(df):
     direction_similarity : pd.Series
         series containing the direction similarity for every row
     """
-    cdf = df.copy()
+    kinematics = trajectory_kinematics(df['latitude'].values, df['longitude'].values)
+    return pd.Series(kinematics['direction_similarity'], index=df.index)
 
-    # Calculate differences for current and previous steps
-    cdf['diff_lat'] = cdf['latitude'] - cdf['latitude'].shift(1)
-    cdf['diff_lon'] = cdf['longitude'] - cdf['longitude'].shift(1)
-    # Shift these differences to get 'previous' differences
-    cdf['prev_diff_lat'] = cdf['diff_lat'].shift(1)
-    cdf['prev_diff_lon'] = cdf['diff_lon'].shift(1)
 
-    # Stack the columns to form 2D arrays where each row is a vector
-    vector_A = cdf[['prev_diff_lat', 'prev_diff_lon']].values
-    vector_B = cdf[['diff_lat', 'diff_lon']].values
+# Values of the quality_flag column, in order of precedence when a point fails several checks
+QUALITY_FLAGS = ['ok', 'low_precision', 'speed_spike']
 
-    dot_product = np.sum(vector_A * vector_B, axis=1)
-    magnitude_A = np.sqrt(np.sum(vector_A**2, axis=1))
-    magnitude_B = np.sqrt(np.sum(vector_B**2, axis=1))
+def quality_flags(df: pd.DataFrame, max_precision_m: float = None, max_speed_mps: float = None) -> pd.Series:
+    """
+    Flags the points that should not be clustered, checking every row at once:
+        low_precision - precision (meters) above max_precision_m, missing precision passes
+        speed_spike   - the steps into and out of the point are both faster than max_speed_mps, while going
+                        straight from the previous to the next point is not: a jump away and back. Fast travel
+                        (e.g. a flight) passes, since skipping the point is just as fast
+    Duplicate timestamps are not flagged, combine_all_data already keeps one row per (tile_uuid, location_timestamp)
 
-    # Calculate direction similarity
-    direction_similarity = np.divide(dot_product,
-                                     (magnitude_A * magnitude_B),
-                                     out = np.zeros_like(dot_product, dtype=float), # Output array for results
-                                     where = (magnitude_A * magnitude_B) != 0) # handle division by 0
-    
-    return pd.Series(direction_similarity, index=df.index)
+    Parameters
+    ----------
+    df : pd.DataFrame
+        points ordered by tile then time, contains ['location_timestamp','latitude','longitude','precision'],
+        optionally 'tile_uuid' and 'speed_mps' (computed with trajectory_kinematics when missing)
+    max_precision_m : float [optional]
+        precision threshold in meters, None skips the check
+    max_speed_mps : float [optional]
+        speed threshold in meters per second, None skips the check
 
+    Returns
+    -------
+    flags : pd.Series
+        categorical series with one of QUALITY_FLAGS per row
+    """
+    n = len(df)
+    codes = np.zeros(n, dtype=np.int8)
+    if n == 0: # e.g. a tile without any locations yet
+        return pd.Series(pd.Categorical.from_codes(codes, categories=QUALITY_FLAGS), index=df.index, name='quality_flag')
+    group = pd.factorize(df['tile_uuid'])[0] if 'tile_uuid' in df.columns else np.zeros(n, dtype=np.int64)
+
+    if max_speed_mps is not None:
+        if 'speed_mps' in df.columns:
+            speed = df['speed_mps'].to_numpy(dtype=np.float64)
+        else:
+            speed = trajectory_kinematics(df['latitude'].values, df['longitude'].values,
+                                          timestamp=df['location_timestamp'].values, group=group)['speed_mps']
+        # speed of the step out of a point is the speed of the next row, within the same tile
+        speed_out = np.full(n, np.nan)
+        speed_out[:-1] = np.where(group[1:] == group[:-1], speed[1:], np.nan)
+        # speed from the previous straight to the next point, within the same tile
+        latitude, longitude = df['latitude'].to_numpy(), df['longitude'].to_numpy()
+        speed_skip = np.full(n, np.nan)
+        if n > 2:
+            elapsed_skip = (df['location_timestamp'].values[2:] - df['location_timestamp'].values[:-2]) / 1000
+            with np.errstate(divide='ignore', invalid='ignore'):
+                speed_skip[1:-1] = np.where(group[2:] == group[:-2],
+                                            haversine_m(latitude[:-2], longitude[:-2], latitude[2:], longitude[2:]) / elapsed_skip,
+                                            np.nan)
+        spike = (speed > max_speed_mps) & (speed_out > max_speed_mps) & ~(speed_skip > max_speed_mps) # NaN compares False
+        codes[spike] = 2
+
+    if max_precision_m is not None:
+        codes[df['precision'].to_numpy(dtype=np.float64) > max_precision_m] = 1
+
+    return pd.Series(pd.Categorical.from_codes(codes, categories=QUALITY_FLAGS), index=df.index, name='quality_flag')
 
 def reduce_clusters(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -213,3 +823,47 @@ def reduce_clusters(df: pd.DataFrame) -> pd.DataFrame:
 
     cluster_labels = cdf['cluster_label']
     return cluster_labels
+
+def cluster_summary(df: pd.DataFrame, labels: np.ndarray = None) -> pd.DataFrame:
+    """
+    Per-cluster statistics in a single grouped pass over the points, so later stages can read them instead
+    of scanning the points again
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        one tile's points ordered by time, contains ['location_timestamp','latitude','longitude'], plus
+        'cluster_label' unless labels is given and optionally 'direction_similarity'
+    labels : np.ndarray [optional]
+        cluster label of every row of df, defaults to df['cluster_label']
+
+    Returns
+    -------
+    summary : pd.DataFrame
+        one row per label (noise and transit included), in order of first appearance, contains
+        ['cluster_label','centroid_latitude','centroid_longitude','count','first_seen','last_seen',
+        'last_latitude','last_longitude','dwell_s','mean_direction_similarity','min_latitude','max_latitude',
+        'min_longitude','max_longitude','extent_m']. first_seen/last_seen are location_timestamps (ms),
+        dwell_s is the time spent between consecutive points of the cluster and extent_m is the diagonal of
+        the bounding box
+    """
+    labels = df['cluster_label'].to_numpy() if labels is None else np.asarray(labels)
+    timestamp = df['location_timestamp'].to_numpy(dtype=np.int64)
+    dwell = np.zeros(len(df))
+    dwell[1:] = np.where(labels[1:] == labels[:-1], np.diff(timestamp) / 1000, 0.0)
+    direction_similarity = (df['direction_similarity'].to_numpy() if 'direction_similarity' in df.columns
+                            else np.full(len(df), np.nan))
+    points = pd.DataFrame({'cluster_label': labels, 'location_timestamp': timestamp,
+                           'latitude': df['latitude'].to_numpy(), 'longitude': df['longitude'].to_numpy(),
+                           'dwell_s': dwell, 'direction_similarity': direction_similarity})
+
+    summary = points.groupby('cluster_label', sort=False).agg(
+        centroid_latitude=('latitude', 'mean'), centroid_longitude=('longitude', 'mean'),
+        count=('latitude', 'size'), first_seen=('location_timestamp', 'min'), last_seen=('location_timestamp', 'max'),
+        last_latitude=('latitude', 'last'), last_longitude=('longitude', 'last'), dwell_s=('dwell_s', 'sum'),
+        mean_direction_similarity=('direction_similarity', 'mean'),
+        min_latitude=('latitude', 'min'), max_latitude=('latitude', 'max'),
+        min_longitude=('longitude', 'min'), max_longitude=('longitude', 'max'))
+    summary['extent_m'] = haversine_m(summary['min_latitude'].values, summary['min_longitude'].values,
+                                      summary['max_latitude'].values, summary['max_longitude'].values)
+    return summary.reset_index()
@@ -0,0 +1,112 @@
+# Native Imports
+from datetime import datetime, timedelta
+from pathlib import Path
+import json
+
+
+class WatermarkStore():
+    """
+    Class to keep track of the last location_timestamp ingested for every tile so that the nightly
+    extraction only requests the new window of history instead of the whole trip
+
+    Attributes
+    ----------
+    path : pathlib.Path
+        location of the json file holding the watermarks
+    watermarks : dict
+        dict containing {tile_uuid: last location_timestamp (ms since epoch)}
+    default_start : datetime
+        start of the history window for tiles that have no watermark yet
+    overlap : timedelta
+        how far before the watermark to start the next window, catches late updates from Tile
+
+    Methods
+    -------
+    load()
+        read the watermarks from disk
+    save()
+        write the watermarks to disk
+    get_start(tile_uuid)
+        start of the next history window for a tile
+    advance(tile_uuid, location_timestamp)
+        advance the watermark for a tile to a location_timestamp
+    """
+    def __init__(self, path: str, default_start: datetime = datetime(2024, 10, 1, 0, 0, 0),
+                 overlap: timedelta = timedelta(days=1)):
+        """
+        Initialize WatermarkStore
+
+        Parameters
+        -----------
+        path : str
+            file path of the json file holding the watermarks, created on first save
+        default_start : datetime [optional]
+            start of the history window for tiles that have no watermark yet
+        overlap : timedelta [optional]
+            how far before the watermark to start the next window
+
+        Returns
+        -----------
+        None
+        """
+        self.path = Path(path)
+        self.default_start = default_start
+        self.overlap = overlap
+        self.watermarks = self.load()
+
+    def load(self) -> dict:
+        """
+        Read the watermarks from disk, returns an empty dict if nothing has been saved yet
+        """
+        if not self.path.exists():
+            return {}
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def save(self) -> None:
+        """
+        Write the watermarks to disk. Writes to a temporary file first so a crash can't leave a corrupt store
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.watermarks, f, indent=2)
+        tmp_path.replace(self.path)
+
+    def get_start(self, tile_uuid: str) -> datetime:
+        """
+        Start of the next history window for a tile
+
+        Parameters
+        -----------
+        tile_uuid : str
+            unique ID for the tile
+
+        Returns
+        -----------
+        start : datetime
+            watermark minus the overlap, or default_start if the tile has never been ingested
+        """
+        if tile_uuid not in self.watermarks:
+            return self.default_start
+        start = datetime.fromtimestamp(self.watermarks[tile_uuid] / 1000) - self.overlap
+        return max(start, self.default_start)
+
+    def advance(self, tile_uuid: str, location_timestamp: int) -> None:
+        """
+        Advance the watermark for a tile to a location_timestamp, never moves backwards
+
+        Parameters
+        -----------
+        tile_uuid : str
+            unique ID for the tile
+        location_timestamp : int
+            latest location_timestamp ingested (ms since epoch), None leaves the watermark unchanged
+
+        Returns
+        -----------
+        None
+        """
+        if location_timestamp is None:
+            return
+        self.watermarks[tile_uuid] = max(location_timestamp, self.watermarks.get(tile_uuid, 0))
@@ -29,7 +29,7 @@ class Weather_API():
         Parameters
         ------------
         df : pd.DataFrame
-            dataframe containing date, latitude, and longitude
+            dataframe containing date, hour, latitude, and longitude
 
         Returns
         -----------
@@ -45,6 +45,7 @@ class Weather_API():
             if i%10 == 0:
                 print(f"{100*(i/total_len):.1f}% Complete")
             date, lat, lon = row.values
+            date = date.strftime('%Y-%m-%d')
             params = {
                 "latitude": lat,
                 "longitude": lon,
@@ -139,7 +140,7 @@ class Weather_API():
         Parameters
         ------------
         df : pd.DataFrame
-            original dataframe containig date, latitude, and longitude
+            original dataframe containig date, hour, latitude, and longitude
 
         Returns
         -----------
@@ -148,8 +149,8 @@ class Weather_API():
         """
         # Make column to merge on
         cdf = df.copy()
-        cdf.loc[:,'hour'] = pd.to_datetime(cdf['time'], format="%H:%M:%S").dt.hour
-        cdf.loc[:,'weather_hour'] = pd.to_datetime(cdf['date'].astype(str) + ' ' + cdf['hour'].astype(str), format="%Y-%m-%d %H")
+        weather_hour = pd.to_datetime(cdf['date']) + pd.to_timedelta(cdf['hour'].astype(np.int64), unit='h')
+        cdf.loc[:,'weather_hour'] = weather_hour.astype(self.hourly_df['date_hour'].dtype)
 
         # Merge with hourly weather data
         cdf = pd.merge(cdf, self.hourly_df, how='left', left_on='weather_hour', right_on='date_hour', suffixes=[None,'_right'])
@@ -157,7 +158,7 @@ class Weather_API():
         # Remove and Organize columns
         remove_cols = ['date_hour', 'datetime','hour'] + [col for col in cdf if '_right' in col.lower()]
         cdf = cdf.drop(columns=remove_cols)
-        col_order = ['date','time','weather_hour','latitude','longitude']
+        col_order = ['date','weather_hour','latitude','longitude']
         col_order = col_order + [col for col in cdf.columns if col not in col_order]
         cdf = cdf[col_order]
         return cdf
\ No newline at end of file
@@ -5,11 +5,18 @@ from pytile import async_login
 from dotenv import load_dotenv
 
 # Native Imports
-from datetime import datetime
-import json
+from datetime import datetime, timedelta
 import os
 
+# Custom Imports
+from data_utils.watermarks import WatermarkStore
+from data_utils.tile_api import HistoryFetcher
+from data_utils.raw_store import RawWriter
+
 RAWDATAPATH = '/opt/data/raw/'
+STATEPATH = '/opt/data/state/'
+MAX_CONCURRENT_REQUESTS = 4 # requests to Tile in flight at once
+WINDOW_MONTHS = 1 # size of the date windows each tile's history is split into
 load_dotenv()
 email = os.getenv("TILE_EMAIL")
 pwd = os.getenv("TILE_PWD")
@@ -23,7 +30,8 @@ pwd = os.getenv("TILE_PWD")
 #     }
 async def main(email: str, pwd: str) -> None:
     """
-    Function to request and save data from Tile
+    Function to request and save data from Tile. Location updates are streamed to the raw folder as each
+    response arrives, partitioned by tile uuid and date ('raw/<tile_uuid>/<YYYY-MM-DD>.jsonl.gz')
 
     Parameters
     -----------
@@ -34,6 +42,9 @@ async def main(email: str, pwd: str) -> None:
     -----------
         None
     """
+    # Last location_timestamp ingested per tile, so only the new window is requested
+    watermarks = WatermarkStore(STATEPATH + 'tile_watermarks.json')
+
     # Open client to request data
     async with ClientSession() as session:
         # login
@@ -44,15 +55,22 @@ async def main(email: str, pwd: str) -> None:
 
         # handle and save data from request return
         print("Collecting Data...")
-        tile_history = {}
-        for tile_uuid, tile in tiles.items():
-            start = datetime(2024, 10, 1, 0, 0, 0)
-            end = datetime.today()
-            history = await tile.async_history(start, end)
-            tile_history[tile_uuid] = history
-        
-        print("Saving Data...")
-        with open(RAWDATAPATH + f'data_{datetime.now().date()}.json', 'w') as f:
-            json.dump(tile_history, f)
-        print(f"Data successfully saved to 'raw/data_{datetime.now().date()}.json'")
+        # end at midnight tonight so the windows (and their checkpoints) are the same for any rerun today
+        end = datetime.combine(datetime.today().date() + timedelta(days=1), datetime.min.time())
+        starts = {tile_uuid: watermarks.get_start(tile_uuid) for tile_uuid in tiles}
+        writer = RawWriter(RAWDATAPATH)
+        fetcher = HistoryFetcher(writer=writer,
+                                 checkpoint_dir=STATEPATH + f'checkpoint_{datetime.now().date()}/',
+                                 max_concurrency=MAX_CONCURRENT_REQUESTS,
+                                 window_months=WINDOW_MONTHS)
+        latest_timestamps = await fetcher.fetch_all(tiles, starts, end)
+        for tile_uuid, count in writer.counts.items():
+            print(f"{tile_uuid}: saved {count} location updates to '{RAWDATAPATH + tile_uuid}/'")
+
+        # Only advance the watermarks once the raw data is safely on disk
+        for tile_uuid, latest_timestamp in latest_timestamps.items():
+            watermarks.advance(tile_uuid, latest_timestamp)
+        watermarks.save()
+        print(f"Watermarks saved to '{watermarks.path}'")
+        fetcher.clear_checkpoints()
 asyncio.run(main(email, pwd))
\ No newline at end of file
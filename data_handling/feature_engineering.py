@@ -3,15 +3,28 @@ import pandas as pd
 
 # Native Imports
 import time
-import pickle
 
 # Custom Imports
-from data_utils.utils import combine_data, add_bearing_column, add_direction_similarity, cluster_data, reduce_clusters
+from data_utils.utils import combine_all_data, reduce_clusters, cluster_summary, quality_flags
+from data_utils.feature_store import FeatureStore
+from data_utils.cluster_index import IncrementalClusterer, StayPointClusterer
+from data_utils.cluster_artifact import ClusterArtifact
+from data_utils.cluster_registry import ClusterRegistry
 
 # Variables
 RAWDATAPATH = '/opt/data/raw/'
 STAGEDATAPATH = '/opt/data/staged/'
 TEMPPATH = '/opt/data/temp/'
+N_WORKERS = 4 # processes used to parse the raw files
+MAX_GAP_SECONDS = 6 * 3600 # steps across a longer gap between updates get no bearing/direction/speed
+REFIT_DAYS = 7 # full HDBSCAN re-fit at least this often, new points are assigned to existing clusters otherwise
+REFIT_PENDING_POINTS = 500 # ...or once this many assigned points did not fit any cluster
+GRID_METERS = 10 # points are snapped to cells this size and de-duplicated before HDBSCAN
+PARTITION_DEGREES = 1.0 # HDBSCAN is fit separately (in N_WORKERS processes) on partitions this size
+CLUSTER_METRIC = 'chord' # same neighbours as haversine, but lets HDBSCAN use a kd-tree
+MAX_PRECISION_METERS = 100 # points reported with a worse precision are not clustered
+MAX_SPEED_MPS = 100 # ...nor points reached and left faster than this (GPS jumps)
+CLUSTER_ENGINE = 'hdbscan' # or 'stay_points': single pass over the trajectory, labels stays and transit (-3) directly
 tilenames = { # From pytile
     '0287c8181aa557e7': 'Maya', # On Maya's Camera
     '02df4813aa180c3a': "Maya's Backpack",
@@ -25,34 +38,52 @@ tile_name = "John"
 tile_uuid = tilenames_reverse[tile_name]
 
 if __name__ == "__main__":
-    # Start from Raw Data
+    # Start from Raw Data -- every tile is combined in one pass over the raw files
     print("Combining raw data...")
     start = time.time()
-    df = combine_data(datapath=RAWDATAPATH, tile_uuid=tile_uuid, tile_name=tile_name)
+    df_all = combine_all_data(datapath=RAWDATAPATH, tilenames=tilenames, statepath=STAGEDATAPATH,
+                              n_workers=N_WORKERS)
     print("Data successfully combined.")
     print(f"Took {time.time() - start:.3f} seconds")
-    
-    # Add Bearing (DEPRECATED - column no longer used, but could be useful for visualizations)
-    print('Adding bearing column...')
-    start = time.time()
-    df['bearing'] = add_bearing_column(df[['latitude','longitude']])
-    print('Data successfully added.')
-    print(f"Took {time.time() - start:.3f} seconds")
+    for name, count in df_all['tile_name'].value_counts().items():
+        print(f"{name}: {count} locations")
 
-    # Add Direction Similarity
-    print('Adding direction similarity column...')
+    # Add step kinematics -- bearing, direction similarity, step distance, elapsed time and speed.
+    # Only points appended since the last run are computed, the trailing points of each tile are persisted
+    print('Adding kinematics columns...')
     start = time.time()
-    df['direction_similarity'] = add_direction_similarity(df[['latitude','longitude']])
+    feature_store = FeatureStore(STAGEDATAPATH + 'features/', max_gap_s=MAX_GAP_SECONDS)
+    feature_store.update(df_all)
     print('Data successfully added.')
     print(f"Took {time.time() - start:.3f} seconds")
 
+    # Clusters are built for the tile carried daily, on its full history: only its own feature parts are
+    # read back, but that read still grows with the length of the history
+    df = feature_store.load(df_all, tile_uuids=[tile_uuid])
+
+    # Flag low precision fixes and GPS jumps, flagged points are labelled outliers (-1)
+    df['quality_flag'] = quality_flags(df, max_precision_m=MAX_PRECISION_METERS, max_speed_mps=MAX_SPEED_MPS)
+    keep = (df['quality_flag'] == 'ok').values
+    for flag, count in df['quality_flag'].value_counts().items():
+        print(f"{flag}: {count} locations ({100 * count / max(len(df), 1):.1f}%)")
+
     testing = True # flag for making debugging easier
     if testing:
-        # Cluster Data using HDBSCAN
+        # Cluster Data using HDBSCAN -- full re-fit when due, otherwise new points are assigned to existing clusters.
+        # The stay_points engine only passes over the points since the last open visit
         print('Clustering data...')
         start = time.time()
-        db, df['cluster_label'] = cluster_data(df[['latitude','longitude']])
-        print('Data successfully clustered.')
+        if CLUSTER_ENGINE == 'stay_points':
+            clusterer = StayPointClusterer(STAGEDATAPATH + 'stay_points/')
+        else:
+            clusterer = IncrementalClusterer(STAGEDATAPATH + 'clusters/', refit_days=REFIT_DAYS,
+                                             refit_pending=REFIT_PENDING_POINTS, grid_m=GRID_METERS,
+                                             partition_deg=PARTITION_DEGREES, n_workers=N_WORKERS,
+                                             metric=CLUSTER_METRIC)
+        db, labels, pending = clusterer.label(df.loc[keep, ['location_timestamp','latitude','longitude']].reset_index(drop=True))
+        df['cluster_label'], df['cluster_pending'] = -1, False
+        df.loc[keep, 'cluster_label'], df.loc[keep, 'cluster_pending'] = labels, pending
+        print('Data successfully clustered.' if db is not None else 'New points successfully assigned.')
         print(f"Took {time.time() - start:.3f} seconds")
 
         # Reduce clusters by labelling some as transit (-3) using direction similarity
@@ -63,10 +94,19 @@ if __name__ == "__main__":
         print(f"reduced clusters by {prev_len - df['cluster_label'].nunique()} from {prev_len} to {df['cluster_label'].nunique()}")
         print(f"Took {time.time() - start:.3f} seconds")
 
-        # Save HDBSCAN model
-        with open(TEMPPATH + f"temp_hdbscan.pkl",'wb+') as f:
-            pickle.dump(db, f)
-        print(f"Successfully saved model: '{TEMPPATH + 'temp_hdbscan.pkl'}'")
+        # Per-cluster statistics for the later stages, so they don't have to scan the points again.
+        # Clusters are matched to the places of earlier runs, so unchanged places keep their place_id (and
+        # their geocoding) when a re-fit renumbers the clusters
+        summary = cluster_summary(df)
+        places = ClusterRegistry(STAGEDATAPATH + 'cluster_registry/').update(summary)
+        summary['place_id'], summary['place_status'] = places['place_id'].values, places['place_status'].values
+        df['place_id'] = df['cluster_label'].map(dict(zip(places['cluster_label'], places['place_id'])))
+        summary.to_parquet(TEMPPATH + 'cluster_summary.parquet', index=False)
+        print(TEMPPATH + 'cluster_summary.parquet')
+
+        # Save the clusters (centroids, radii, counts, first/last seen, exemplars) instead of the HDBSCAN model
+        ClusterArtifact(TEMPPATH + 'cluster_artifact/').write(df, df['cluster_label'].values)
+        print(f"Successfully saved clusters: '{TEMPPATH + 'cluster_artifact/'}'")
 
         # Save df to parquet
         df.to_parquet(TEMPPATH + 'feature_engineering.parquet', index=False)
@@ -21,7 +21,7 @@ if __name__ == '__main__':
         print("Getting weather data from Open-Meteo...")
         start = time.time()
         weather_api = Weather_API()
-        weather_api.get_weather(df[['date','time','latitude','longitude']])
+        weather_api.get_weather(df[['date','hour','latitude','longitude']])
         print('Weather data successfully retrieved.')
         print(f"Took {time.time() - start:.3f} seconds")
 
@@ -1,33 +1,91 @@
 # Third Party Imports
 import pandas as pd
+import numpy as np
 
 # Native Imports
 import time
 import json
+import os
 
 # Custom Imports
 from data_utils.geocoder import Geocoder
+from data_utils.geocode_cache import GeocodeCache
+from data_utils.gazetteer import Gazetteer
+from data_utils.utils import haversine_m
 
 # Variables
 TEMPPATH = '/opt/data/temp/'
+STATEPATH = '/opt/data/state/'
+CACHE_RADIUS_METERS = 50 # a cluster centroid this close to an already geocoded point is served from the cache
+CACHE_TTL_DAYS = 180 # cached responses older than this are requested again
+N_WORKERS = 8 # requests in flight at once, throughput is capped by the rate limiter in Geocoder
+CHECKPOINT = TEMPPATH + 'geocode_checkpoint.jsonl' # responses received so far, survives a crash mid-run
+PLACE_RESULTS = STATEPATH + 'place_geocode_results.json' # {place_id: {latitude, longitude, response}}, kept across runs
+PLACE_CHANGE_METERS = 25 # a place whose centroid moved more than this since it was geocoded is geocoded again, as ClusterRegistry's change_m
+GAZETTEERPATH = STATEPATH + 'gazetteer/' # built by build_gazetteer.py, without it every cluster goes to the API
+COARSE_DWELL_SECONDS = None # opt-in: clusters visited for less than this only get locality/region/country (no tags,
+                            # place_ids or addresses), answered offline. None geocodes every cluster in full
 
 if __name__ == '__main__':
     # Load Data
-    df = pd.read_parquet(TEMPPATH + 'feature_engineering.parquet')
+    # centroids come from the cluster summary written by feature_engineering, no need to scan every point
+    df = pd.read_parquet(TEMPPATH + 'cluster_summary.parquet')
 
     # request reverse geocode information from googlemaps api
     # *** Must have Google Cloud SDK Shell running and authenticated ***
-    geocoder = Geocoder()
+    cache = GeocodeCache(STATEPATH + 'geocode_cache.sqlite', radius_m=CACHE_RADIUS_METERS, ttl_days=CACHE_TTL_DAYS)
+    local = Gazetteer(GAZETTEERPATH) if Gazetteer.exists(GAZETTEERPATH) else None
+    geocoder = Geocoder(cache=cache, local=local)
     geocoder.check_state()
     print(f"Requestion reverse geocoding from GoogleMaps API...")
     start = time.time()
-    geocode_results = geocoder.geocode_clusters(df[['cluster_label','latitude','longitude']])
+    # only new or moved places (see ClusterRegistry) and the special labels are geocoded, the rest reuse the
+    # response stored for their place_id
+    place_results = {}
+    if os.path.exists(PLACE_RESULTS):
+        with open(PLACE_RESULTS, 'r') as f:
+            place_results = json.load(f)
+        # responses stored without the centroid they were requested at can't be checked, they are requested again
+        place_results = {place_id: result for place_id, result in place_results.items() if isinstance(result, dict)}
+    # the special labels (and short visits, when COARSE_DWELL_SECONDS is set) only need coarse address fields,
+    # the local gazetteer answers them (when built) on every run, so they are never stored per place
+    coarse = (df['cluster_label'] < 0).values
+    if COARSE_DWELL_SECONDS is not None:
+        coarse |= (df['dwell_s'] < COARSE_DWELL_SECONDS).values
+    if local is None:
+        coarse = np.zeros(len(df), dtype=bool)
+    # the registry moves a place's centroid as soon as it changes, so the response is checked against the
+    # centroid it was requested at: a place that changed while its geocoding failed is still requested again
+    stored = [place_results.get(str(place_id)) for place_id in df['place_id']]
+    stored_latitude = np.array([np.nan if result is None else result['latitude'] for result in stored])
+    stored_longitude = np.array([np.nan if result is None else result['longitude'] for result in stored])
+    drift = haversine_m(df['centroid_latitude'].values, df['centroid_longitude'].values, stored_latitude, stored_longitude)
+    stale = (coarse | (df['cluster_label'] < 0) | (df['place_status'] != 'unchanged')
+             | ~(drift <= PLACE_CHANGE_METERS)).values
+    print(f"{(~stale).sum()} unchanged places reuse their geocoding, {stale.sum()} clusters to geocode")
+    new_results = geocoder.geocode_clusters(df.loc[stale, ['cluster_label','centroid_latitude','centroid_longitude']],
+                                            n_workers=N_WORKERS, checkpoint_path=CHECKPOINT, coarse=coarse[stale])
+    for _, row in df.loc[stale & ~coarse & (df['cluster_label'] >= 0).values].iterrows():
+        place_results[str(row['place_id'])] = {'latitude': float(row['centroid_latitude']),
+                                               'longitude': float(row['centroid_longitude']),
+                                               'response': new_results[str(row['cluster_label'])]}
+    with open(PLACE_RESULTS + '.tmp', 'w') as f:
+        json.dump(place_results, f)
+    os.replace(PLACE_RESULTS + '.tmp', PLACE_RESULTS)
+
+    # downstream tables are still keyed by this run's cluster_label
+    geocode_results = {str(cluster_label): new_results[str(cluster_label)] if str(cluster_label) in new_results else place_results[str(place_id)]['response']
+                       for cluster_label, place_id in zip(df['cluster_label'], df['place_id'])}
+    geocoder.geocode_results, geocoder.df = geocode_results, df[['cluster_label']]
     print("Done.")
     print(f"Took {time.time() - start:.3f} seconds") 
 
     # Save Result immediately so we dont have to do it again
     with open(TEMPPATH + 'geocode_results.json','w+') as f:
         json.dump(geocode_results, f)
+    # every response is in the results file now
+    if os.path.exists(CHECKPOINT):
+        os.remove(CHECKPOINT)
     print(f"Successfully saved geocoding data: 'geocode_results.json'")
 
     print("Processing geocode results...")
@@ -0,0 +1,6 @@
+# Native Imports
+from pathlib import Path
+import sys
+
+# the pipeline scripts import data_utils from data_handling/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,66 @@
+# Third Party Imports
+import pandas as pd
+import numpy as np
+import pytest
+
+# Native Imports
+import json
+
+# Custom Imports
+from data_utils.cluster_index import IncrementalClusterer
+
+
+def visits(n=60, seed=0):
+    """
+    A tile parked at two places: every fix at the first identical (core distance 0), the second scattered
+    within ~10 m
+    """
+    rng = np.random.default_rng(seed)
+    centres = np.repeat([[52.3700, 4.8900], [52.3800, 4.9100]], n // 2, axis=0)
+    noise = rng.normal(0, 0.00005, centres.shape)
+    noise[:n // 2] = 0
+    coords = centres + noise
+    return pd.DataFrame({'location_timestamp': np.arange(n, dtype=np.int64) * 60_000,
+                         'latitude': coords[:, 0], 'longitude': coords[:, 1]})
+
+
+@pytest.mark.parametrize('metric', ['haversine', 'chord'])
+def test_assign_duplicates(tmp_path, metric):
+    clusterer = IncrementalClusterer(tmp_path, metric=metric)
+    _, labels = clusterer.fit(visits())
+    assert (labels >= 0).all()
+    # the exact spot of the duplicates, and a few meters off it, join the place
+    new = np.deg2rad([[52.3700, 4.8900], [52.37003, 4.89003], [52.3800, 4.9100]])
+    assigned = clusterer.assign(new)
+    assert assigned.tolist() == [labels[0], labels[0], labels[-1]]
+    # far from every member stays pending
+    assert clusterer.assign(np.deg2rad([[52.40, 4.95]])).tolist() == [-1]
+
+
+def test_label_new_points(tmp_path):
+    df = visits()
+    clusterer = IncrementalClusterer(tmp_path)
+    _, labels, _ = clusterer.label(df)
+    later = pd.DataFrame({'location_timestamp': [df['location_timestamp'].max() + 60_000],
+                          'latitude': [52.3700], 'longitude': [4.8900]})
+    _, new_labels, pending = IncrementalClusterer(tmp_path).label(pd.concat([df, later], ignore_index=True))
+    assert np.array_equal(new_labels[:-1], labels)
+    assert new_labels[-1] == labels[0] and not pending.any()
+    with open(tmp_path / 'meta.json', 'r') as f:
+        assert json.load(f)['pending'] == 0
+    assert not (tmp_path / 'meta.tmp').exists()
+
+
+def test_empty_and_tiny_tiles(tmp_path):
+    empty = visits().iloc[:0]
+    db, labels, pending = IncrementalClusterer(tmp_path / 'empty').label(empty)
+    assert db is None and len(labels) == 0 and len(pending) == 0
+    # the empty index labels every later point pending until the next fit
+    clusterer = IncrementalClusterer(tmp_path / 'empty')
+    assert not clusterer.needs_refit()
+    _, labels, pending = clusterer.label(visits().iloc[:3])
+    assert labels.tolist() == [-1, -1, -1] and pending.all()
+
+    # fewer points than min_cluster_size fit to noise
+    _, labels, pending = IncrementalClusterer(tmp_path / 'tiny').label(visits().iloc[:3])
+    assert labels.tolist() == [-1, -1, -1] and not pending.any()
@@ -0,0 +1,45 @@
+# Third Party Imports
+import pandas as pd
+import numpy as np
+
+# Custom Imports
+from data_utils.cluster_registry import ClusterRegistry
+from data_utils.utils import EARTH_RADIUS_M
+
+
+def summary(labels, centroids, half_m=40):
+    """
+    Cluster summary rows with a square bounding box of half_m around every centroid
+    """
+    centroids = np.asarray(centroids, dtype=np.float64)
+    half_deg = np.degrees(np.asarray(half_m) / EARTH_RADIUS_M)
+    return pd.DataFrame({'cluster_label': labels,
+                         'centroid_latitude': centroids[:, 0], 'centroid_longitude': centroids[:, 1],
+                         'min_latitude': centroids[:, 0] - half_deg, 'max_latitude': centroids[:, 0] + half_deg,
+                         'min_longitude': centroids[:, 1] - half_deg, 'max_longitude': centroids[:, 1] + half_deg,
+                         'count': 10, 'first_seen': 0, 'last_seen': 1})
+
+
+def shifted(latitude, meters):
+    return latitude + np.degrees(meters / EARTH_RADIUS_M)
+
+
+def test_relabelled_clusters_keep_place_ids(tmp_path):
+    first = ClusterRegistry(tmp_path).update(summary([-1, 0, 1], [[0, 0], [52.37, 4.89], [52.38, 4.91]]))
+    assert first['place_id'].tolist() == [-1, 0, 1]
+    assert first['place_status'].tolist() == ['unchanged', 'new', 'new']
+
+    # HDBSCAN swapped the labels, one place drifted by 5 m, the other moved 40 m, and a third place appeared
+    second = ClusterRegistry(tmp_path).update(summary([-1, 0, 1, 2], [[0, 0], [shifted(52.38, 40), 4.91],
+                                                                       [shifted(52.37, 5), 4.89], [52.50, 5.00]]))
+    assert second['place_id'].tolist() == [-1, 1, 0, 2]
+    assert second['place_status'].tolist() == ['unchanged', 'changed', 'unchanged', 'new']
+    assert not (tmp_path / 'places.tmp').exists() and not (tmp_path / 'meta.tmp').exists()
+
+
+def test_split_keeps_place_for_larger_part(tmp_path):
+    ClusterRegistry(tmp_path).update(summary([0], [[52.37, 4.89]], half_m=60))
+    # the place split in two: the part overlapping most of the old box keeps its place_id
+    split = summary([0, 1], [[shifted(52.37, -45), 4.89], [shifted(52.37, 10), 4.89]], half_m=[15, 50])
+    places = ClusterRegistry(tmp_path).update(split)
+    assert places['place_id'].tolist() == [1, 0]
@@ -0,0 +1,69 @@
+# Third Party Imports
+import pandas as pd
+import numpy as np
+
+# Custom Imports
+from data_utils.utils import cluster_data, sweep_clusters
+
+
+def stationary(n, latitude=52.37, longitude=4.89):
+    """
+    n fixes of a tile that didn't move, all in one grid cell
+    """
+    return pd.DataFrame({'latitude': np.full(n, latitude), 'longitude': np.full(n, longitude)})
+
+
+def test_grid_single_cell():
+    # 100 points in one cell reduce to min_cluster_size - 1 rows, too few for HDBSCAN
+    db, labels = cluster_data(stationary(100), grid_m=20)
+    assert len(labels) == 100
+    _, expected = cluster_data(stationary(100))
+    assert np.array_equal(labels, expected)
+
+
+def test_too_few_points():
+    db, labels = cluster_data(stationary(3), grid_m=20)
+    assert db is None
+    assert np.array_equal(labels, [-1, -1, -1])
+
+
+def test_sweep_single_cell():
+    sweep, labels = sweep_clusters(stationary(100), [5, 10], grid_m=20)
+    assert len(sweep) == 4
+    assert all(len(setting_labels) == 100 for setting_labels in labels.values())
+
+
+def test_sweep_too_few_points():
+    sweep, labels = sweep_clusters(stationary(3), [5], grid_m=20)
+    assert sweep['n_clusters'].tolist() == [0, 0]
+    assert all((setting_labels == -1).all() for setting_labels in labels.values())
+
+
+def test_partition_of_identical_points():
+    # a remote partition holding a few identical points reduces to fewer grid rows than min_samples
+    df = pd.concat([stationary(6), stationary(6, latitude=-33.87, longitude=151.21)], ignore_index=True)
+    db, labels = cluster_data(df, grid_m=20, partition_deg=1, n_workers=2)
+    assert len(labels) == 12
+
+
+def test_partition_antimeridian():
+    # one cluster straddling 180 degrees, fit in the partitions on both sides
+    rng = np.random.default_rng(0)
+    longitude = 180 + rng.normal(0, 0.0002, 200)
+    df = pd.DataFrame({'latitude': -17.0 + rng.normal(0, 0.0002, 200),
+                       'longitude': np.where(longitude > 180, longitude - 360, longitude)})
+    _, expected = cluster_data(df)
+    _, labels = cluster_data(df, partition_deg=1)
+    assert np.array_equal(labels >= 0, expected >= 0)
+    assert len(np.unique(labels[labels >= 0])) == len(np.unique(expected[expected >= 0]))
+
+
+def test_sweep_matches_cluster_data():
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame(np.concatenate([rng.normal([52.37, 4.89], 0.0003, (80, 2)),
+                                      rng.normal([52.38, 4.91], 0.0003, (80, 2)),
+                                      rng.uniform([52.3, 4.8], [52.45, 5.0], (20, 2))]),
+                      columns=['latitude', 'longitude'])
+    _, expected = cluster_data(df, min_cluster_size=10)
+    _, labels = sweep_clusters(df, [10], selection_methods=('eom',), min_samples=10)
+    assert np.array_equal(labels[(10, 'eom')], expected)
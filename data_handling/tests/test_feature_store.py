@@ -0,0 +1,77 @@
+# Third Party Imports
+import pandas as pd
+import numpy as np
+
+# Custom Imports
+from data_utils import feature_store
+from data_utils.feature_store import FeatureStore, MAX_PARTS
+
+
+def locations(n=200, seed=0):
+    """
+    Two tiles walking randomly, sorted by tile then time like combine_all_data
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for tile_uuid, tile_name in [('a1', 'keys'), ('b2', 'wallet')]:
+        frames.append(pd.DataFrame({'tile_uuid': tile_uuid, 'tile_name': tile_name,
+                                    'location_timestamp': np.sort(rng.choice(10**9, n, replace=False)).astype(np.int64),
+                                    'latitude': 52.37 + np.cumsum(rng.normal(0, 0.0005, n)),
+                                    'longitude': 4.89 + np.cumsum(rng.normal(0, 0.0005, n))}))
+    df = pd.concat(frames, ignore_index=True)
+    for col in ['tile_uuid', 'tile_name']:
+        df[col] = df[col].astype('category')
+    return df
+
+
+def prefix(df, n):
+    return df.groupby('tile_uuid', observed=True).head(n).reset_index(drop=True)
+
+
+def test_incremental_matches_full(tmp_path):
+    df = locations()
+    store = FeatureStore(tmp_path / 'incremental', max_gap_s=3600)
+    for n in range(10, 201, 5): # more runs than MAX_PARTS, so the parts get compacted
+        new_features = store.update(prefix(df, n))
+    expected = FeatureStore(tmp_path / 'full', max_gap_s=3600).update(df)
+    pd.testing.assert_frame_equal(store.load(df), expected)
+    # update only returns the points computed in the run
+    pd.testing.assert_frame_equal(new_features, expected.groupby('tile_uuid', observed=True).tail(5).reset_index(drop=True))
+    assert len(list((tmp_path / 'incremental' / 'a1').glob('part-*.parquet'))) <= MAX_PARTS
+
+
+def test_load_one_tile(tmp_path):
+    df = locations()
+    store = FeatureStore(tmp_path, max_gap_s=3600)
+    expected = store.update(df)
+    pd.testing.assert_frame_equal(store.load(df, tile_uuids=['b2']),
+                                  expected[expected['tile_uuid'] == 'b2'].reset_index(drop=True))
+    # a tile without stored features comes back empty, with the columns of the others
+    empty = store.load(df, tile_uuids=['c3'])
+    assert empty.empty and list(empty.columns) == list(expected.columns)
+
+
+def test_changed_trailing_point_recomputes(tmp_path):
+    df = locations()
+    store = FeatureStore(tmp_path, max_gap_s=3600)
+    store.update(prefix(df, 100))
+    # same number of points and the same last timestamp, but the last point moved
+    moved = df.copy()
+    last = moved.index[moved['tile_uuid'] == 'a1'][99]
+    moved.loc[last, 'latitude'] += 0.01
+    new_features = store.update(moved)
+    assert (new_features['tile_uuid'] == 'a1').sum() == 200 # recomputed in full
+    expected = FeatureStore(tmp_path / 'full', max_gap_s=3600).update(moved)
+    pd.testing.assert_frame_equal(store.load(moved), expected)
+
+
+def test_interrupted_compaction(tmp_path, monkeypatch):
+    df = locations()
+    store = FeatureStore(tmp_path, max_gap_s=3600)
+    for n in range(10, 10 + 5 * MAX_PARTS, 5):
+        store.update(prefix(df, n))
+    # the merged part is written, the old parts are never removed
+    monkeypatch.setattr(feature_store.Path, 'unlink', lambda self: None)
+    store.update(prefix(df, 10 + 5 * MAX_PARTS))
+    expected = FeatureStore(tmp_path / 'full', max_gap_s=3600).update(prefix(df, 10 + 5 * MAX_PARTS))
+    pd.testing.assert_frame_equal(store.load(df), expected)
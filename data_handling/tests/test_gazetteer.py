@@ -0,0 +1,40 @@
+# Native Imports
+import json
+
+# Custom Imports
+from data_utils.gazetteer import Gazetteer
+
+
+def square(lat1, lon1, lat2, lon2):
+    """
+    GeoJSON ring [longitude, latitude] of a box
+    """
+    return [[lon1, lat1], [lon2, lat1], [lon2, lat2], [lon1, lat2], [lon1, lat1]]
+
+
+def build(tmp_path):
+    countries = {'type': 'FeatureCollection',
+                 'features': [{'properties': {'ISO_A2': 'AA'},
+                               'geometry': {'type': 'Polygon', 'coordinates': [square(0, 0, 10, 10)]}}]}
+    (tmp_path / 'countries.geojson').write_text(json.dumps(countries))
+    (tmp_path / 'cities.txt').write_text('\t'.join(['1', 'Alphaville', 'Alphaville', '', '2.0', '2.0', 'P', 'PPL', 'AA',
+                                                   '', '01', '', '', '', '1000', '', '', 'UTC', '2020-01-01']) + '\n')
+    (tmp_path / 'admin1.txt').write_text('AA.01\tAlpha Region\tAlpha Region\t11\n')
+    (tmp_path / 'country_info.txt').write_text('#ISO\tISO3\tISO-Numeric\tfips\tCountry\nAA\tAAA\t1\tAA\tAlphaland\n')
+    Gazetteer.build(tmp_path / 'gazetteer', tmp_path / 'cities.txt', tmp_path / 'admin1.txt',
+                    tmp_path / 'country_info.txt', tmp_path / 'countries.geojson')
+    return Gazetteer(tmp_path / 'gazetteer')
+
+
+def component_types(response):
+    return [comp['types'][0] for comp in response[0]['address_components']]
+
+
+def test_distance_limits(tmp_path):
+    gazetteer = build(tmp_path)
+    # ~6 km from Alphaville: locality, region and country
+    assert component_types(gazetteer.reverse_geocode(2.05, 2.03)) == ['locality', 'administrative_area_level_1', 'country']
+    # ~60 km: too far for the locality, still within the region limit
+    assert component_types(gazetteer.reverse_geocode(2.4, 2.4)) == ['administrative_area_level_1', 'country']
+    # ~600 km: the nearest place says nothing about the region
+    assert component_types(gazetteer.reverse_geocode(6.0, 6.0)) == ['country']
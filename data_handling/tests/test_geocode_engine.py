@@ -0,0 +1,63 @@
+# Third Party Imports
+import googlemaps
+import numpy as np
+import pytest
+
+# Native Imports
+from pathlib import Path
+import sys
+
+# Custom Imports
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'benchmarks'))
+from data_utils.geocode_engine import TokenBucket, geocode_concurrent, load_checkpoint
+from stub_geocode_server import StubGeocodeServer, make_response
+
+
+@pytest.fixture
+def server():
+    server = StubGeocodeServer(latency_s=0.01, queries_per_second=20)
+    server.start()
+    yield server
+    server.shutdown()
+
+
+def coordinates(n=30):
+    rng = np.random.default_rng(0)
+    # rounded, the client sends latlng with 8 decimals
+    return {str(i): (round(float(lat), 5), round(float(lon), 5))
+            for i, (lat, lon) in enumerate(rng.uniform([-60, -180], [60, 180], (n, 2)))}
+
+
+def client(server):
+    return googlemaps.Client(key='AIzaStubKey', base_url=server.base_url, retry_over_query_limit=False)
+
+
+def test_quota_refusals_are_retried(server):
+    # a limiter at 3x the quota gets refused, the backoff still recovers every response
+    results = geocode_concurrent(client(server), coordinates(), TokenBucket(rate=60), n_workers=8)
+    assert server.n_refused > 0
+    assert results == {label: make_response(lat, lon) for label, (lat, lon) in coordinates().items()}
+
+
+def test_resume_from_checkpoint(server, tmp_path):
+    checkpoint_path = str(tmp_path / 'checkpoint.jsonl')
+
+    def interrupt(cluster_label, lat, lon, response):
+        if len(load_checkpoint(checkpoint_path)) >= 10:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        geocode_concurrent(client(server), coordinates(), TokenBucket(rate=19), n_workers=4,
+                           checkpoint_path=checkpoint_path, on_result=interrupt)
+    saved = load_checkpoint(checkpoint_path)
+    assert len(saved) >= 10
+
+    server.n_requests, server.n_refused = 0, 0
+    stored = {}
+    results = geocode_concurrent(client(server), coordinates(), TokenBucket(rate=19), n_workers=4,
+                                 checkpoint_path=checkpoint_path,
+                                 on_result=lambda label, lat, lon, response: stored.__setitem__(label, response))
+    assert results == {label: make_response(lat, lon) for label, (lat, lon) in coordinates().items()}
+    # only the missing responses are requested, the recovered ones still reach on_result (e.g. the cache)
+    assert server.n_requests - server.n_refused == len(coordinates()) - len(saved)
+    assert stored == results
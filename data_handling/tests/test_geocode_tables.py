@@ -0,0 +1,51 @@
+# Third Party Imports
+import pandas as pd
+import numpy as np
+
+# Custom Imports
+from data_utils.geocode_tables import flatten_responses, group_mode
+
+
+def response(rng, street):
+    """
+    Google-shaped response with a precise result first and a few approximate ones
+    """
+    results = [{'geometry': {'location_type': 'ROOFTOP'}, 'formatted_address': f"{street} 1, Zürich",
+                'place_id': f"p-{street}", 'types': ['street_address'],
+                'address_components': [{'long_name': '1', 'types': ['street_number']},
+                                       {'long_name': street, 'types': ['route']},
+                                       {'long_name': 'Zürich', 'types': ['locality', 'political']}]}]
+    for i in range(rng.integers(0, 3)):
+        results.append({'geometry': {'location_type': 'APPROXIMATE'}, 'place_id': f"a-{street}-{i}",
+                        'types': ['political', 'sublocality'] if i % 2 else None})
+    return results
+
+
+def test_flatten_responses():
+    rng = np.random.default_rng(0)
+    geocode_results = {str(label): response(rng, street) for label, street in
+                       enumerate(['Bahnhofstrasse', 'Limmatquai', 'Seefeldstrasse'])}
+    geocode_results['-1'] = []
+    tables = flatten_responses(geocode_results)
+
+    # the nested loops flatten_responses replaces
+    results, types, components = [], [], []
+    for key, items in geocode_results.items():
+        for i, item in enumerate(items):
+            results.append((key, item['geometry']['location_type'], item.get('formatted_address'), item.get('place_id')))
+            types.extend((len(results) - 1, tag) for tag in item.get('types') or [])
+            if i == 0:
+                components.extend((key, comp['types'][0], comp['long_name']) for comp in item['address_components'])
+
+    assert tables['results']['result_id'].tolist() == list(range(len(results)))
+    assert list(tables['results'][['cluster_key', 'location_type', 'formatted_address', 'place_id']]
+                .itertuples(index=False, name=None)) == results
+    assert list(tables['types'].itertuples(index=False, name=None)) == types
+    assert list(tables['components'].itertuples(index=False, name=None)) == components
+
+
+def test_group_mode():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'cluster_label': rng.integers(0, 50, 2000), 'tag': rng.choice(list('abcde'), 2000)})
+    expected = df.groupby('cluster_label')['tag'].apply(lambda tags: tags.mode().iloc[-1]) # ties to the largest value
+    pd.testing.assert_series_equal(group_mode(df, 'cluster_label', 'tag').sort_index(), expected, check_names=False)
@@ -0,0 +1,20 @@
+# Third Party Imports
+import pandas as pd
+import numpy as np
+
+# Custom Imports
+from data_utils.utils import trajectory_kinematics, add_bearing_column, add_direction_similarity
+
+
+def test_empty_input():
+    kinematics = trajectory_kinematics(np.empty(0), np.empty(0), timestamp=np.empty(0, dtype=np.int64),
+                                       group=np.empty(0, dtype=np.int64), max_gap_s=3600)
+    assert all(len(values) == 0 for values in kinematics.values())
+    empty = pd.DataFrame({'latitude': pd.Series(dtype=np.float64), 'longitude': pd.Series(dtype=np.float64)})
+    assert add_bearing_column(empty).empty
+    assert add_direction_similarity(empty).empty
+
+
+def test_single_point():
+    kinematics = trajectory_kinematics(np.array([52.37]), np.array([4.89]), timestamp=np.array([0]))
+    assert all(np.isnan(values).all() and len(values) == 1 for values in kinematics.values())
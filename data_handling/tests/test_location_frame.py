@@ -0,0 +1,26 @@
+# Third Party Imports
+import pandas as pd
+import numpy as np
+
+# Native Imports
+import datetime
+import sqlite3
+
+# Custom Imports
+from data_utils.utils import build_location_frame
+
+
+def test_date_is_a_calendar_date():
+    midnight = 1760745600000 # 2025-10-18 00:00:00 UTC
+    columns = {'tile_index': np.zeros(3, dtype=np.int64),
+               'location_timestamp': np.array([midnight - 1, midnight, midnight + 3_600_000], dtype=np.int64),
+               'latitude': np.ones(3), 'longitude': np.ones(3), 'raw_precision': np.ones(3), 'precision': np.ones(3)}
+    df = build_location_frame(columns, {'a1': 'John'})
+    assert df['date'].tolist() == [datetime.date(2025, 10, 17), datetime.date(2025, 10, 18), datetime.date(2025, 10, 18)]
+    assert df['hour'].tolist() == [23, 0, 1]
+
+    # the dashboard filters dates as strings, the last day of a range must be included
+    with sqlite3.connect(':memory:') as conn:
+        df[['date']].to_sql('tile_data', conn)
+        count = conn.execute("SELECT COUNT(*) FROM tile_data WHERE date BETWEEN '2025-10-11' AND '2025-10-18'").fetchone()[0]
+    assert count == 3
@@ -0,0 +1,26 @@
+# Third Party Imports
+import pandas as pd
+import numpy as np
+
+# Custom Imports
+from data_utils.utils import quality_flags, QUALITY_FLAGS
+
+
+def test_flags_per_tile():
+    # tile a: still, one jump ~11 km away and back. Tile b: a steady flight at ~200 m/s, then a vague fix
+    df = pd.DataFrame({'tile_uuid': ['a'] * 5 + ['b'] * 4,
+                       'location_timestamp': np.array([0, 60, 120, 180, 240, 0, 60, 120, 180]) * 1000,
+                       'latitude': [52.0, 52.0, 52.1, 52.0, 52.0, 40.0, 40.1, 40.2, 40.3],
+                       'longitude': [4.0] * 5 + [-3.0] * 4,
+                       'precision': [5, 5, 5, 5, 5, 5, 5, 5, 500]})
+    flags = quality_flags(df, max_precision_m=100, max_speed_mps=50)
+    assert list(flags.cat.categories) == QUALITY_FLAGS
+    assert flags.tolist() == ['ok', 'ok', 'speed_spike', 'ok', 'ok', 'ok', 'ok', 'ok', 'low_precision']
+
+
+def test_empty_tile():
+    df = pd.DataFrame({'tile_uuid': pd.Series(dtype=object), 'location_timestamp': pd.Series(dtype=np.int64),
+                       'latitude': pd.Series(dtype=np.float64), 'longitude': pd.Series(dtype=np.float64),
+                       'precision': pd.Series(dtype=np.float64)})
+    flags = quality_flags(df, max_precision_m=100, max_speed_mps=50)
+    assert flags.empty and list(flags.cat.categories) == QUALITY_FLAGS
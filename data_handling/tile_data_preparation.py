@@ -3,13 +3,13 @@ import pandas as pd
 
 # Native Imports
 import time
-import pickle
 import json
 
 # Custom Imports
 from data_utils.utils import *
 from data_utils.geocoder import Geocoder
 from data_utils.weather_api import Weather_API
+from data_utils.cluster_artifact import ClusterArtifact
 
 # Variables
 RAWDATAPATH = r'data\raw\\'
@@ -108,10 +108,9 @@ if __name__ == "__main__":
         df.to_csv(STAGEDATAPATH + f'tile_data_{tile_name}.csv')
         print(f"Successfully saved Tile data: 'tile_data_{tile_name}.csv'")
 
-        # Save HDBSCAN model
-        with open(f"models/tile_hdbscan.pkl",'wb+') as f:
-            pickle.dump(db, f)
-        print(f"Successfully saved model: 'tile_hdbscan.pkl'")
+        # Save the clusters instead of the HDBSCAN model
+        ClusterArtifact("models/tile_clusters/").write(df, df['cluster_label'].values)
+        print(f"Successfully saved clusters: 'models/tile_clusters/'")
 
         # Save processed geocode data
         df_tags.to_csv(STAGEDATAPATH + 'tags.csv')
@@ -124,7 +123,7 @@ if __name__ == "__main__":
             print("Getting weather data from Open-Meteo...")
             start = time.time()
             weather_api = Weather_API()
-            weather_api.get_weather(df[['date','time','latitude','longitude']])
+            weather_api.get_weather(df[['date','hour','latitude','longitude']])
             print('Weather data successfully retrieved.')
             print(f"Took {time.time() - start:.3f} seconds")
 